@@ -23,12 +23,19 @@ import argparse
 from aip.functions import toc_fetch
 from aip.functions import toc_list
 from aip.functions import toc_delete
+from aip.functions import toc_catalog
 from aip.functions import page_tree
 from aip.functions import page_list
 from aip.functions import page_fetch
 from aip.functions import page_diff
+from aip.functions import page_query
+from aip.functions import page_search
 from aip.functions import page_purge
 from aip.functions import pdf_summary
+from aip.functions import pdf_batch
+from aip.functions import pdf_preview
+from aip.functions import pdf_print
+from aip.functions import serve
 
 
 
@@ -97,6 +104,51 @@ def parse_filter(parser):
         help = "Filter")
 
 
+def parse_jobs(parser):
+    parser.add_argument(
+        '-j', '--jobs',
+        type = int,
+        metavar = "N",
+        help = "Anzahl paralleler Prozesse (Vorgabe: Anzahl der Prozessoren)")
+
+
+def parse_update(parser):
+    parser.add_argument(
+        '-u', '--update',
+        action = 'store_true',
+        help = "Vorhandene Ausgabe fortschreiben und nur geänderte Seiten neu einlesen")
+
+
+def parse_profile(parser):
+    parser.add_argument(
+        '-p', '--profile',
+        choices = [ 'fast', 'small', 'web' ],
+        default = 'web',
+        help = "Speicherprofil: fast (schnell), small (klein), web (linearisiert, Vorgabe)")
+
+
+def parse_variant(parser):
+    parser.add_argument(
+        '--variant',
+        choices = [ 'tablet', 'phone', 'print', 'mono' ],
+        help = "Bildvariante der Seiten verwenden (verkleinert und neu komprimiert)")
+
+
+def parse_format(parser):
+    parser.add_argument(
+        '--format',
+        choices = [ 'text', 'json', 'jsonl', 'csv' ],
+        default = 'text',
+        help = "Ausgabeformat")
+
+
+def parse_catalog(parser):
+    parser.add_argument(
+        '--catalog',
+        action = 'store_true',
+        help = "Abfrage über den SQLite-Katalog ausführen")
+
+
 def parse_pairs(parser, help):
     parser.add_argument(
         '--pairs',
@@ -105,168 +157,377 @@ def parse_pairs(parser, help):
 
 
 
-parser = argparse.ArgumentParser(
-        description = "Zugriff auf das Luftfahrthandbuch AIP"
-    )
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description = "Zugriff auf das Luftfahrthandbuch AIP"
+        )
+
+    parser.add_argument(
+        '-c', '--cache',
+        type = str,
+        metavar = "DIR",
+        help = "Cache-Verzeichnis")
+
+
+    commands = parser.add_subparsers(required = True)
+
+
+    command_toc = commands.add_parser(
+        'toc',
+        description = "Inhaltsverzeichnisse verwalten")
+
+    commands_toc = command_toc.add_subparsers(required = True)
+
+
+    commands_toc_fetch = commands_toc.add_parser(
+        'fetch',
+        description = "Inhaltsverzeichnis herunterladen")
+
+    parse_type(commands_toc_fetch)
+    parse_refresh(commands_toc_fetch)
+
+    commands_toc_fetch.add_argument(
+        '--catalog',
+        action = 'store_true',
+        help = "SQLite-Katalog anlegen bzw. aktualisieren")
+
+    commands_toc_fetch.set_defaults(func = toc_fetch)
+
+
+    command_toc_list = commands_toc.add_parser(
+        'list',
+        description = "Inhaltsverzeichnisse anzeigen")
+
+    parse_type_multi(command_toc_list)
+
+    command_toc_list.set_defaults(func = toc_list)
+
+
+    command_toc_delete = commands_toc.add_parser(
+        'delete',
+        description = "Inhaltsverzeichnis löschen")
+
+    parse_type(command_toc_delete)
+    parse_airac(command_toc_delete)
 
-parser.add_argument(
-    '-c', '--cache',
-    type = str,
-    metavar = "DIR",
-    help = "Cache-Verzeichnis")
+    command_toc_delete.set_defaults(func = toc_delete)
 
 
-commands = parser.add_subparsers(required = True)
+    command_toc_catalog = commands_toc.add_parser(
+        'catalog',
+        description = "SQLite-Katalog aus den Inhaltsverzeichnissen im Cache aktualisieren")
 
+    parse_refresh(command_toc_catalog)
 
-command_toc = commands.add_parser(
-    'toc',
-    description = "Inhaltsverzeichnisse verwalten")
+    command_toc_catalog.set_defaults(func = toc_catalog)
 
-commands_toc = command_toc.add_subparsers(required = True)
 
+    command_page = commands.add_parser(
+        'page',
+        description = "Seiten verwalten")
 
-commands_toc_fetch = commands_toc.add_parser(
-    'fetch',
-    description = "Inhaltsverzeichnis herunterladen")
+    commands_page = command_page.add_subparsers(required = True)
 
-parse_type(commands_toc_fetch)
-parse_refresh(commands_toc_fetch)
 
-commands_toc_fetch.set_defaults(func = toc_fetch)
+    command_page_fetch = commands_page.add_parser(
+        'fetch',
+        description = "Seiten herunterladen")
 
+    parse_type(command_page_fetch)
+    parse_refresh(command_page_fetch)
+    parse_baseairac(command_page_fetch)
+    parse_airac(command_page_fetch)
+    parse_filter(command_page_fetch)
+    parse_pairs(command_page_fetch, "Zugehörige Vorder- bzw. Rückseiten herunterladen")
+    parse_variant(command_page_fetch)
+    parse_jobs(command_page_fetch)
 
-command_toc_list = commands_toc.add_parser(
-    'list',
-    description = "Inhaltsverzeichnisse anzeigen")
+    command_page_fetch.set_defaults(func = page_fetch)
 
-parse_type_multi(command_toc_list)
 
-command_toc_list.set_defaults(func = toc_list)
+    command_page_tree = commands_page.add_parser(
+        'tree',
+        description = "Seitenbaum anzeigen")
 
+    parse_type(command_page_tree)
+    parse_airac(command_page_tree)
 
-command_toc_delete = commands_toc.add_parser(
-    'delete',
-    description = "Inhaltsverzeichnis löschen")
+    command_page_tree.add_argument(
+        '--only-folder',
+        action = 'store_true',
+        help = "Nur Abschnitte ohne Seiten anzeigen")
 
-parse_type(command_toc_delete)
-parse_airac(command_toc_delete)
+    command_page_tree.add_argument(
+        '--num',
+        action = 'store_true',
+        help = "Interne Seitennummerierung anzeigen")
 
-command_toc_delete.set_defaults(func = toc_delete)
+    command_page_tree.add_argument(
+        '--prefix',
+        action = 'store_true',
+        help = "Präfix anzeigen")
 
+    command_page_tree.add_argument(
+        '--title',
+        action = 'store_true',
+        help = "Titel anzeigen")
 
-command_page = commands.add_parser(
-    'page',
-    description = "Seiten verwalten")
+    parse_format(command_page_tree)
 
-commands_page = command_page.add_subparsers(required = True)
+    command_page_tree.set_defaults(func = page_tree)
 
 
-command_page_fetch = commands_page.add_parser(
-    'fetch',
-    description = "Seiten herunterladen")
+    command_page_list = commands_page.add_parser(
+        'list',
+        description = "Seiten anzeigen")
 
-parse_type(command_page_fetch)
-parse_refresh(command_page_fetch)
-parse_baseairac(command_page_fetch)
-parse_airac(command_page_fetch)
-parse_filter(command_page_fetch)
-parse_pairs(command_page_fetch, "Zugehörige Vorder- bzw. Rückseiten herunterladen")
+    parse_type(command_page_list)
+    parse_baseairac(command_page_list)
+    parse_airac(command_page_list)
+    parse_filter(command_page_list)
+    parse_pairs(command_page_list, "Vorder- und Rückseiten anzeigen")
+    parse_format(command_page_list)
+    parse_catalog(command_page_list)
 
-command_page_fetch.set_defaults(func = page_fetch)
+    command_page_list.set_defaults(func = page_list)
 
 
-command_page_tree = commands_page.add_parser(
-    'tree',
-    description = "Seitenbaum anzeigen")
+    command_page_diff = commands_page.add_parser(
+        'diff',
+        description = "Geänderte Seiten anzeigen")
 
-parse_type(command_page_tree)
-parse_airac(command_page_tree)
+    parse_type(command_page_diff)
+    parse_baseairac(command_page_diff, required = True)
+    parse_airac(command_page_diff)
+    parse_filter(command_page_diff)
+    parse_format(command_page_diff)
+    parse_catalog(command_page_diff)
 
-command_page_tree.add_argument(
-    '--only-folder',
-    action = 'store_true',
-    help = "Nur Abschnitte ohne Seiten anzeigen")
+    command_page_diff.set_defaults(func = page_diff)
 
-command_page_tree.add_argument(
-    '--num',
-    action = 'store_true',
-    help = "Interne Seitennummerierung anzeigen")
 
-command_page_tree.add_argument(
-    '--prefix',
-    action = 'store_true',
-    help = "Präfix anzeigen")
+    command_page_query = commands_page.add_parser(
+        'query',
+        description = "Seiten über mehrere Ausgaben im SQLite-Katalog suchen")
 
-command_page_tree.add_argument(
-    '--title',
-    action = 'store_true',
-    help = "Titel anzeigen")
+    parse_type_multi(command_page_query)
 
-command_page_tree.set_defaults(func = page_tree)
+    command_page_query.add_argument(
+        '-f', '--filter',
+        type = str,
+        metavar = "Abschnitt",
+        nargs = '+',
+        help = "Abschnitte samt Unterabschnitten")
 
+    command_page_query.add_argument(
+        '--title',
+        type = str,
+        help = "Teil des Titels")
 
-command_page_list = commands_page.add_parser(
-    'list',
-    description = "Seiten anzeigen")
+    command_page_query.add_argument(
+        '--cycles',
+        type = int,
+        metavar = "N",
+        help = "Nur die jüngsten N Ausgaben je Typ durchsuchen")
 
-parse_type(command_page_list)
-parse_baseairac(command_page_list)
-parse_airac(command_page_list)
-parse_filter(command_page_list)
-parse_pairs(command_page_list, "Vorder- und Rückseiten anzeigen")
+    parse_format(command_page_query)
 
-command_page_list.set_defaults(func = page_list)
+    command_page_query.set_defaults(func = page_query)
 
 
-command_page_diff = commands_page.add_parser(
-    'diff',
-    description = "Geänderte Seiten anzeigen")
+    command_page_search = commands_page.add_parser(
+        'search',
+        description = "Seiten und Abschnitte anhand von Name, Titel oder ICAO-Locator suchen")
 
-parse_type(command_page_diff)
-parse_baseairac(command_page_diff, required = True)
-parse_airac(command_page_diff)
-parse_filter(command_page_diff)
+    parse_type_multi(command_page_search)
 
-command_page_diff.set_defaults(func = page_diff)
+    command_page_search.add_argument(
+        '--cycles',
+        type = int,
+        metavar = "N",
+        help = "Nur die jüngsten N Ausgaben je Typ durchsuchen")
 
+    command_page_search.add_argument(
+        '--limit',
+        type = int,
+        metavar = "N",
+        help = "Höchstens N Treffer ausgeben")
 
-command_page_purge = commands_page.add_parser(
-    'purge',
-    description = "Überflüssige Seiten löschen")
+    parse_format(command_page_search)
 
-command_page_purge.set_defaults(func = page_purge)
+    command_page_search.add_argument(
+        'text',
+        metavar = 'BEGRIFF',
+        type = str,
+        nargs = '+',
+        help = "Suchbegriffe")
 
+    command_page_search.set_defaults(func = page_search)
 
-command_pdf = commands.add_parser(
-    'pdf',
-    description = "Zusammenfassung als PDF exportieren")
 
-command_pdf.add_argument(
-    '--output',
-    metavar = 'FILE',
-    type = str,
-    required = True,
-    help = 'Ausgabedatei')
+    command_page_purge = commands_page.add_parser(
+        'purge',
+        description = "Überflüssige Seiten löschen")
 
-commands_pdf = command_pdf.add_subparsers(required = True)
+    command_page_purge.set_defaults(func = page_purge)
 
 
-command_pdf_summary = commands_pdf.add_parser(
-    'summary',
-    description = "Einfache Zusammenfassung erstellen")
+    command_pdf = commands.add_parser(
+        'pdf',
+        description = "Zusammenfassung als PDF exportieren")
 
-parse_type(command_pdf_summary)
-parse_refresh(command_pdf_summary)
-parse_baseairac(command_pdf_summary)
-parse_airac(command_pdf_summary)
-parse_filter(command_pdf_summary)
-parse_pairs(command_pdf_summary, "Vorder- und Rückseiten für Duplex-Druck ausgeben")
+    command_pdf.add_argument(
+        '--output',
+        metavar = 'FILE',
+        type = str,
+        required = True,
+        help = 'Ausgabedatei (bei "batch" Ausgabeverzeichnis)')
+
+    commands_pdf = command_pdf.add_subparsers(required = True)
+
+
+    command_pdf_summary = commands_pdf.add_parser(
+        'summary',
+        description = "Einfache Zusammenfassung erstellen")
+
+    parse_type(command_pdf_summary)
+    parse_refresh(command_pdf_summary)
+    parse_baseairac(command_pdf_summary)
+    parse_airac(command_pdf_summary)
+    parse_filter(command_pdf_summary)
+    parse_pairs(command_pdf_summary, "Vorder- und Rückseiten für Duplex-Druck ausgeben")
+    parse_update(command_pdf_summary)
+    parse_jobs(command_pdf_summary)
+    parse_profile(command_pdf_summary)
+    parse_variant(command_pdf_summary)
+
+    command_pdf_summary.set_defaults(func = pdf_summary)
+
+
+    command_pdf_batch = commands_pdf.add_parser(
+        'batch',
+        description = "Mehrere Zusammenfassungen anhand eines Manifests erstellen")
+
+    parse_refresh(command_pdf_batch)
+    parse_jobs(command_pdf_batch)
+    parse_update(command_pdf_batch)
+    parse_profile(command_pdf_batch)
+    parse_variant(command_pdf_batch)
+
+    command_pdf_batch.add_argument(
+        'manifest',
+        metavar = 'MANIFEST',
+        type = str,
+        help = "Manifest (JSON oder YAML)")
+
+    command_pdf_batch.set_defaults(func = pdf_batch)
+
+
+    command_pdf_preview = commands_pdf.add_parser(
+        'preview',
+        description = "Vorschau als Kontaktabzug (.pdf) oder Galerie (.html) erstellen")
+
+    parse_type(command_pdf_preview)
+    parse_refresh(command_pdf_preview)
+    parse_baseairac(command_pdf_preview)
+    parse_airac(command_pdf_preview)
+    parse_filter(command_pdf_preview)
+    parse_pairs(command_pdf_preview, "Vorder- und Rückseiten samt Leerseiten anzeigen")
+    parse_jobs(command_pdf_preview)
+
+    command_pdf_preview.add_argument(
+        '--columns',
+        metavar = 'N',
+        type = int,
+        default = 6,
+        help = "Spalten je Kontaktabzug")
+
+    command_pdf_preview.add_argument(
+        '--rows',
+        metavar = 'N',
+        type = int,
+        default = 3,
+        help = "Zeilen je Kontaktabzug")
+
+    command_pdf_preview.set_defaults(func = pdf_preview)
+
+
+    command_pdf_print = commands_pdf.add_parser(
+        'print',
+        description = "Seiten für den Druck auf A4-Bögen ausschießen (siehe online/vfr_print.py)")
+
+    parse_type(command_pdf_print)
+    parse_refresh(command_pdf_print)
+    parse_baseairac(command_pdf_print)
+    parse_airac(command_pdf_print)
+    parse_filter(command_pdf_print)
+    parse_pairs(command_pdf_print, "Fehlende Vorder- und Rückseiten als Leerseiten einfügen")
+    parse_jobs(command_pdf_print)
+
+    command_pdf_print.add_argument(
+        '--cropmark',
+        action = 'store_true',
+        help = "Schnittmarken einzeichnen")
+
+    command_pdf_print.add_argument(
+        '--punchmark',
+        action = 'store_true',
+        help = "Lochmarken einzeichnen")
+
+    command_pdf_print.add_argument(
+        '--foldmark',
+        action = 'store_true',
+        help = "Faltmarken einzeichnen")
+
+    command_pdf_print.add_argument(
+        '--tc-to-a4',
+        action = 'store_true',
+        help = "Terminal Charts auf A4 verkleinern")
+
+    command_pdf_print.add_argument(
+        '--misc-to-a4',
+        action = 'store_true',
+        help = "Seiten unbekannten Formats auf A4 verkleinern")
+
+    command_pdf_print.set_defaults(func = pdf_print)
+
+
+    command_serve = commands.add_parser(
+        'serve',
+        description = "Inhaltsverzeichnisse im Speicher vorhalten und Anfragen beantworten")
+
+    group = command_serve.add_mutually_exclusive_group(required = True)
+
+    group.add_argument(
+        '--socket',
+        metavar = 'PATH',
+        type = str,
+        help = "Unix-Socket")
+
+    group.add_argument(
+        '--http',
+        metavar = '[HOST:]PORT',
+        type = str,
+        help = "HTTP-Adresse")
+
+    command_serve.add_argument(
+        '--keep',
+        metavar = 'N',
+        type = int,
+        default = 3,
+        help = "Anzahl vorgehaltener Ausgaben je Typ")
+
+    command_serve.add_argument(
+        '--output-dir',
+        metavar = 'DIR',
+        type = str,
+        default = '.',
+        help = "Verzeichnis für Ausgabedateien")
 
-command_pdf_summary.set_defaults(func = pdf_summary)
+    command_serve.set_defaults(func = serve)
 
 
 
-args = parser.parse_args()
+    args = parser.parse_args()
 
-args.func(args)
+    args.func(args)
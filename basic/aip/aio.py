@@ -0,0 +1,216 @@
+#
+# Copyright (C) 2022-2023 Mario Haustein, mario@mariohaustein.de
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import asyncio
+import httpx
+import os
+
+from .cache import AipCache
+from .toc import AipToc
+from .tmpfile import make_tmpfile
+from .tmpfile import remove_tmpfile
+
+
+
+#
+# Asynchroner Zugriff auf das AIP-Portal
+#
+# Die Klasse verwendet die Parser von `AipCache` und `AipToc` und ersetzt nur
+# den HTTP-Zugriff. Die Zahl gleichzeitiger Anfragen wird über `concurrency`
+# begrenzt. Wird eine Koroutine abgebrochen, werden auch alle noch laufenden
+# Teilabrufe abgebrochen. Inhaltsverzeichnisse werden erst nach vollständigem
+# Abruf geschrieben.
+#
+class AipAsync:
+    def __init__(self, cache: AipCache = None, concurrency: int = 4, client: httpx.AsyncClient = None):
+        self.cache = AipCache() if cache is None else cache
+        self.concurrency = concurrency
+        self.semaphore = None
+        self.client = client
+        self._ownclient = client is None
+
+
+    async def __aenter__(self):
+        # Die Semaphore erst in der laufenden Ereignisschleife anlegen.
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        if self.client is None:
+            self.client = httpx.AsyncClient(follow_redirects = True)
+        return self
+
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+
+    async def aclose(self):
+        if self._ownclient and self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+
+    async def _get(self, url, headers = AipCache._HEADERS):
+        if self.client is None or self.semaphore is None:
+            raise RuntimeError("Client nicht geöffnet. 'async with AipAsync(...)' verwenden.")
+
+        async with self.semaphore:
+            response = await self.client.get(url, headers = headers)
+        response.raise_for_status()
+
+        return response
+
+
+    #
+    # Aktuelles AIRAC-Datum abrufen
+    #
+    async def current_airac(self, aiptype):
+        response = await self._get(self.cache._TYPES[aiptype]['url'])
+        return await _run(self.cache._parse_airac, response.content)
+
+
+    #
+    # AIP-Inhaltsverzeichnis herunterladen
+    #
+    async def fetch_toc(self, aiptype: str, refresh: bool = False):
+        airac = await self.current_airac(aiptype)
+        tocpath = self.cache._tocpath(aiptype, airac)
+
+        if os.path.exists(tocpath) and not refresh:
+            return
+
+        toc = self.cache._newtoc(aiptype, airac)
+        toc.update(await self._fetch_folder(self.cache._TYPES[aiptype]['url']))
+        self.cache._store(tocpath, toc)
+
+        return ( aiptype, airac, tocpath )
+
+
+    async def _fetch_folder(self, url):
+        response = await self._get(url)
+
+        # Ggf. einem Meta-Redirect folgen
+        while True:
+            url = await _run(self.cache._parse_redirect, str(response.url), response.content)
+            if url is None:
+                break
+
+            response = await self._get(url)
+
+        # Das Auswerten der HTML-Seiten mit BeautifulSoup ist rechenintensiv und
+        # wird daher nicht in der Ereignisschleife ausgeführt.
+        result, folders = await _run(self.cache._parse_folder, str(response.url), response.content)
+
+        # Unterordner parallel abrufen. Schlägt ein Abruf fehl, werden die
+        # übrigen abgebrochen.
+        subfolders = await _gather(*[ self._fetch_folder(entry['href']) for entry in folders ])
+        for entry, subfolder in zip(folders, subfolders):
+            entry.update(subfolder)
+
+        return result
+
+
+    #
+    # Einzelseite herunterladen
+    #
+    async def fetch_page(self, toc: AipToc, page, refresh: bool = False):
+        if page is None or 'folder' in page:
+            return None
+
+        filename = toc._pagefile(page)
+        if not refresh and os.path.exists(filename):
+            return filename
+
+        url, headers = toc._pageurl(page)
+        response = await self._get(url, headers = headers)
+
+        # Die Umwandlung der Rasterbilder ist rechenintensiv und wird daher
+        # nicht in der Ereignisschleife ausgeführt.
+        contenttype = response.headers['content-type']
+        await _store(filename, lambda tmpfile : toc._store_page(page, tmpfile, contenttype, response.content))
+        await _run(toc.index.record, page['pageid'], filename)
+
+        return filename
+
+
+    #
+    # Mehrere Seiten herunterladen. Die Reihenfolge des Ergebnisses entspricht
+    # der Eingabe. Für `None`-Einträge (Leerseiten) wird `None` geliefert.
+    #
+    async def fetch_pages(self, toc: AipToc, pages, refresh: bool = False):
+        return await _gather(*[ self.fetch_page(toc, page, refresh = refresh) for page in pages ])
+
+
+    #
+    # Vorschaubild herunterladen
+    #
+    async def fetch_thumbnail(self, toc: AipToc, page, refresh: bool = False):
+        if page is None or 'folder' in page:
+            return None
+
+        filename = toc._thumbnailfile(page)
+        if not refresh and os.path.exists(filename):
+            return filename
+
+        response = await self._get(page['href'])
+
+        # Die Vorschauseite wird mit BeautifulSoup ausgewertet.
+        await _store(filename, lambda tmpfile : toc._store_thumbnail(page, tmpfile, response.content))
+
+        return filename
+
+
+
+# Blockierende Funktion im Standard-Executor ausführen
+async def _run(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+#
+# Datei im Standard-Executor erzeugen
+#
+# `store` schreibt in eine temporäre Datei, die erst nach Abschluss an ihren
+# Platz verschoben wird, damit ein Abbruch keine halben Dateien im Cache
+# hinterlässt. Wird die Koroutine abgebrochen, läuft `store` im Hintergrund
+# weiter. Die temporäre Datei wird dann erst danach entfernt.
+#
+async def _store(filename, store):
+    tmpfile = make_tmpfile(filename)
+    future = asyncio.get_running_loop().run_in_executor(None, store, tmpfile)
+    try:
+        await asyncio.shield(future)
+        os.replace(tmpfile, filename)
+    finally:
+        if future.done():
+            remove_tmpfile(tmpfile)
+        else:
+            future.add_done_callback(lambda f : remove_tmpfile(tmpfile))
+
+
+#
+# Wie `asyncio.gather`, bricht aber beim ersten Fehler die übrigen Aufgaben ab,
+# statt sie im Hintergrund weiterlaufen zu lassen.
+#
+async def _gather(*coros):
+    tasks = [ asyncio.ensure_future(c) for c in coros ]
+
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions = True)
+        raise
@@ -16,15 +16,13 @@
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 #
 
-from bs4 import BeautifulSoup
 import datetime
 import json
 import os
 import re
-import requests
 import urllib.parse
-import xdg.BaseDirectory
 
+from .toc import AipToc
 
 
 class AipCache:
@@ -58,9 +56,14 @@ class AipCache:
 
     _PERMAPATTERN = re.compile(r'const myPermalink = "(\S+)";')
 
+    _TOCPATTERN = re.compile(r'(VFR|IFR)-([0-9]{4}-[0-9]{2}-[0-9]{2})\.json')
+
+    _HEADERS = { 'User-Agent': 'AIP Download Tool' }
+
 
     def __init__(self, basedir = None):
         if basedir is None:
+            import xdg.BaseDirectory
             self.basedir = xdg.BaseDirectory.save_cache_path('dfs-aip')
         else:
             self.basedir = basedir
@@ -70,12 +73,22 @@ class AipCache:
     # Aktuelles AIRAC-Datum abrufen
     #
     def current_airac(self, aiptype):
+        import requests
+
         # Startseite abrufen
-        response = requests.get(self._TYPES[aiptype]['url'], headers = { 'User-Agent': 'AIP Download Tool' })
+        response = requests.get(self._TYPES[aiptype]['url'], headers = self._HEADERS)
         response.raise_for_status()
 
-        # Startseite parsen
-        soup = BeautifulSoup(response.content, 'html.parser')
+        return self._parse_airac(response.content)
+
+
+    #
+    # AIRAC-Datum aus der Startseite bestimmen
+    #
+    def _parse_airac(self, content):
+        from bs4 import BeautifulSoup
+
+        soup = BeautifulSoup(content, 'html.parser')
 
         # Ausgabedatum bestimmen
         aip_airac = soup.find('div', class_ = 'subHeader').text.strip()
@@ -108,13 +121,23 @@ class AipCache:
 
             path = os.path.abspath(os.path.join(self.basedir, entry.name))
 
-            with open(entry) as f:
-                toc = json.load(f)
+            # Typ und Datum nach Möglichkeit aus dem Dateinamen bestimmen.
+            # Das vollständige Inhaltsverzeichnis einzulesen, dauert deutlich
+            # länger.
+            match = self._TOCPATTERN.fullmatch(entry.name)
+            if match:
+                toctype  = match[1]
+                tocairac = match[2]
+            else:
+                with open(entry) as f:
+                    toc = json.load(f)
+                toctype  = toc['type']
+                tocairac = toc['airac']
 
-                if aiptype is not None and toc['type'] != aiptype:
-                    continue
+            if aiptype is not None and toctype != aiptype:
+                continue
 
-                result.append(( toc['type'], datetime.date.fromisoformat(toc['airac']), path ))
+            result.append(( toctype, datetime.date.fromisoformat(tocairac), path ))
 
         result.sort(key = lambda x : ( x[1], x[0] ), reverse = True)
 
@@ -132,58 +155,121 @@ class AipCache:
         return None
 
 
+    #
+    # Inhaltsverzeichnis anhand von Typ und ggf. AIRAC-Datum laden
+    #
+    def load(self, aiptype, airac = None):
+        entry = self.get(aiptype, airac)
+        if entry is None:
+            if airac is None:
+                raise KeyError("Kein Inhaltsverzeichnis für AIP %s vorhanden" % aiptype)
+            raise KeyError("Kein Inhaltsverzeichnis für AIP %s vom %s vorhanden" % ( aiptype, airac.isoformat() ))
+
+        return AipToc(entry[2])
+
+
     #
     # AIP-Inhaltsverzeichnis herunterladen
     #
     def fetch(self, aiptype: str, debug: bool = False, refresh: bool = False):
         airac = self.current_airac(aiptype)
-        airac_string = airac.isoformat()
-        tocpath = os.path.join(self.basedir, '%s-%s.json' % ( aiptype, airac_string ))
+        tocpath = self._tocpath(aiptype, airac)
 
         if os.path.exists(tocpath) and not refresh:
             return
 
+        toc = self._newtoc(aiptype, airac)
+        toc.update(self._fetch_folder(self._TYPES[aiptype]['url'], debug = debug))
+        self._store(tocpath, toc)
+
+        return ( aiptype, airac, tocpath )
+
+
+    def _tocpath(self, aiptype, airac):
+        return os.path.join(self.basedir, '%s-%s.json' % ( aiptype, airac.isoformat() ))
+
+
+    def _newtoc(self, aiptype, airac):
         toc = {}
         toc['type'] = aiptype
         toc['version'] = 1
-        toc['airac'] = airac_string
+        toc['airac'] = airac.isoformat()
         toc['name'] = 'AIP %s' % aiptype
-        toc.update(self._fetch_folder(self._TYPES[aiptype]['url'], debug = debug))
 
-        with open(tocpath, 'w') as f:
-            json.dump(toc, f, indent = 2)
+        return toc
 
-        return ( aiptype, airac, tocpath )
+
+    def _store(self, tocpath, toc):
+        # Erst vollständig schreiben, dann umbenennen. So sieht `list` nie ein
+        # halb geschriebenes Inhaltsverzeichnis.
+        tmppath = tocpath + '.tmp'
+        with open(tmppath, 'w') as f:
+            json.dump(toc, f, indent = 2)
+        os.replace(tmppath, tocpath)
 
 
     #
     # Einen Unterordner herunterladen
     #
     def _fetch_folder(self, url: str, depth: int = 0, debug: bool = False):
-        response = requests.get(url, headers = { 'User-Agent': 'AIP Download Tool' })
+        import requests
+
+        response = requests.get(url, headers = self._HEADERS)
         response.raise_for_status()
 
         # Ggf. einem Meta-Redirect folgen
         while True:
-            soup = BeautifulSoup(response.content, 'html.parser')
-            metarefresh = soup.find('meta', attrs = { 'http-equiv': 'Refresh' })
-            if not metarefresh:
+            url = self._parse_redirect(response.url, response.content)
+            if url is None:
                 break
 
-            url = metarefresh['content'].split(';')[1].strip().split('=', maxsplit = 1)[1]
-            url = urllib.parse.urljoin(response.url, url)
-            response = requests.get(url, headers = { 'User-Agent': 'AIP Download Tool' })
+            response = requests.get(url, headers = self._HEADERS)
             response.raise_for_status()
 
+        result, folders = self._parse_folder(response.url, response.content)
+
+        for entry in folders:
+            if debug:
+                print(depth * "  " + entry['name'])
+            entry.update(self._fetch_folder(entry['href'], depth = depth + 1, debug = debug))
+
+        return result
+
+
+    #
+    # Ziel eines Meta-Redirects bestimmen
+    #
+    def _parse_redirect(self, url, content):
+        from bs4 import BeautifulSoup
+
+        soup = BeautifulSoup(content, 'html.parser')
+        metarefresh = soup.find('meta', attrs = { 'http-equiv': 'Refresh' })
+        if not metarefresh:
+            return None
+
+        target = metarefresh['content'].split(';')[1].strip().split('=', maxsplit = 1)[1]
+        return urllib.parse.urljoin(url, target)
+
+
+    #
+    # Einträge eines Unterordners bestimmen. Neben dem Ergebnis wird die Liste
+    # der Unterordner zurückgegeben, die noch abzurufen sind.
+    #
+    def _parse_folder(self, url, content):
+        from bs4 import BeautifulSoup
+
+        soup = BeautifulSoup(content, 'html.parser')
+
         result = {}
+        folders = []
 
         # URL
-        result['href'] = response.url
+        result['href'] = url
 
         # Permalink
-        permalink = self._PERMAPATTERN.search(response.content.decode())
+        permalink = self._PERMAPATTERN.search(content.decode())
         if permalink:
-            permaurl = urllib.parse.urlparse(response.url)
+            permaurl = urllib.parse.urlparse(url)
             permaurl = permaurl._replace(path = '/' + permaurl.path.split('/')[1])
             result['permalink'] = permaurl.geturl() + '/' + permalink[1]
 
@@ -198,15 +284,14 @@ class AipCache:
         soup = soup.find_all('a')
 
         for e in soup:
-            url = urllib.parse.urljoin(response.url, e['href'])
-
             entry = {}
-            entry['href'] = url
+            entry['href'] = urllib.parse.urljoin(url, e['href'])
 
             cls = e['class'][0]
 
             if cls == 'folder-link':
                 entry['name'] = e.find('span', class_ = 'folder-name', lang = 'de').text.strip()
+                folders.append(entry)
 
             elif cls == 'document-link':
                 entry['name'] = e.find('span', class_ = 'document-name', lang = 'de').text.strip()
@@ -214,14 +299,9 @@ class AipCache:
             else:
                 continue
 
-            if cls == 'folder-link':
-                if debug:
-                    print(depth * "  " + entry['name'])
-                entry.update(self._fetch_folder(url, depth = depth + 1, debug = debug))
-
             result['folder'].append(entry)
 
-        return result
+        return result, folders
 
 
     #
@@ -0,0 +1,442 @@
+#
+# Copyright (C) 2022-2023 Mario Haustein, mario@mariohaustein.de
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import datetime
+import os
+import re
+import sqlite3
+
+from .cache import AipCache
+from .toc import AipToc
+
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cycles (
+    id       INTEGER PRIMARY KEY,
+    type     TEXT NOT NULL,
+    airac    TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    mtime    INTEGER NOT NULL,
+    UNIQUE (type, airac)
+);
+
+CREATE TABLE IF NOT EXISTS entries (
+    cycle    INTEGER NOT NULL REFERENCES cycles(id) ON DELETE CASCADE,
+    seq      INTEGER NOT NULL,
+    level    INTEGER NOT NULL,
+    folder   INTEGER NOT NULL,
+    num      INTEGER,
+    numfirst INTEGER,
+    numlast  INTEGER,
+    prefix   TEXT,
+    pageid   TEXT NOT NULL,
+    name     TEXT NOT NULL,
+    title    TEXT,
+    href     TEXT NOT NULL,
+    page     INTEGER,
+    subpage  INTEGER,
+    odd      INTEGER,
+    PRIMARY KEY (cycle, seq)
+);
+
+CREATE INDEX IF NOT EXISTS entries_prefix ON entries (cycle, prefix);
+CREATE INDEX IF NOT EXISTS entries_num    ON entries (cycle, num);
+CREATE INDEX IF NOT EXISTS entries_pageid ON entries (pageid);
+"""
+
+# Volltextindex über Namen, Titel, Präfixe und ICAO-Locator. Die `rowid`
+# entspricht der des Eintrags in `entries`.
+_SCHEMA_FTS = """
+CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5 (
+    name, title, prefix, icao,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+_ICAOPATTERN = re.compile(r'\bE[DT][A-Z]{2}\b')
+
+_COLUMNS = [ 'num', 'numfirst', 'numlast', 'prefix', 'pageid', 'name', 'title', 'href', 'page', 'subpage', 'odd' ]
+
+
+
+def _row_page(row):
+    page = { k: row[k] for k in _COLUMNS if row[k] is not None }
+    if 'odd' in page:
+        page['odd'] = bool(page['odd'])
+    if row['folder']:
+        page['folder'] = []
+
+    return page
+
+
+def _cycle_conditions(types, cycles):
+    conditions = []
+    params = []
+
+    if types:
+        conditions.append("c.type IN (%s)" % ", ".join([ "?" ] * len(types)))
+        params += types
+
+    if cycles is not None:
+        conditions.append(
+            "( SELECT COUNT(*) FROM cycles c2 WHERE c2.type = c.type AND c2.airac > c.airac ) < ?")
+        params.append(cycles)
+
+    return conditions, params
+
+
+def _icao(entry):
+    codes = set()
+    for k in [ 'prefix', 'name' ]:
+        if k in entry:
+            codes.update(_ICAOPATTERN.findall(entry[k]))
+
+    return " ".join(sorted(codes))
+
+
+#
+# Suchbegriffe in eine FTS5-Abfrage umwandeln. Jedes Wort wird als
+# Präfixsuche übernommen, Sonderzeichen der Abfragesprache werden maskiert.
+#
+def _fts_query(text):
+    words = re.findall(r'\w+', text)
+    if not words:
+        raise ValueError("Keine Suchbegriffe angegeben")
+
+    return " ".join('"%s"*' % w for w in words)
+
+
+def _prefix_condition(prefix):
+    # Der Abschnitt selbst und alle Unterabschnitte, als Bereichsabfrage über
+    # den Index formuliert (' ' + 1 = '!').
+    return "( e.prefix = ? OR ( e.prefix >= ? AND e.prefix < ? ) )", [ prefix, prefix + ' ', prefix + '!' ]
+
+
+
+#
+# Seitenindex eines Katalog-Inhaltsverzeichnisses
+#
+# Verhält sich gegenüber `AipToc.pairs` wie `AipToc.index_num`, liest die
+# Seiten aber erst bei Bedarf aus der Datenbank.
+#
+class _CatalogIndex:
+    def __init__(self, catalog, cycle):
+        self.catalog = catalog
+        self.cycle = cycle
+        self._len = None
+
+
+    def __getitem__(self, num):
+        row = self.catalog.conn.execute(
+            "SELECT * FROM entries e WHERE cycle = ? AND num = ?", ( self.cycle, num )).fetchone()
+        if row is None:
+            raise KeyError(num)
+
+        return _row_page(row)
+
+
+    def __len__(self):
+        if self._len is None:
+            self._len = self.catalog.conn.execute(
+                "SELECT COUNT(*) FROM entries WHERE cycle = ? AND folder = 0", ( self.cycle, )).fetchone()[0]
+        return self._len
+
+
+
+#
+# Inhaltsverzeichnis einer Ausgabe im Katalog
+#
+# Bietet dieselben Abfragen wie `AipToc`, beantwortet sie aber über indizierte
+# SQL-Abfragen statt über den Seitenbaum.
+#
+class CatalogToc:
+    pairs = AipToc.pairs
+
+
+    def __init__(self, catalog, cycle, aiptype, airac):
+        self.catalog = catalog
+        self.cycle = cycle
+        self.aiptype = aiptype
+        self.airac = airac
+        self.datadir = os.path.join(catalog.cache.basedir, 'data')
+        self.index_num = _CatalogIndex(catalog, cycle)
+
+
+    def _range(self, prefix):
+        row = self.catalog.conn.execute(
+            "SELECT num, numfirst, numlast FROM entries WHERE cycle = ? AND prefix = ? ORDER BY seq DESC LIMIT 1",
+            ( self.cycle, prefix )).fetchone()
+        if row is None:
+            raise KeyError("Unbekannter Abschnitt '%s'" % prefix)
+
+        if row['num'] is not None:
+            return row['num'], row['num']
+        return row['numfirst'], row['numlast']
+
+
+    def filter(self, prefixes):
+        if prefixes is None:
+            rows = self.catalog.conn.execute(
+                "SELECT * FROM entries e WHERE cycle = ? AND folder = 0 ORDER BY num", ( self.cycle, ))
+            return [ _row_page(row) for row in rows ]
+
+        conditions = []
+        params = [ self.cycle ]
+
+        for prefix in prefixes:
+            if isinstance(prefix, tuple):
+                prefixfirst, prefixlast = prefix
+            else:
+                prefixfirst, prefixlast = prefix, prefix
+
+            numfirst, _ = self._range(prefixfirst)
+            _, numlast = self._range(prefixlast)
+            if numfirst is None or numlast is None:
+                continue
+            if numfirst > numlast:
+                raise ValueError("Ungültiger Bereich '%s'-'%s'. Anfang muss vor dem Ende liegen." % ( prefixfirst, prefixlast ))
+
+            conditions.append("num BETWEEN ? AND ?")
+            params += [ numfirst, numlast ]
+
+        if not conditions:
+            return []
+
+        rows = self.catalog.conn.execute(
+            "SELECT * FROM entries e WHERE cycle = ? AND folder = 0 AND ( %s ) ORDER BY num" % " OR ".join(conditions),
+            params)
+
+        return [ _row_page(row) for row in rows ]
+
+
+
+def catalog_filename(cache):
+    return os.path.join(cache.basedir, 'catalog.sqlite')
+
+
+#
+# SQLite-Katalog aller Inhaltsverzeichnisse im Cache
+#
+# Der Katalog wird mit `update` aus den Inhaltsverzeichnissen im Cache befüllt.
+# Bereits erfasste Ausgaben werden nur neu eingelesen, wenn sich die Datei
+# geändert hat, und entfernt, wenn sie nicht mehr im Cache liegt. Gegenüber
+# `prepare_pagepairs` und `prepare_pagediff` verhält sich der Katalog wie
+# `AipCache`.
+#
+class AipCatalog:
+    def __init__(self, cache: AipCache, filename: str = None):
+        self.cache = cache
+        self.filename = catalog_filename(cache) if filename is None else filename
+
+        self.conn = sqlite3.connect(self.filename)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.executescript(_SCHEMA)
+
+        # Nicht jede SQLite-Version enthält FTS5. Die Suche weicht dann auf
+        # `LIKE` aus.
+        exists = self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'entries_fts'").fetchone() is not None
+        try:
+            self.conn.executescript(_SCHEMA_FTS)
+            self.fts = True
+        except sqlite3.OperationalError:
+            self.fts = False
+
+        # Ausgaben, die vor dem Volltextindex erfasst wurden, beim nächsten
+        # `update` neu einlesen.
+        if self.fts and not exists:
+            with self.conn:
+                self.conn.execute("UPDATE cycles SET mtime = 0")
+
+
+    def close(self):
+        self.conn.close()
+
+
+    def update(self, refresh: bool = False):
+        imported = []
+
+        entries = self.cache.list(None)
+        for aiptype, airac, filename in entries:
+            mtime = os.stat(filename).st_mtime_ns
+            row = self.conn.execute(
+                "SELECT id, mtime FROM cycles WHERE type = ? AND airac = ?", ( aiptype, airac.isoformat() )).fetchone()
+            if row is not None and row['mtime'] == mtime and not refresh:
+                continue
+
+            self._import(aiptype, airac, filename, mtime, AipToc(filename))
+            imported.append(( aiptype, airac, filename ))
+
+        # Ausgaben entfernen, deren Inhaltsverzeichnis nicht mehr im Cache liegt
+        current = { ( aiptype, airac.isoformat() ) for aiptype, airac, _ in entries }
+        with self.conn:
+            for row in self.conn.execute("SELECT type, airac FROM cycles").fetchall():
+                if ( row['type'], row['airac'] ) not in current:
+                    self._delete(row['type'], row['airac'])
+
+        return imported
+
+
+    def _delete(self, aiptype, airac):
+        if self.fts:
+            self.conn.execute(
+                "DELETE FROM entries_fts WHERE rowid IN "
+                "( SELECT e.rowid FROM entries e JOIN cycles c ON c.id = e.cycle WHERE c.type = ? AND c.airac = ? )",
+                ( aiptype, airac ))
+        self.conn.execute("DELETE FROM cycles WHERE type = ? AND airac = ?", ( aiptype, airac ))
+
+
+    def _import(self, aiptype, airac, filename, mtime, toc):
+        rows = []
+
+        texts = []
+
+        def walk(entry, level):
+            row = [ entry.get(k) for k in _COLUMNS ]
+            row[-1] = None if 'odd' not in entry else int(entry['odd'])
+            rows.append([ len(rows), level, int('folder' in entry) ] + row)
+            texts.append(( entry['name'], entry.get('title', ""), entry.get('prefix', ""), _icao(entry) ))
+
+            for e in entry.get('folder', []):
+                walk(e, level + 1)
+
+        walk(toc.toc, 0)
+
+        with self.conn:
+            self._delete(aiptype, airac.isoformat())
+            cycle = self.conn.execute(
+                "INSERT INTO cycles (type, airac, filename, mtime) VALUES (?, ?, ?, ?)",
+                ( aiptype, airac.isoformat(), filename, mtime )).lastrowid
+
+            self.conn.executemany(
+                "INSERT INTO entries (cycle, seq, level, folder, %s) VALUES (?, ?, ?, ?, %s)" %
+                (
+                    ", ".join(_COLUMNS),
+                    ", ".join([ "?" ] * len(_COLUMNS)),
+                ),
+                [ [ cycle ] + row for row in rows ])
+
+            if self.fts:
+                self.conn.executemany(
+                    "INSERT INTO entries_fts (rowid, name, title, prefix, icao) "
+                    "SELECT rowid, ?, ?, ?, ? FROM entries WHERE cycle = ? AND seq = ?",
+                    [ text + ( cycle, seq ) for seq, text in enumerate(texts) ])
+
+
+    def list(self, aiptype = None):
+        if aiptype is None:
+            rows = self.conn.execute("SELECT type, airac, filename FROM cycles ORDER BY airac DESC, type DESC")
+        else:
+            rows = self.conn.execute("SELECT type, airac, filename FROM cycles WHERE type = ? ORDER BY airac DESC", ( aiptype, ))
+
+        return [ ( t, datetime.date.fromisoformat(a), f ) for t, a, f in rows ]
+
+
+    def load(self, aiptype, airac = None):
+        if airac is None:
+            row = self.conn.execute(
+                "SELECT id, type, airac FROM cycles WHERE type = ? ORDER BY airac DESC LIMIT 1", ( aiptype, )).fetchone()
+        else:
+            row = self.conn.execute(
+                "SELECT id, type, airac FROM cycles WHERE type = ? AND airac = ?", ( aiptype, airac.isoformat() )).fetchone()
+
+        if row is None:
+            if airac is None:
+                raise KeyError("Kein Inhaltsverzeichnis für AIP %s vorhanden" % aiptype)
+            raise KeyError("Kein Inhaltsverzeichnis für AIP %s vom %s vorhanden" % ( aiptype, airac.isoformat() ))
+
+        return CatalogToc(self, row['id'], row['type'], datetime.date.fromisoformat(row['airac']))
+
+
+    #
+    # Seiten über mehrere Ausgaben und Typen hinweg suchen
+    #
+    # - types:    Liste der AIP-Typen oder `None` für alle
+    # - prefixes: Abschnitte, deren Seiten gesucht werden
+    # - title:    Teilzeichenkette des Titels (ohne Beachtung der
+    #             Groß-/Kleinschreibung)
+    # - cycles:   Nur die jüngsten `cycles` Ausgaben je Typ durchsuchen
+    #
+    def query(self, types = None, prefixes = None, title = None, cycles = None):
+        conditions, params = _cycle_conditions(types, cycles)
+        conditions.append("e.folder = 0")
+
+        if prefixes:
+            prefixconditions = []
+            for prefix in prefixes:
+                condition, conditionparams = _prefix_condition(prefix)
+                prefixconditions.append(condition)
+                params += conditionparams
+            conditions.append("( %s )" % " OR ".join(prefixconditions))
+
+        if title is not None:
+            conditions.append("e.title LIKE ?")
+            params.append('%' + title.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+            conditions[-1] += " ESCAPE '\\'"
+
+        rows = self.conn.execute(
+            "SELECT c.type AS type, c.airac AS airac, e.* FROM entries e JOIN cycles c ON c.id = e.cycle "
+            "WHERE %s ORDER BY c.airac DESC, c.type, e.num" % " AND ".join(conditions),
+            params)
+
+        result = []
+        for row in rows:
+            page = _row_page(row)
+            page['type'] = row['type']
+            page['airac'] = row['airac']
+            result.append(page)
+
+        return result
+
+
+    #
+    # Volltextsuche über Namen, Titel, Präfixe und ICAO-Locator
+    #
+    # Jedes Wort der Suche muss (als Wortanfang) vorkommen. Gefunden werden
+    # Seiten und Abschnitte, die jüngsten Ausgaben zuerst.
+    #
+    def search(self, text, types = None, cycles = None, limit = None):
+        conditions, params = _cycle_conditions(types, cycles)
+
+        if self.fts:
+            conditions.insert(0, "entries_fts MATCH ?")
+            params.insert(0, _fts_query(text))
+            query = \
+                "SELECT c.type AS type, c.airac AS airac, e.* FROM entries_fts " \
+                "JOIN entries e ON e.rowid = entries_fts.rowid JOIN cycles c ON c.id = e.cycle " \
+                "WHERE %s ORDER BY c.airac DESC, c.type, entries_fts.rank, e.seq"
+        else:
+            for word in re.findall(r'\w+', text):
+                conditions.append("( e.name LIKE ? OR e.title LIKE ? OR e.prefix LIKE ? )")
+                params += 3 * [ '%' + word + '%' ]
+            query = \
+                "SELECT c.type AS type, c.airac AS airac, e.* FROM entries e JOIN cycles c ON c.id = e.cycle " \
+                "WHERE %s ORDER BY c.airac DESC, c.type, e.seq"
+
+        if limit is not None:
+            query += " LIMIT %d" % limit
+
+        result = []
+        for row in self.conn.execute(query % " AND ".join(conditions), params):
+            page = _row_page(row)
+            page['type'] = row['type']
+            page['airac'] = row['airac']
+            result.append(page)
+
+        return result
@@ -16,12 +16,17 @@
 # Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 #
 
+import argparse
 import datetime
-import pikepdf
+import json
+import os
 
 from .cache import AipCache
 from .toc import AipToc
 from .page import page_amdt
+from .output import PAGE_FIELDS
+from .output import RecordWriter
+from .output import page_record
 
 
 
@@ -43,19 +48,21 @@ def prepare_filter(filterarray):
     return prefixes
 
 
-def prepare_pagepairs(args, pairs):
+def parse_airac(airac):
+    return None if airac is None else datetime.date.fromisoformat(airac)
+
+
+def prepare_pagepairs(args, pairs, store = None):
     prefixes = prepare_filter(args.filter)
 
-    cache = AipCache(basedir = args.cache)
-    airac = None if args.airac is None else datetime.date.fromisoformat(args.airac)
-    aiptype, airac, filename = cache.get(args.type, airac)
-    toc = AipToc(filename)
+    if store is None:
+        store = AipCache(basedir = args.cache)
+
+    toc = store.load(args.type, parse_airac(args.airac))
     pages = toc.filter(prefixes)
 
     if args.base_airac is not None:
-        base_airac = datetime.date.fromisoformat(args.base_airac)
-        _, base_airac, base_filename = cache.get(args.type, base_airac)
-        base_toc = AipToc(base_filename)
+        base_toc = store.load(args.type, parse_airac(args.base_airac))
         base_pages = base_toc.filter(prefixes)
 
         pagesdiff = page_amdt(base_pages, pages)
@@ -66,6 +73,21 @@ def prepare_pagepairs(args, pairs):
     return toc, pagepairs
 
 
+def prepare_pagediff(args, store = None):
+    prefixes = prepare_filter(args.filter)
+
+    if store is None:
+        store = AipCache(basedir = args.cache)
+
+    target_toc = store.load(args.type, parse_airac(args.airac))
+    target_pages = target_toc.filter(prefixes)
+
+    base_toc = store.load(args.type, parse_airac(args.base_airac))
+    base_pages = base_toc.filter(prefixes)
+
+    return page_amdt(base_pages, target_pages)
+
+
 def page_tree_show(entry, show, indent = []):
     if not ('folder' in entry or show['pages']):
         return
@@ -128,10 +150,52 @@ def page_list_show(args, page, odd):
         print(line)
 
 
+def page_tree_records(writer, entry, datadir, level = 0):
+    record = page_record(entry, datadir)
+    record['level'] = level
+    record['folder'] = 'folder' in entry
+    record['numfirst'] = entry.get('numfirst')
+    record['numlast'] = entry.get('numlast')
+    writer.write(record)
+
+    for e in entry.get('folder', []):
+        page_tree_records(writer, e, datadir, level = level + 1)
+
+
+def open_catalog(args):
+    from .catalog import AipCatalog
+
+    catalog = AipCatalog(AipCache(basedir = args.cache))
+    catalog.update()
+
+    return catalog
+
+
 def toc_fetch(args):
+    import sys
+
+    from .catalog import AipCatalog
+    from .catalog import catalog_filename
+
     cache = AipCache(basedir = args.cache)
     cache.fetch(args.type, debug = True, refresh = args.refresh)
 
+    # Einen vorhandenen oder ausdrücklich angeforderten Katalog samt Suchindex
+    # fortschreiben. Unveränderte Ausgaben werden dabei nicht erneut
+    # eingelesen. Das Herunterladen ist bereits abgeschlossen, Fehler beim
+    # Einlesen werden daher nur gemeldet.
+    if not args.catalog and not os.path.exists(catalog_filename(cache)):
+        return
+
+    try:
+        catalog = AipCatalog(cache)
+        try:
+            catalog.update()
+        finally:
+            catalog.close()
+    except Exception as e:
+        sys.stderr.write("Warnung: Katalog konnte nicht aktualisiert werden: %s\n" % e)
+
 
 def toc_list(args):
     if args.vfr == args.ifr:
@@ -152,11 +216,24 @@ def toc_delete(args):
     pass
 
 
+def toc_catalog(args):
+    from .catalog import AipCatalog
+
+    catalog = AipCatalog(AipCache(basedir = args.cache))
+    for aiptype, airac, filename in catalog.update(refresh = args.refresh):
+        print("%3s  %s  %s" % ( aiptype, airac.isoformat(), filename ))
+    catalog.close()
+
+
 def page_tree(args):
     cache = AipCache(basedir = args.cache)
-    airac = None if args.airac is None else datetime.date.fromisoformat(args.airac)
-    aiptype, airac, filename = cache.get(args.type, airac)
-    toc = AipToc(filename)
+    toc = cache.load(args.type, parse_airac(args.airac))
+
+    if args.format != 'text':
+        fields = [ 'level', 'folder', 'numfirst', 'numlast' ] + PAGE_FIELDS
+        with RecordWriter(args.format, fields) as writer:
+            page_tree_records(writer, toc.toc, toc.datadir)
+        return
 
     show = \
     {
@@ -174,7 +251,20 @@ def page_tree(args):
 
 
 def page_list(args):
-    toc, pagepairs = prepare_pagepairs(args, args.pairs)
+    store = open_catalog(args) if args.catalog else None
+    toc, pagepairs = prepare_pagepairs(args, args.pairs, store = store)
+
+    if args.format != 'text':
+        fields = ( [ 'pair' ] if args.pairs else [] ) + PAGE_FIELDS
+        with RecordWriter(args.format, fields) as writer:
+            for idx, pp in enumerate(pagepairs):
+                for page in pp:
+                    if page is None and not args.pairs:
+                        continue
+                    record = page_record(page, toc.datadir)
+                    record['pair'] = idx
+                    writer.write(record)
+        return
 
     for pageodd, pageeven in pagepairs:
         page_list_show(args, pageodd,  True)
@@ -184,29 +274,39 @@ def page_list(args):
 def page_fetch(args):
     toc, pagepairs = prepare_pagepairs(args, args.pairs)
 
+    filenames = []
     for pageodd, pageeven in pagepairs:
         if pageodd is not None:
-            toc.fetchpage(pageodd, refresh = args.refresh)
+            filenames.append(toc.fetchpage(pageodd, refresh = args.refresh))
         if pageeven is not None:
-            toc.fetchpage(pageeven, refresh = args.refresh)
+            filenames.append(toc.fetchpage(pageeven, refresh = args.refresh))
 
+    if args.variant is not None:
+        from .image import make_variants
+        make_variants([ f for f in filenames if f is not None ], args.variant, jobs = args.jobs, refresh = args.refresh)
 
-def page_diff(args):
-    prefixes = prepare_filter(args.filter)
 
+def page_diff(args):
     cache = AipCache(basedir = args.cache)
-
-    target_airac = None if args.airac is None else datetime.date.fromisoformat(args.airac)
-    _, target_airac, target_filename = cache.get(args.type, target_airac)
-    target_toc = AipToc(target_filename)
-    target_pages = target_toc.filter(prefixes)
-
-    base_airac = datetime.date.fromisoformat(args.base_airac)
-    _, base_airac, base_filename = cache.get(args.type, base_airac)
-    base_toc = AipToc(base_filename)
-    base_pages = base_toc.filter(prefixes)
-
-    pagesdiff = page_amdt(base_pages, target_pages)
+    pagesdiff = prepare_pagediff(args, store = open_catalog(args) if args.catalog else cache)
+
+    if args.format != 'text':
+        datadir = os.path.join(cache.basedir, 'data')
+        fields = [ 'change', 'base_pageid' ] + PAGE_FIELDS
+        with RecordWriter(args.format, fields) as writer:
+            for pbase, ptarget in pagesdiff:
+                if pbase is None:
+                    change = 'added'
+                elif ptarget is None:
+                    change = 'deleted'
+                else:
+                    change = 'changed'
+
+                record = page_record(pbase if ptarget is None else ptarget, datadir)
+                record['change'] = change
+                record['base_pageid'] = None if pbase is None else pbase['pageid']
+                writer.write(record)
+        return
 
     for pbase, ptarget in pagesdiff:
         if pbase is None:
@@ -219,57 +319,488 @@ def page_diff(args):
         print(line)
 
 
+def page_query(args):
+    if args.vfr == args.ifr:
+        types = None
+    else:
+        types = [ 'VFR' ] if args.vfr else [ 'IFR' ]
+
+    catalog = open_catalog(args)
+    pages = catalog.query(types = types, prefixes = args.filter, title = args.title, cycles = args.cycles)
+
+    if args.format != 'text':
+        datadir = os.path.join(catalog.cache.basedir, 'data')
+        with RecordWriter(args.format, [ 'type', 'airac' ] + PAGE_FIELDS) as writer:
+            for page in pages:
+                record = page_record(page, datadir)
+                record['type'] = page['type']
+                record['airac'] = page['airac']
+                writer.write(record)
+        return
+
+    for page in pages:
+        print("%3s  %s  %s:\t%s" % ( page['type'], page['airac'], page.get('prefix', page['name']), page.get('title', "") ))
+
+
+def page_search(args):
+    if args.vfr == args.ifr:
+        types = None
+    else:
+        types = [ 'VFR' ] if args.vfr else [ 'IFR' ]
+
+    catalog = open_catalog(args)
+    pages = catalog.search(" ".join(args.text), types = types, cycles = args.cycles, limit = args.limit)
+
+    if args.format != 'text':
+        datadir = os.path.join(catalog.cache.basedir, 'data')
+        with RecordWriter(args.format, [ 'type', 'airac' ] + PAGE_FIELDS) as writer:
+            for page in pages:
+                record = page_record(page, datadir)
+                record['type'] = page['type']
+                record['airac'] = page['airac']
+                writer.write(record)
+        return
+
+    for page in pages:
+        print("%3s  %s  %s:\t%s" % ( page['type'], page['airac'], page.get('prefix', page['name']), page.get('title', "") ))
+
+
 def page_purge(args):
     pass
 
 
 def pdf_summary(args):
     toc, pagepairs = prepare_pagepairs(args, args.pairs)
+    result = write_summary(toc, pagepairs, args.output,
+        pairs    = args.pairs,
+        refresh  = args.refresh,
+        previous = args.output if args.update else None,
+        jobs     = args.jobs,
+        profile  = args.profile,
+        variant  = args.variant)
+
+    print(summary_report(args.output, args.profile, result))
+
+
+def pdf_preview(args):
+    from .preview import make_tiles
+    from .preview import write_contact_sheets
+    from .preview import write_gallery
+
+    toc, pagepairs = prepare_pagepairs(args, args.pairs)
+    if args.pairs:
+        pages = [ p for pp in pagepairs for p in pp ]
+    else:
+        pages = [ p for pp in pagepairs for p in pp if p is not None ]
+
+    tiles = make_tiles(toc, pages, refresh = args.refresh, jobs = args.jobs)
+
+    if args.output.endswith('.html'):
+        title = "AIP %s" % args.type
+        if args.base_airac is not None:
+            title += " – Änderungen seit %s" % args.base_airac
+        write_gallery(pages, tiles, args.output, title)
+        print("%s: %d Seiten" % ( args.output, len(pages) ))
+    elif args.output.endswith('.pdf'):
+        sheets = write_contact_sheets(pages, tiles, args.output, columns = args.columns, rows = args.rows)
+        print("%s: %d Seiten auf %d Kontaktabzügen" % ( args.output, len(pages), sheets ))
+    else:
+        raise ValueError("Ausgabedatei '%s' muss auf '.pdf' oder '.html' enden" % args.output)
+
+
+#
+# Ausschießen aus `online/vfr_print.py` laden
+#
+def load_imposer():
+    from .online import load_online
+
+    return load_online('vfr_print').Imposer
+
+
+#
+# Druckdokument erstellen
+#
+# Die Seiten werden direkt aus dem Cache ausgeschossen, ohne zuvor eine
+# Zusammenfassung zu schreiben und wieder einzulesen. Jede Seite wird erst beim
+# Einsortieren geöffnet.
+#
+def pdf_print(args):
+    Imposer = load_imposer()
+
+    toc, pagepairs = prepare_pagepairs(args, args.pairs)
+    plan = summary_plan(toc, pagepairs, refresh = args.refresh)
+
+    imposer = Imposer(
+        cropmark   = args.cropmark,
+        punchmark  = args.punchmark,
+        foldmark   = args.foldmark,
+        tc_to_a4   = args.tc_to_a4,
+        misc_to_a4 = args.misc_to_a4)
+
+    def pages():
+        for entry in ( e for pp in plan for e in pp ):
+            if entry is None:
+                # Fehlende Vorder- bzw. Rückseiten bleiben leer
+                if args.pairs:
+                    yield None
+                continue
+
+            filename = entry[0]
+            yield filename, imposer.pool.open(filename).pages[0].obj
+
+    imposer.add_pages(pages())
+
+    # Nur tatsächlich ausgeschossene Seiten zählen. Seiten unbekannten
+    # Formats werden ohne `--misc-to-a4` verworfen.
+    page_count = sum(s['pages'] for s in imposer.stats().values())
+    sheets = imposer.write(args.output, jobs = 1 if args.jobs is None else args.jobs)
+
+    print("%s: %d Seiten auf %d Bögen" % ( args.output, page_count, sheets ))
+
+
+def summary_report(output, profile, result):
+    page_count, savetime, size = result
+
+    return "%s: %d Seiten, %.1f MB, gespeichert in %.2f s (Profil '%s')" % \
+        (
+            output,
+            page_count,
+            size / 1024.0 / 1024.0,
+            savetime,
+            profile,
+        )
+
+
+def write_summary(toc, pagepairs, output, pairs = False, refresh = False, previous = None, jobs = None, profile = 'web', variant = None):
+    plan = summary_plan(toc, pagepairs, refresh = refresh)
+    if variant is not None:
+        plan = summary_variant(plan, variant, jobs = jobs)
+
+    if jobs is not None and jobs > 1 and previous is None:
+        return write_summary_chunked(plan, output, pairs = pairs, jobs = jobs, profile = profile, variant = variant)
+
+    return write_summary_plan(plan, output, pairs = pairs, previous = previous, profile = profile, variant = variant)
+
+
+#
+# Seiten einer Zusammenfassung herunterladen
+#
+# Das Ergebnis enthält je Seitenpaar Dateiname, Name, Seitenkennung und Boxen
+# (aus dem Metadatenindex) der Vorder- und Rückseite bzw. `None`. Es enthält
+# keine Verweise auf das Inhaltsverzeichnis und kann daher an andere Prozesse
+# übergeben werden. Über `fetched` lassen sich bereits heruntergeladene Seiten
+# mehrerer Zusammenfassungen teilen.
+#
+def summary_plan(toc, pagepairs, refresh = False, fetched = None):
+    if fetched is None:
+        fetched = {}
+
+    def fetch(page):
+        if page is None:
+            return None
+
+        if page['pageid'] not in fetched:
+            fetched[page['pageid']] = toc.fetchpage(page, refresh = refresh)
+
+        filename = fetched[page['pageid']]
+        boxes = toc.pageinfo(page)['boxes'][0]
+
+        return ( filename, page['name'], page['pageid'], boxes )
+
+    return [ ( fetch(pageodd), fetch(pageeven) ) for pageodd, pageeven in pagepairs ]
+
+
+#
+# Seiten einer Zusammenfassung durch ihre Bildvariante ersetzen. Fehlende
+# Varianten werden parallel erzeugt.
+#
+def summary_variant(plan, variant, jobs = None):
+    from .image import make_variants
+
+    variants = make_variants([ e[0] for pp in plan for e in pp if e is not None ], variant, jobs = jobs)
+
+    def replace(entry):
+        if entry is None:
+            return None
+
+        filename, name, pageid, boxes = entry
+        return ( variants[filename], name, pageid, boxes )
+
+    return [ ( replace(pageodd), replace(pageeven) ) for pageodd, pageeven in plan ]
+
+
+#
+# Zu jeder Zusammenfassung wird eine Seitenzuordnung (Seite im PDF ->
+# Seitenkennung) samt Speicherprofil und Bildvariante abgelegt. Anhand dieser
+# lassen sich unveränderte Seiten bei der nächsten Ausgabe übernehmen. Wurde
+# die vorherige Ausgabe mit anderem Profil oder anderer Variante erstellt, wird
+# nichts übernommen.
+#
+def summary_mapfile(output):
+    return output + '.json'
+
+
+def load_summary_map(output, profile = 'web', variant = None):
+    try:
+        with open(summary_mapfile(output)) as f:
+            pagemap = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    if not isinstance(pagemap, dict) or pagemap.get('version') != 1:
+        return None
+
+    if pagemap.get('profile') != profile or pagemap.get('variant') != variant:
+        return None
+
+    return pagemap['pages']
+
+
+def store_summary_map(output, pagemap, profile = 'web', variant = None):
+    with open(summary_mapfile(output), 'w') as f:
+        json.dump({ 'version': 1, 'profile': profile, 'variant': variant, 'pages': pagemap }, f)
+
+
+def write_summary_plan(plan, output, pairs = False, previous = None, chunk = False, profile = 'web', variant = None):
+    import pikepdf
+
+    from .pdf import ResourceDedup
+    from .pdf import save
+
+    # Ist eine vorherige Ausgabe samt Seitenzuordnung vorhanden, bauen wir
+    # darauf auf. Seiten mit unveränderter Kennung werden übernommen, nur
+    # geänderte Seiten werden aus dem Cache eingelesen.
+    reuse = {}
+    prevmap = None if previous is None or not os.path.exists(previous) else load_summary_map(previous, profile, variant)
+
+    if prevmap is not None:
+        out = pikepdf.Pdf.open(previous, allow_overwriting_input = True)
+        oldpages = list(out.pages)
+
+        if len(oldpages) == len(prevmap):
+            reuse = { pageid: oldpages[idx] for idx, pageid in enumerate(prevmap) if pageid is not None }
+
+        del out.pages[:]
+        if '/Outlines' in out.Root:
+            del out.Root.Outlines
+    else:
+        out = pikepdf.Pdf.new()
 
-    out = pikepdf.Pdf.new()
     out.Root.PageLayout = pikepdf.Name.SinglePage
     out.Root.PageMode = pikepdf.Name.UseOutlines
 
+    # Die geöffneten Dokumente müssen erhalten bleiben, bis die Seite in die
+    # Ausgabe kopiert wurde.
+    def loadpage(entry):
+        if entry is None:
+            return None, None
+
+        filename, name, pageid, boxes = entry
+        if pageid in reuse:
+            return None, reuse[pageid]
+
+        pdf = pikepdf.Pdf.open(filename)
+        return pdf, pdf.pages[0]
+
+    dedup = ResourceDedup()
+
+    pagemap = []
     page_count = 0
     with out.open_outline() as outline:
-        for pageodd, pageeven in pagepairs:
-            if pageodd is None:
-                pdfodd = None
-                boxodd = None
-            else:
-                fileodd = toc.fetchpage(pageodd, refresh = args.refresh)
-                pdfodd = pikepdf.Pdf.open(fileodd)
-                boxodd = pdfodd.pages[0].trimbox
-
-            if pageeven is None:
-                pdfeven = None
-                boxeven = None
-            else:
-                fileeven = toc.fetchpage(pageeven, refresh = args.refresh)
-                pdfeven = pikepdf.Pdf.open(fileeven)
-                boxeven = pdfeven.pages[0].mediabox
+        for pageodd, pageeven in plan:
+            # Die Größe der Leerseiten wird dem Metadatenindex entnommen.
+            pdfodd, sourceodd = loadpage(pageodd)
+            boxodd = None if pageodd is None else pageodd[3]['trimbox']
+
+            pdfeven, sourceeven = loadpage(pageeven)
+            boxeven = None if pageeven is None else pageeven[3]['mediabox']
 
             if pageodd is not None:
-                pagename = pageodd["name"]
-                outline.root.append(pikepdf.OutlineItem(pagename, page_count))
-                out.pages.append(pdfodd.pages[0])
+                outline.root.append(pikepdf.OutlineItem(pageodd[1], page_count))
+                out.pages.append(sourceodd)
+                dedup.page(out.pages[-1])
+                pagemap.append(pageodd[2])
                 page_count += 1
-            elif args.pairs:
+            elif pairs:
                 out.add_blank_page(page_size = ( abs(boxeven[2] - boxeven[0]), abs(boxeven[3] - boxeven[1]) ))
+                pagemap.append(None)
                 page_count += 1
 
             if pageeven is not None:
-                pagename = pageeven["name"]
-                outline.root.append(pikepdf.OutlineItem(pagename, page_count))
-                out.pages.append(pdfeven.pages[0])
+                outline.root.append(pikepdf.OutlineItem(pageeven[1], page_count))
+                out.pages.append(sourceeven)
+                dedup.page(out.pages[-1])
+                pagemap.append(pageeven[2])
                 page_count += 1
-            elif args.pairs:
+            elif pairs:
                 out.add_blank_page(page_size = ( abs(boxodd[2] - boxodd[0]), abs(boxodd[3] - boxodd[1]) ))
+                pagemap.append(None)
                 page_count += 1
 
-    out.save(
-        args.output,
-        object_stream_mode = pikepdf.ObjectStreamMode.generate,
-        stream_decode_level = pikepdf.StreamDecodeLevel.specialized,
-        linearize = True
-    )
+    # Teildokumente werden ohnehin noch einmal zusammengeführt und deshalb
+    # ohne Optimierung gespeichert.
+    if chunk:
+        save(out, output, profile = 'fast')
+        return pagemap
+
+    savetime, size = save(out, output, profile = profile)
+
+    store_summary_map(output, pagemap, profile, variant)
+
+    return page_count, savetime, size
+
+
+#
+# Zusammenfassung in Teilen parallel erzeugen
+#
+# Die Seitenpaare werden auf mehrere Teildokumente aufgeteilt, die in eigenen
+# Prozessen erzeugt werden. Anschließend werden die Teildokumente samt
+# Lesezeichen zusammengeführt.
+#
+def write_summary_chunked(plan, output, pairs = False, jobs = None, profile = 'web', variant = None):
+    import concurrent.futures
+    import tempfile
+
+    from .pdf import merge
+
+    # Ohne Seiten gibt es nichts aufzuteilen
+    if not plan:
+        return write_summary_plan(plan, output, pairs = pairs, profile = profile, variant = variant)
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    chunkcount = max(1, min(len(plan), 2 * jobs))
+    chunksize = -(-len(plan) // chunkcount)
+    chunks = [ plan[i : i + chunksize] for i in range(0, len(plan), chunksize) ]
+
+    outdir = os.path.dirname(os.path.abspath(output))
+    with tempfile.TemporaryDirectory(dir = outdir) as tmpdir:
+        chunkfiles = [ os.path.join(tmpdir, 'chunk-%04d.pdf' % idx) for idx in range(len(chunks)) ]
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers = jobs) as executor:
+            futures = [ executor.submit(write_summary_plan, c, f, pairs = pairs, chunk = True) for c, f in zip(chunks, chunkfiles) ]
+            pagemap = [ pageid for future in futures for pageid in future.result() ]
+
+        result = merge(chunkfiles, output, profile = profile)
+
+    store_summary_map(output, pagemap, profile, variant)
+
+    return result
+
+
+#
+# Inhaltsverzeichnisse nur einmal einlesen
+#
+class AipTocMemo:
+    def __init__(self, cache):
+        self.cache = cache
+        self.tocs = {}
+
+
+    def load(self, aiptype, airac = None):
+        entry = self.cache.get(aiptype, airac)
+        if entry is None:
+            return self.cache.load(aiptype, airac)
+
+        _, _, filename = entry
+        if filename not in self.tocs:
+            self.tocs[filename] = AipToc(filename)
+
+        return self.tocs[filename]
+
+
+def load_manifest(filename):
+    with open(filename) as f:
+        if filename.endswith('.yaml') or filename.endswith('.yml'):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError("Für YAML-Manifeste wird das Paket 'PyYAML' benötigt.")
+            manifest = yaml.safe_load(f)
+        else:
+            manifest = json.load(f)
+
+    if not isinstance(manifest, dict) or not isinstance(manifest.get('outputs'), list):
+        raise ValueError("Manifest '%s' enthält keine Liste 'outputs'." % filename)
+
+    return manifest
+
+
+def pdf_batch(args):
+    import concurrent.futures
+
+    manifest = load_manifest(args.manifest)
+
+    # Gemeinsame Vorgaben, die je Ausgabe überschrieben werden können
+    defaults = \
+    {
+        'type':       manifest.get('type'),
+        'airac':      manifest.get('airac'),
+        'base_airac': manifest.get('base_airac'),
+        'filter':     manifest.get('filter'),
+        'pairs':      manifest.get('pairs', False),
+        'profile':    manifest.get('profile', args.profile),
+        'variant':    manifest.get('variant', args.variant),
+    }
+
+    store = AipTocMemo(AipCache(basedir = args.cache))
+    fetched = {}
+    jobs = []
+
+    # Ausgabeverzeichnisse vor dem Herunterladen anlegen, damit ein Fehler
+    # nicht erst beim Speichern auffällt.
+    os.makedirs(args.output, exist_ok = True)
+
+    # Inhaltsverzeichnisse einlesen und Seiten herunterladen. Jede Seite wird
+    # auch bei mehrfacher Verwendung nur einmal heruntergeladen.
+    for idx, entry in enumerate(manifest['outputs']):
+        if 'output' not in entry:
+            raise ValueError("Eintrag %d im Manifest enthält keine Ausgabedatei." % ( idx + 1 ))
+
+        jobargs = argparse.Namespace(**defaults)
+        for k in defaults:
+            if k in entry:
+                setattr(jobargs, k, entry[k])
+
+        if jobargs.type not in [ 'VFR', 'IFR' ]:
+            raise ValueError("Ungültiger AIP-Typ '%s' für '%s'." % ( jobargs.type, entry['output'] ))
+
+        name = entry.get('name', entry['output'])
+        output = os.path.join(args.output, entry['output'])
+        os.makedirs(os.path.dirname(output), exist_ok = True)
+
+        toc, pagepairs = prepare_pagepairs(jobargs, jobargs.pairs, store = store)
+        plan = summary_plan(toc, pagepairs, refresh = args.refresh, fetched = fetched)
+        if jobargs.variant is not None:
+            plan = summary_variant(plan, jobargs.variant, jobs = args.jobs)
+        jobs.append(( name, plan, output, jobargs.pairs, output if args.update else None, jobargs.profile, jobargs.variant ))
+
+    # PDF-Dokumente parallel erzeugen
+    with concurrent.futures.ProcessPoolExecutor(max_workers = args.jobs) as executor:
+        futures = \
+        [
+            executor.submit(write_summary_plan, plan, output, pairs = pairs, previous = previous, profile = profile, variant = variant)
+            for name, plan, output, pairs, previous, profile, variant in jobs
+        ]
+
+        for ( name, plan, output, pairs, previous, profile, variant ), future in zip(jobs, futures):
+            print("%s: %s" % ( name, summary_report(output, profile, future.result()) ))
+
+
+def serve(args):
+    from .server import AipTocStore
+    from .server import run_server
+
+    store = AipTocStore(AipCache(basedir = args.cache), keep = args.keep)
+    store.refresh()
+
+    if args.socket is not None:
+        run_server(store, socketpath = args.socket, outdir = args.output_dir)
+        return
+
+    # Ohne Angabe nur lokal erreichbar
+    host, _, port = args.http.rpartition(':')
+    if host == '':
+        host = '127.0.0.1'
+    run_server(store, address = ( host, int(port) ), outdir = args.output_dir)
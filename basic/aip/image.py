@@ -0,0 +1,263 @@
+#
+# Copyright (C) 2022-2023 Mario Haustein, mario@mariohaustein.de
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+from io import BytesIO
+import os
+import zlib
+
+import pikepdf
+from PIL import Image
+from PIL import ImageChops
+
+from .tmpfile import make_tmpfile
+from .tmpfile import remove_tmpfile
+
+
+
+#
+# Bildvarianten der Einzelseiten
+#
+# Die Seiten der AIP VFR liegen als Rasterbilder mit 300 dpi vor, die PIL als
+# unkomprimierte Palettenbilder in das PDF schreibt. Für die Anzeige auf
+# Tablets und Telefonen genügen geringere Auflösungen und verlustbehaftete
+# Kompression.
+#
+# - dpi:         Zielauflösung bezogen auf die Seitenbreite
+# - color:       Farbreduktion
+#                  color   - Farben unverändert übernehmen
+#                  palette - auf `colors` Farben reduzieren
+#                  gray    - in Graustufen umwandeln
+#                  mono    - in Schwarz-Weiß umwandeln
+#                  auto    - Graustufen bzw. Schwarz-Weiß, wenn die Seite keine
+#                            Farben enthält, sonst unverändert
+# - compression: jpeg oder flate. Schwarz-Weiß-Bilder werden immer als
+#                1-Bit-Bild mit Flate komprimiert.
+# - quality:     JPEG-Qualität
+#
+IMAGE_VARIANTS = \
+{
+    'tablet':
+    {
+        'dpi':         150,
+        'color':       'auto',
+        'compression': 'jpeg',
+        'quality':     75,
+    },
+    'phone':
+    {
+        'dpi':         100,
+        'color':       'auto',
+        'compression': 'jpeg',
+        'quality':     60,
+    },
+    'print':
+    {
+        'dpi':         300,
+        'color':       'palette',
+        'colors':      64,
+        'compression': 'flate',
+    },
+    'mono':
+    {
+        'dpi':         200,
+        'color':       'mono',
+        'compression': 'flate',
+    },
+}
+
+# Schwellwert für Schwarz-Weiß-Seiten: Anteil der Bildpunkte, die weder
+# (nahezu) schwarz noch (nahezu) weiß sind.
+_MONO_THRESHOLD = 0.01
+
+
+
+def variant_file(filename, variant):
+    root, ext = os.path.splitext(filename)
+    return '%s.%s%s' % ( root, variant, ext )
+
+
+def _colormode(img, settings):
+    color = settings['color']
+    if color != 'auto':
+        return color
+
+    if img.mode in [ '1' ]:
+        return 'mono'
+
+    rgb = img.convert('RGB')
+    r, g, b = rgb.split()
+
+    # Enthält die Seite Farben?
+    if ImageChops.difference(r, g).getextrema()[1] > 8 or \
+       ImageChops.difference(g, b).getextrema()[1] > 8:
+        return 'color'
+
+    histogram = rgb.convert('L').histogram()
+    mid = sum(histogram[32:224])
+    if mid <= _MONO_THRESHOLD * rgb.width * rgb.height:
+        return 'mono'
+
+    return 'gray'
+
+
+#
+# Bild umwandeln. Zurückgegeben werden der komprimierte Inhalt und das
+# zugehörige Bildwörterbuch.
+#
+def _encode(img, mode, settings):
+    if mode == 'mono':
+        img = img.convert('L').point(lambda x : 255 if x >= 128 else 0).convert('1')
+        return zlib.compress(img.tobytes(), 9), \
+            {
+                '/ColorSpace':       pikepdf.Name.DeviceGray,
+                '/BitsPerComponent': 1,
+                '/Filter':           pikepdf.Name.FlateDecode,
+            }
+
+    if mode == 'gray':
+        img = img.convert('L')
+        colorspace = pikepdf.Name.DeviceGray
+    elif mode == 'palette':
+        img = img.convert('RGB').quantize(colors = settings.get('colors', 256))
+        colorspace = None
+    else:
+        img = img.convert('RGB')
+        colorspace = pikepdf.Name.DeviceRGB
+
+    # Palettenbilder lassen sich nicht als JPEG speichern.
+    if settings['compression'] == 'jpeg' and img.mode != 'P':
+        data = BytesIO()
+        img.save(data, format = 'JPEG', quality = settings.get('quality', 75), optimize = True)
+        return data.getvalue(), \
+            {
+                '/ColorSpace':       colorspace,
+                '/BitsPerComponent': 8,
+                '/Filter':           pikepdf.Name.DCTDecode,
+            }
+
+    if img.mode == 'P':
+        palette = img.getpalette()[:3 * ( img.getextrema()[1] + 1 )]
+        colorspace = pikepdf.Array([ pikepdf.Name.Indexed, pikepdf.Name.DeviceRGB, len(palette) // 3 - 1, pikepdf.String(bytes(palette)) ])
+
+    return zlib.compress(img.tobytes(), 9), \
+        {
+            '/ColorSpace':       colorspace,
+            '/BitsPerComponent': 8,
+            '/Filter':           pikepdf.Name.FlateDecode,
+        }
+
+
+def _convert_image(raw, pagewidth, settings):
+    # Masken und Bilder mit Transparenz unverändert lassen
+    if raw.get('/ImageMask', False) or '/SMask' in raw or '/Mask' in raw:
+        return False
+
+    try:
+        img = pikepdf.PdfImage(raw).as_pil_image()
+    except (pikepdf.PdfError, NotImplementedError, ValueError):
+        return False
+
+    # Die Farbreduktion anhand des Originals bestimmen, da beim Verkleinern
+    # Zwischentöne entstehen.
+    mode = _colormode(img, settings)
+
+    # Die Rasterseiten füllen die ganze Seite aus. Die Auflösung wird daher
+    # anhand der Seitenbreite bestimmt.
+    scale = settings['dpi'] * pagewidth / 72.0 / img.width
+    if scale < 1.0:
+        size = ( max(1, round(img.width * scale)), max(1, round(img.height * scale)) )
+        if img.mode in [ '1', 'P' ]:
+            img = img.convert('RGB')
+        img = img.resize(size, Image.LANCZOS)
+
+    data, params = _encode(img, mode, settings)
+
+    # Nur ersetzen, wenn das Bild tatsächlich kleiner wird
+    if len(data) >= len(raw.read_raw_bytes()):
+        return False
+
+    raw.write(data, filter = params['/Filter'])
+    raw.Width = img.width
+    raw.Height = img.height
+    raw.ColorSpace = params['/ColorSpace']
+    raw.BitsPerComponent = params['/BitsPerComponent']
+    for key in [ '/DecodeParms', '/Decode' ]:
+        if key in raw:
+            del raw[key]
+
+    return True
+
+
+#
+# Bildvariante einer Einzelseite erzeugen
+#
+# Die Variante wird neben der Originaldatei abgelegt (`<pageid>.<variante>.pdf`)
+# und nur neu erzeugt, wenn das Original jünger ist.
+#
+def make_variant(filename, variant, refresh = False):
+    if variant not in IMAGE_VARIANTS:
+        raise ValueError("Unbekannte Bildvariante '%s'" % variant)
+
+    settings = IMAGE_VARIANTS[variant]
+    output = variant_file(filename, variant)
+
+    if not refresh and os.path.exists(output) and \
+       os.stat(output).st_mtime_ns >= os.stat(filename).st_mtime_ns:
+        return output
+
+    pdf = pikepdf.Pdf.open(filename)
+
+    for page in pdf.pages:
+        box = page.mediabox
+        pagewidth = abs(float(box[2]) - float(box[0]))
+
+        if '/Resources' not in page.obj or '/XObject' not in page.obj.Resources:
+            continue
+
+        for name, raw in page.obj.Resources.XObject.items():
+            if raw.get('/Subtype') == pikepdf.Name.Image:
+                _convert_image(raw, pagewidth, settings)
+
+    # In eine eigene temporäre Datei schreiben, damit ein Abbruch keine halben
+    # Varianten im Cache hinterlässt und sich gleichzeitige Aufrufe nicht in
+    # die Quere kommen.
+    tmpfile = make_tmpfile(output)
+    try:
+        pdf.save(tmpfile, object_stream_mode = pikepdf.ObjectStreamMode.generate)
+        os.replace(tmpfile, output)
+    finally:
+        remove_tmpfile(tmpfile)
+
+    return output
+
+
+#
+# Bildvarianten mehrerer Seiten parallel erzeugen. Zurückgegeben wird eine
+# Zuordnung Originaldatei -> Variante.
+#
+def make_variants(filenames, variant, jobs = None, refresh = False):
+    import concurrent.futures
+
+    filenames = sorted(set(filenames))
+
+    if jobs == 1 or len(filenames) <= 1:
+        return { f: make_variant(f, variant, refresh = refresh) for f in filenames }
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers = jobs) as executor:
+        futures = [ executor.submit(make_variant, f, variant, refresh = refresh) for f in filenames ]
+        return { f: future.result() for f, future in zip(filenames, futures) }
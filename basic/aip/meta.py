@@ -0,0 +1,200 @@
+#
+# Copyright (C) 2022-2023 Mario Haustein, mario@mariohaustein.de
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import hashlib
+import json
+import os
+import threading
+
+
+
+# Version der Indexeinträge. Ältere Einträge werden neu eingelesen.
+META_VERSION = 2
+
+# Papierformate in mm (Breite x Höhe im Hochformat). Tabelle und Toleranz
+# entsprechen `online/aip_lib.py`, damit Index und Ausschießen dieselben
+# Formate erkennen.
+PAPER_FORMATS = \
+[
+    ( "A5",  148,  210 ),
+    ( "A4n", 210,  277 ),
+    ( "A4",  210,  297 ),
+    ( "A3",  297,  420 ),
+    ( "A0",  841, 1189 ),
+    ( "TC",  297,  380 ),
+]
+
+# Zulässige Abweichung von den Formatmaßen in mm
+PAPER_TOLERANCE = 1
+
+
+
+#
+# Größe einer Box in mm. Die Koordinaten werden einzeln auf ganze Millimeter
+# gerundet.
+#
+def box_size(box):
+    box = [ round(float(x) / 72.0 * 25.4) for x in box ]
+    return abs(box[2] - box[0]), abs(box[3] - box[1])
+
+
+#
+# Papierformat und Ausrichtung einer Größe in mm bestimmen. Unbekannte Formate
+# werden als "<Breite>x<Höhe>" ohne Ausrichtung geliefert.
+#
+def paper_format(width, height, tolerance = PAPER_TOLERANCE):
+    short = min(width, height)
+    long  = max(width, height)
+
+    for paper, pwidth, pheight in PAPER_FORMATS:
+        if abs(short - pwidth) <= tolerance and abs(long - pheight) <= tolerance:
+            return paper, "p" if height > width else "l"
+
+    return "%dx%d" % ( width, height ), None
+
+
+#
+# Metadaten einer Seiten-PDF auslesen
+#
+def scan_page(filename):
+    import pikepdf
+
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda : f.read(1 << 20), b''):
+            digest.update(block)
+
+    stat = os.stat(filename)
+    boxes = []
+
+    with pikepdf.Pdf.open(filename) as pdf:
+        for p in pdf.pages:
+            mediabox = [ float(x) for x in p.mediabox ]
+            cropbox  = [ float(x) for x in p.cropbox  ]
+            trimbox  = [ float(x) for x in p.trimbox  ]
+            paper, orient = paper_format(*box_size(trimbox))
+
+            boxes.append(
+                {
+                    'mediabox': mediabox,
+                    'cropbox':  cropbox,
+                    'trimbox':  trimbox,
+                    'rotate':   int(p.obj.get('/Rotate', 0)),
+                    'paper':    paper,
+                    'orient':   orient,
+                })
+
+    return \
+    {
+        'version': META_VERSION,
+        'file':    os.path.basename(filename),
+        'size':    stat.st_size,
+        'mtime':   stat.st_mtime_ns,
+        'sha256':  digest.hexdigest(),
+        'pages':   len(boxes),
+        'boxes':   boxes,
+    }
+
+
+
+#
+# Metadatenindex der heruntergeladenen Seiten
+#
+# Beim Herunterladen einer Seite werden Seitenzahl, Boxen, Rotation,
+# Papierformat und Prüfsumme im Index (`data/index.jsonl`) vermerkt. Damit
+# lassen sich Layoutentscheidungen treffen, ohne jede Seite zu öffnen.
+#
+# Der Index wird nur fortgeschrieben, je Seite eine Zeile. Beim Einlesen gilt
+# der letzte Eintrag einer Seite. Enthält die Datei überwiegend veraltete
+# Einträge, wird sie neu geschrieben. Fehlt ein Eintrag, stammt er von einer
+# älteren Version oder passen Größe bzw. Änderungszeit nicht mehr zur Datei,
+# wird die Seite erneut eingelesen.
+#
+class PageIndex:
+    def __init__(self, datadir: str):
+        self.filename = os.path.join(datadir, 'index.jsonl')
+        self.datadir = datadir
+
+        self._lock = threading.Lock()
+        self._entries = None
+
+
+    def _load(self):
+        entries = {}
+        lines = 0
+
+        try:
+            with open(self.filename) as f:
+                for line in f:
+                    try:
+                        pageid, meta = json.loads(line)
+                    except ValueError:
+                        # Abgebrochener Schreibvorgang
+                        continue
+                    entries[pageid] = meta
+                    lines += 1
+        except FileNotFoundError:
+            pass
+
+        if lines > 2 * len(entries) + 100:
+            self._compact(entries)
+
+        return entries
+
+
+    def _compact(self, entries):
+        tmpfile = self.filename + '.tmp'
+        with open(tmpfile, 'w') as f:
+            for pageid, meta in entries.items():
+                f.write(json.dumps([ pageid, meta ]) + '\n')
+        os.replace(tmpfile, self.filename)
+
+
+    def _entries_locked(self):
+        if self._entries is None:
+            self._entries = self._load()
+        return self._entries
+
+
+    def record(self, pageid, filename):
+        meta = scan_page(filename)
+
+        with self._lock:
+            self._entries_locked()[pageid] = meta
+            with open(self.filename, 'a') as f:
+                f.write(json.dumps([ pageid, meta ]) + '\n')
+
+        return meta
+
+
+    def get(self, pageid, filename = None):
+        with self._lock:
+            meta = self._entries_locked().get(pageid)
+
+        if filename is None:
+            return meta
+
+        try:
+            stat = os.stat(filename)
+        except FileNotFoundError:
+            return None
+
+        if meta is None or meta.get('version') != META_VERSION or meta['size'] != stat.st_size or meta['mtime'] != stat.st_mtime_ns:
+            meta = self.record(pageid, filename)
+
+        return meta
@@ -0,0 +1,41 @@
+#
+# Copyright (C) 2022-2023 Mario Haustein, mario@mariohaustein.de
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import importlib
+import os
+import sys
+
+
+
+# Verzeichnis der Werkzeuge für Online-Dokumente
+ONLINE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'online')
+
+
+
+#
+# Modul aus dem Verzeichnis der Online-Werkzeuge laden
+#
+# Die Skripte der Online-Ausgabe bilden kein Paket. Ihr Verzeichnis wird daher
+# erst beim ersten Aufruf in den Suchpfad aufgenommen, damit die Module samt
+# pikepdf nur bei Bedarf geladen werden.
+#
+def load_online(name):
+    if ONLINE_DIR not in sys.path:
+        sys.path.append(ONLINE_DIR)
+
+    return importlib.import_module(name)
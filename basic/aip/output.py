@@ -0,0 +1,117 @@
+#
+# Copyright (C) 2022-2023 Mario Haustein, mario@mariohaustein.de
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import csv
+import json
+import os
+import sys
+
+
+
+# Felder einer Seite in maschinenlesbaren Ausgaben
+PAGE_FIELDS = [ 'num', 'prefix', 'pageid', 'href', 'odd', 'title', 'name', 'file' ]
+
+
+
+def page_record(page, datadir):
+    if page is None:
+        return { k: None for k in PAGE_FIELDS }
+
+    record = { k: page.get(k) for k in PAGE_FIELDS }
+
+    if 'folder' in page:
+        record['file'] = None
+    else:
+        filename = os.path.join(datadir, page['pageid'] + '.pdf')
+        record['file'] = filename if os.path.exists(filename) else None
+
+    return record
+
+
+
+#
+# Datensätze maschinenlesbar ausgeben
+#
+# Alle Datensätze werden über einen gemeinsamen, gepufferten Datenstrom
+# geschrieben. Bei JSON wird das Feld schrittweise ausgegeben, ohne alle
+# Datensätze im Speicher zu sammeln.
+#
+class RecordWriter:
+    FORMATS = [ 'json', 'jsonl', 'csv' ]
+
+
+    def __init__(self, format: str, fields, stream = None, buffersize: int = 1 << 16):
+        if format not in self.FORMATS:
+            raise ValueError("Unbekanntes Ausgabeformat '%s'" % format)
+
+        self.format = format
+        self.fields = fields
+        self.count = 0
+
+        if stream is None:
+            sys.stdout.flush()
+            stream = open(sys.stdout.fileno(), 'w', buffering = buffersize, encoding = 'utf-8', newline = '', closefd = False)
+            self._ownstream = True
+        else:
+            self._ownstream = False
+
+        self.stream = stream
+
+        if format == 'csv':
+            self._csv = csv.DictWriter(stream, fieldnames = fields, extrasaction = 'ignore')
+            self._csv.writeheader()
+        elif format == 'json':
+            stream.write('[')
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+    def write(self, record):
+        record = { k: record.get(k) for k in self.fields }
+
+        if self.format == 'csv':
+            self._csv.writerow(record)
+        elif self.format == 'jsonl':
+            self.stream.write(json.dumps(record, ensure_ascii = False))
+            self.stream.write('\n')
+        else:
+            self.stream.write(',\n' if self.count else '\n')
+            self.stream.write(json.dumps(record, ensure_ascii = False))
+
+        self.count += 1
+
+
+    def close(self):
+        if self.stream is None:
+            return
+
+        if self.format == 'json':
+            self.stream.write('\n]\n' if self.count else ']\n')
+
+        if self._ownstream:
+            self.stream.close()
+        else:
+            self.stream.flush()
+
+        self.stream = None
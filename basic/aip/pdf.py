@@ -0,0 +1,210 @@
+#
+# Copyright (C) 2022-2023 Mario Haustein, mario@mariohaustein.de
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import hashlib
+import os
+import pikepdf
+import threading
+import time
+
+
+
+#
+# Speicherprofile
+#
+# - fast:  Keine Linearisierung, keine Neukomprimierung. Für Dokumente, die nur
+#          lokal gedruckt werden.
+# - small: Objektströme und maximale Neukomprimierung aller Flate-Ströme
+#          einschließlich der Bilder.
+# - web:   Objektströme und Linearisierung für die Anzeige im Web-Browser.
+#
+SAVE_PROFILES = \
+{
+    'fast':
+    {
+        'object_stream_mode':  pikepdf.ObjectStreamMode.preserve,
+        'stream_decode_level': pikepdf.StreamDecodeLevel.none,
+    },
+    'small':
+    {
+        'object_stream_mode':  pikepdf.ObjectStreamMode.generate,
+        'stream_decode_level': pikepdf.StreamDecodeLevel.generalized,
+        'recompress_flate':    True,
+        'flate_level':         9,
+    },
+    'web':
+    {
+        'object_stream_mode':  pikepdf.ObjectStreamMode.generate,
+        'stream_decode_level': pikepdf.StreamDecodeLevel.specialized,
+        'linearize':           True,
+    },
+}
+
+
+# Die Kompressionsstufe von pikepdf gilt für den ganzen Prozess. Gleichzeitige
+# Speichervorgänge, z.B. im Server, werden daher nacheinander ausgeführt.
+_save_lock = threading.Lock()
+
+
+#
+# Dokument mit dem angegebenen Profil speichern. Zurückgegeben werden die
+# benötigte Zeit in Sekunden und die Dateigröße in Byte.
+#
+def save(pdf, output, profile = 'web'):
+    if profile not in SAVE_PROFILES:
+        raise ValueError("Unbekanntes Speicherprofil '%s'" % profile)
+
+    saveargs = dict(SAVE_PROFILES[profile])
+    level = saveargs.pop('flate_level', None)
+
+    # Dokumente ohne Seiten lassen sich nicht linearisieren
+    if len(pdf.pages) == 0:
+        saveargs.pop('linearize', None)
+
+    with _save_lock:
+        start = time.perf_counter()
+
+        if level is not None:
+            pikepdf.settings.set_flate_compression_level(level)
+        try:
+            pdf.save(output, **saveargs)
+        finally:
+            if level is not None:
+                pikepdf.settings.set_flate_compression_level(-1)
+
+    return time.perf_counter() - start, os.path.getsize(output)
+
+
+#
+# Gemeinsame Ressourcen zusammenführen
+#
+# Jede Einzelseite bringt eigene Kopien von Schriften, Farbprofilen und Bildern
+# mit. Beim Einfügen in die Ausgabe werden die Ressourcen einer Seite von unten
+# nach oben durchlaufen und anhand ihres Inhalts gehasht. Stimmt ein Objekt mit
+# einem bereits bekannten überein, wird stattdessen auf das bekannte Objekt
+# verwiesen. Das Duplikat ist danach nicht mehr referenziert und wird beim
+# Speichern nicht geschrieben.
+#
+class ResourceDedup:
+    # Verweise zurück in den Seitenbaum nicht verfolgen
+    _SKIPKEYS = { '/Parent', '/P' }
+
+
+    def __init__(self):
+        self.objects = {}
+        self.done = {}
+        self.duplicates = 0
+
+
+    def page(self, page):
+        page = pikepdf.Page(page)
+        if '/Resources' not in page.obj or not self._container(page.obj.Resources):
+            return
+
+        resources = page.obj.Resources
+        canonical = self._canonical(resources)
+        if self._replaced(resources, canonical):
+            page.obj.Resources = canonical
+
+
+    def _canonical(self, obj):
+        if not obj.is_indirect:
+            self._children(obj)
+            return obj
+
+        key = obj.objgen
+        if key in self.done:
+            return self.done[key]
+
+        # Vorläufig eintragen, um Zyklen zu unterbrechen
+        self.done[key] = obj
+        self._children(obj)
+
+        if isinstance(obj, pikepdf.Stream):
+            digest = hashlib.sha256()
+            digest.update(b'S')
+            digest.update(obj.stream_dict.unparse(resolved = True))
+            digest.update(b'\0')
+            digest.update(obj.read_raw_bytes())
+        else:
+            digest = hashlib.sha256()
+            digest.update(b'O')
+            digest.update(obj.unparse(resolved = True))
+        digest = digest.digest()
+
+        canonical = self.objects.setdefault(digest, obj)
+        if canonical.objgen != obj.objgen:
+            self.duplicates += 1
+
+        self.done[key] = canonical
+        return canonical
+
+
+    def _replaced(self, value, canonical):
+        return value.is_indirect and canonical.objgen != value.objgen
+
+
+    def _container(self, value):
+        return isinstance(value, ( pikepdf.Dictionary, pikepdf.Array, pikepdf.Stream ))
+
+
+    def _children(self, obj):
+        if isinstance(obj, pikepdf.Array):
+            for idx in range(len(obj)):
+                value = obj[idx]
+                if not self._container(value):
+                    continue
+
+                canonical = self._canonical(value)
+                if self._replaced(value, canonical):
+                    obj[idx] = canonical
+            return
+
+        for k in list(obj.keys()):
+            if k in self._SKIPKEYS:
+                continue
+
+            value = obj[k]
+            if not self._container(value):
+                continue
+
+            canonical = self._canonical(value)
+            if self._replaced(value, canonical):
+                obj[k] = canonical
+
+
+
+#
+# Teildokumente zusammenführen
+#
+# Das Zusammenführen samt Lesezeichen und Seitenbeschriftungen übernimmt
+# `merge_documents` aus `online/aip_lib.py`. Die Ressourcen werden danach
+# erneut zusammengeführt, da jedes Teildokument eigene Kopien enthält.
+#
+def merge(filenames, output, profile = 'web'):
+    from .online import load_online
+
+    out = load_online('aip_lib').merge_documents(filenames)
+
+    dedup = ResourceDedup()
+    for page in out.Root.Pages.Kids:
+        dedup.page(page)
+
+    savetime, size = save(out, output, profile = profile)
+
+    return len(out.Root.Pages.Kids), savetime, size
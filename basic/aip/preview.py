@@ -0,0 +1,258 @@
+#
+# Copyright (C) 2022-2023 Mario Haustein, mario@mariohaustein.de
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import concurrent.futures
+import html
+import os
+
+from PIL import Image
+from PIL import ImageDraw
+
+from .tmpfile import make_tmpfile
+from .tmpfile import remove_tmpfile
+
+
+
+# Größe einer Kachel in Pixeln (Vorschaubild und Beschriftung)
+TILE_WIDTH   = 210
+TILE_HEIGHT  = 297
+LABEL_HEIGHT = 24
+MARGIN       = 12
+
+# Auflösung der Kontaktabzüge im PDF
+SHEET_DPI = 100
+
+
+
+def tile_file(toc, page):
+    return os.path.join(toc.datadir, page['pageid'] + '_tile.png')
+
+
+def page_label(page):
+    if page is None:
+        return "---"
+    if 'prefix' in page:
+        return page['prefix']
+    return page['name']
+
+
+#
+# Quelle des Vorschaubilds bestimmen
+#
+# Liegt die Seite bereits im Cache, wird sie als Quelle verwendet. Ob sie ein
+# Rasterbild enthält, prüft erst `make_tile()`. Andernfalls wird das
+# Vorschaubild vom AIP-Portal abgerufen.
+#
+def tile_source(toc, page, refresh = False):
+    thumbfile = toc._thumbnailfile(page)
+    if os.path.exists(thumbfile) and not refresh:
+        return thumbfile
+
+    pagefile = toc._pagefile(page)
+    if os.path.exists(pagefile) and not refresh:
+        return pagefile
+
+    return toc.fetchthumbnail(page, refresh = refresh)
+
+
+def tile_current(source, tilefile):
+    return os.path.exists(tilefile) and os.stat(tilefile).st_mtime_ns >= os.stat(source).st_mtime_ns
+
+
+def _page_image(filename):
+    import pikepdf
+
+    with pikepdf.Pdf.open(filename) as pdf:
+        if len(pdf.pages) != 1:
+            return None
+
+        page = pdf.pages[0].obj
+        if '/Resources' not in page or '/XObject' not in page.Resources:
+            return None
+
+        images = [ x for x in page.Resources.XObject.values() if x.get('/Subtype') == pikepdf.Name.Image ]
+        if len(images) != 1:
+            return None
+
+        try:
+            return pikepdf.PdfImage(images[0]).as_pil_image()
+        except (pikepdf.PdfError, NotImplementedError, ValueError):
+            return None
+
+
+def _blank_tile(label):
+    tile = Image.new('RGB', ( TILE_WIDTH, TILE_HEIGHT + LABEL_HEIGHT ), 'white')
+    draw = ImageDraw.Draw(tile)
+    draw.rectangle(( 0, 0, TILE_WIDTH - 1, TILE_HEIGHT - 1 ), outline = 'lightgray')
+    draw.text(( 4, TILE_HEIGHT + 4 ), label, fill = 'black')
+    return tile
+
+
+#
+# Kachel einer Seite erzeugen
+#
+# Die Kachel wird je Seitenkennung im Cache abgelegt und nur neu erzeugt, wenn
+# die Quelle jünger ist. Nach einem AIRAC-Wechsel werden daher nur Kacheln
+# geänderter Seiten neu berechnet.
+#
+# Enthält eine Seiten-PDF kein Rasterbild, wird `None` geliefert.
+#
+def make_tile(source, tilefile, label, refresh = False):
+    if not refresh and tile_current(source, tilefile):
+        return tilefile
+
+    if source.endswith('.pdf'):
+        img = _page_image(source)
+        if img is None:
+            return None
+    else:
+        img = Image.open(source)
+
+    img = img.convert('RGB')
+    img.thumbnail(( TILE_WIDTH, TILE_HEIGHT ), Image.LANCZOS)
+
+    tile = _blank_tile(label)
+    tile.paste(img, ( ( TILE_WIDTH - img.width ) // 2, ( TILE_HEIGHT - img.height ) // 2 ))
+
+    # Gleichzeitige Aufrufe schreiben in eigene temporäre Dateien
+    tmpfile = make_tmpfile(tilefile)
+    try:
+        tile.save(tmpfile, optimize = True)
+        os.replace(tmpfile, tilefile)
+    finally:
+        remove_tmpfile(tmpfile)
+
+    return tilefile
+
+
+#
+# Kacheln aller Seiten parallel erzeugen. Das Ergebnis enthält je Seite den
+# Dateinamen der Kachel bzw. `None` für Leerseiten.
+#
+def make_tiles(toc, pages, refresh = False, jobs = None):
+    # Aktuelle Kacheln werden ohne Dekodieren übernommen. Das Herunterladen
+    # erfolgt nacheinander, das Umrechnen parallel.
+    tiles = {}
+    tasks = {}
+    for page in pages:
+        if page is None or page['pageid'] in tiles or page['pageid'] in tasks:
+            continue
+
+        source = tile_source(toc, page, refresh = refresh)
+        tilefile = tile_file(toc, page)
+        if not refresh and tile_current(source, tilefile):
+            tiles[page['pageid']] = tilefile
+        else:
+            tasks[page['pageid']] = ( page, source, tilefile )
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers = jobs) as executor:
+        def submit(tasks):
+            return \
+            {
+                pageid: executor.submit(make_tile, source, tilefile, page_label(page), refresh = True)
+                for pageid, ( page, source, tilefile ) in tasks.items()
+            }
+
+        futures = submit(tasks)
+
+        # Seiten ohne Rasterbild durch das Vorschaubild des AIP-Portals ersetzen
+        retry = {}
+        for pageid, future in futures.items():
+            tiles[pageid] = future.result()
+            if tiles[pageid] is None:
+                page, source, tilefile = tasks[pageid]
+                retry[pageid] = ( page, toc.fetchthumbnail(page, refresh = refresh), tilefile )
+
+        for pageid, future in submit(retry).items():
+            tiles[pageid] = future.result()
+
+    return [ None if page is None else tiles[page['pageid']] for page in pages ]
+
+
+#
+# Kontaktabzüge als PDF schreiben
+#
+def write_contact_sheets(pages, tiles, output, columns = 6, rows = 3):
+    cellwidth  = TILE_WIDTH + MARGIN
+    cellheight = TILE_HEIGHT + LABEL_HEIGHT + MARGIN
+    perpage = columns * rows
+
+    sheets = []
+    for start in range(0, len(pages), perpage):
+        sheet = Image.new('RGB', ( columns * cellwidth + MARGIN, rows * cellheight + MARGIN ), 'white')
+
+        for idx in range(start, min(start + perpage, len(pages))):
+            if tiles[idx] is None:
+                tile = _blank_tile(page_label(None))
+            else:
+                with Image.open(tiles[idx]) as f:
+                    tile = f.convert('RGB')
+
+            col = ( idx - start ) % columns
+            row = ( idx - start ) // columns
+            sheet.paste(tile, ( MARGIN + col * cellwidth, MARGIN + row * cellheight ))
+
+        sheets.append(sheet)
+
+    if not sheets:
+        raise ValueError("Keine Seiten für die Vorschau ausgewählt")
+
+    sheets[0].save(output, save_all = True, append_images = sheets[1:], resolution = SHEET_DPI)
+
+    return len(sheets)
+
+
+#
+# Galerie als HTML-Seite schreiben. Die Kacheln werden relativ zur Ausgabedatei
+# aus dem Cache referenziert.
+#
+def write_gallery(pages, tiles, output, title):
+    outdir = os.path.dirname(os.path.abspath(output))
+
+    with open(output, 'w') as f:
+        f.write('<!DOCTYPE html>\n')
+        f.write('<html lang="de">\n<head>\n<meta charset="utf-8">\n')
+        f.write('<title>%s</title>\n' % html.escape(title))
+        f.write('<style>\n')
+        f.write('body { font-family: sans-serif; }\n')
+        f.write('.gallery { display: grid; grid-template-columns: repeat(auto-fill, %dpx); gap: %dpx; }\n' % ( TILE_WIDTH, MARGIN ))
+        f.write('figure { margin: 0; }\n')
+        f.write('figcaption { font-size: small; }\n')
+        f.write('</style>\n</head>\n<body>\n')
+        f.write('<h1>%s</h1>\n<div class="gallery">\n' % html.escape(title))
+
+        for page, tile in zip(pages, tiles):
+            if page is None:
+                f.write('<figure><div style="width: %dpx; height: %dpx; border: 1px solid lightgray"></div><figcaption>---</figcaption></figure>\n' % ( TILE_WIDTH, TILE_HEIGHT ))
+                continue
+
+            caption = html.escape(page_label(page))
+            if 'title' in page:
+                caption += '<br>' + html.escape(page['title'])
+
+            f.write('<figure><a href="%s"><img src="%s" width="%d" alt="%s"></a><figcaption>%s</figcaption></figure>\n' %
+                (
+                    html.escape(page['href']),
+                    html.escape(os.path.relpath(tile, outdir)),
+                    TILE_WIDTH,
+                    html.escape(page_label(page)),
+                    caption,
+                )
+            )
+
+        f.write('</div>\n</body>\n</html>\n')
@@ -0,0 +1,298 @@
+#
+# Copyright (C) 2022-2023 Mario Haustein, mario@mariohaustein.de
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import argparse
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+import json
+import os
+import socketserver
+import stat
+import threading
+
+from .cache import AipCache
+from .toc import AipToc
+from .functions import prepare_pagediff
+from .functions import prepare_pagepairs
+from .functions import write_summary
+
+
+
+#
+# Geparste Inhaltsverzeichnisse im Speicher vorhalten
+#
+# Je AIP-Typ werden die `keep` jüngsten Ausgaben vorgehalten. Ändert sich das
+# Cache-Verzeichnis (z.B. durch `toc fetch`), werden die Inhaltsverzeichnisse
+# neu eingelesen und danach in einem Schritt ausgetauscht. Laufende Anfragen
+# arbeiten bis zu ihrem Ende mit dem alten Stand weiter.
+#
+class AipTocStore:
+    def __init__(self, cache: AipCache, keep: int = 3):
+        self.cache = cache
+        self.keep = keep
+
+        self._reloadlock = threading.Lock()
+        self._state = ( None, [], {} )
+
+
+    def refresh(self):
+        with self._reloadlock:
+            mtime = os.stat(self.cache.basedir).st_mtime_ns
+            oldmtime, oldentries, oldtocs = self._state
+
+            # Auch ohne neue Ausgabe können vorgehaltene Inhaltsverzeichnisse
+            # neu geschrieben worden sein (z.B. durch `toc fetch --refresh`).
+            if mtime == oldmtime and all(_mtime(f) == m for f, ( m, _ ) in oldtocs.items()):
+                return
+
+            entries = oldentries if mtime == oldmtime else self.cache.list(None)
+
+            tocs = {}
+            count = {}
+            for aiptype, airac, filename in entries:
+                count[aiptype] = count.get(aiptype, 0) + 1
+                if count[aiptype] > self.keep:
+                    continue
+
+                filemtime = _mtime(filename)
+                tocmtime, toc = oldtocs.get(filename, ( None, None ))
+                if toc is None or tocmtime != filemtime:
+                    toc = AipToc(filename)
+                tocs[filename] = ( filemtime, toc )
+
+            self._state = ( mtime, entries, tocs )
+
+
+    def list(self, aiptype = None):
+        self.refresh()
+        _, entries, _ = self._state
+
+        return [ e for e in entries if aiptype is None or e[0] == aiptype ]
+
+
+    def load(self, aiptype, airac = None):
+        self.refresh()
+        _, entries, tocs = self._state
+
+        for _aiptype, _airac, filename in entries:
+            if _aiptype != aiptype:
+                continue
+            if airac is not None and airac != _airac:
+                continue
+
+            # Ältere Ausgaben werden nicht vorgehalten, sondern bei Bedarf
+            # eingelesen.
+            _, toc = tocs.get(filename, ( None, None ))
+            if toc is None:
+                toc = AipToc(filename)
+
+            return toc
+
+        if airac is None:
+            raise KeyError("Kein Inhaltsverzeichnis für AIP %s vorhanden" % aiptype)
+        raise KeyError("Kein Inhaltsverzeichnis für AIP %s vom %s vorhanden" % ( aiptype, airac.isoformat() ))
+
+
+
+def _mtime(filename):
+    try:
+        return os.stat(filename).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _page_info(page):
+    if page is None:
+        return None
+
+    return { k: page[k] for k in [ 'prefix', 'name', 'title', 'pageid' ] if k in page }
+
+
+def _request_args(request):
+    args = argparse.Namespace(
+        type       = None,
+        airac      = None,
+        base_airac = None,
+        filter     = None,
+        pairs      = False,
+        refresh    = False,
+        output     = None,
+        profile    = 'web',
+        variant    = None,
+    )
+
+    for k, v in request.items():
+        if k == 'command':
+            continue
+        if not hasattr(args, k):
+            raise ValueError("Unbekannter Parameter '%s'" % k)
+        setattr(args, k, v)
+
+    if args.type not in [ None, 'VFR', 'IFR' ]:
+        raise ValueError("Ungültiger AIP-Typ '%s'" % args.type)
+
+    return args
+
+
+#
+# Ausgabedatei einer Anfrage im Ausgabeverzeichnis bestimmen
+#
+# Clients dürfen nur relative Pfade innerhalb des Ausgabeverzeichnisses angeben.
+# Absolute Pfade, `..` und symbolische Links aus dem Verzeichnis heraus werden
+# abgewiesen.
+#
+def _output_path(outdir, output):
+    if not isinstance(output, str) or output == '':
+        raise ValueError("Ungültige Ausgabedatei")
+
+    if os.path.isabs(output) or '..' in output.replace('\\', '/').split('/'):
+        raise ValueError("Ausgabedatei '%s' muss relativ zum Ausgabeverzeichnis sein" % output)
+
+    outdir = os.path.realpath(outdir)
+    path = os.path.realpath(os.path.join(outdir, output))
+    if os.path.commonpath([ outdir, path ]) != outdir or path == outdir:
+        raise ValueError("Ausgabedatei '%s' liegt außerhalb des Ausgabeverzeichnisses" % output)
+
+    return path
+
+
+#
+# Eine Anfrage beantworten
+#
+# Anfragen und Antworten sind JSON-Objekte. Die Parameter einer Anfrage
+# entsprechen denen der Kommandozeile. Ausgabedateien werden nur im
+# Ausgabeverzeichnis `outdir` angelegt.
+#
+def handle_request(store, request, outdir = '.'):
+    command = request.get('command')
+    if command not in [ 'toc list', 'page list', 'page diff', 'pdf summary' ]:
+        raise ValueError("Unbekanntes Kommando '%s'" % command)
+
+    args = _request_args(request)
+
+    if command == 'toc list':
+        return [ { 'type': t, 'airac': a.isoformat(), 'filename': f } for t, a, f in store.list(args.type) ]
+
+    if args.type is None:
+        raise ValueError("Parameter 'type' fehlt")
+
+    if command == 'page list':
+        _, pagepairs = prepare_pagepairs(args, args.pairs, store = store)
+        if args.pairs:
+            return [ [ _page_info(po), _page_info(pe) ] for po, pe in pagepairs ]
+        return [ _page_info(p) for pp in pagepairs for p in pp if p is not None ]
+
+    if command == 'page diff':
+        if args.base_airac is None:
+            raise ValueError("Parameter 'base_airac' fehlt")
+
+        result = []
+        for pbase, ptarget in prepare_pagediff(args, store = store):
+            if pbase is None:
+                change = 'added'
+            elif ptarget is None:
+                change = 'deleted'
+            else:
+                change = 'changed'
+            result.append({ 'change': change, 'base': _page_info(pbase), 'target': _page_info(ptarget) })
+        return result
+
+    if command == 'pdf summary':
+        if args.output is None:
+            raise ValueError("Parameter 'output' fehlt")
+        output = _output_path(outdir, args.output)
+
+        toc, pagepairs = prepare_pagepairs(args, args.pairs, store = store)
+        count, savetime, size = write_summary(toc, pagepairs, output, pairs = args.pairs, refresh = args.refresh, profile = args.profile, variant = args.variant)
+        return { 'output': output, 'pages': count, 'seconds': savetime, 'size': size }
+
+
+def _handle_json(store, data, outdir):
+    try:
+        request = json.loads(data)
+        if not isinstance(request, dict):
+            raise ValueError("Anfrage muss ein JSON-Objekt sein")
+        return 200, { 'result': handle_request(store, request, outdir = outdir) }
+    except (KeyError, ValueError) as e:
+        return 400, { 'error': str(e.args[0] if e.args else e) }
+    except Exception as e:
+        return 500, { 'error': str(e) }
+
+
+
+class _UnixHandler(socketserver.StreamRequestHandler):
+    # Je Zeile eine Anfrage, je Zeile eine Antwort
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+
+            _, response = _handle_json(self.server.store, line, self.server.outdir)
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+            self.wfile.flush()
+
+
+class _HttpHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        status, response = _handle_json(self.server.store, self.rfile.read(length), self.server.outdir)
+        body = json.dumps(response).encode()
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+
+#
+# Prüfen, ob ein Pfad auf einen Unix-Socket verweist. Nur verwaiste Sockets
+# werden entfernt, andere Dateien bleiben unangetastet.
+#
+def _is_socket(path):
+    try:
+        return stat.S_ISSOCK(os.lstat(path).st_mode)
+    except FileNotFoundError:
+        return False
+
+
+def run_server(store, socketpath = None, address = None, outdir = '.'):
+    if socketpath is not None:
+        if _is_socket(socketpath):
+            os.unlink(socketpath)
+        elif os.path.lexists(socketpath):
+            raise ValueError("'%s' existiert und ist kein Unix-Socket" % socketpath)
+        server = socketserver.ThreadingUnixStreamServer(socketpath, _UnixHandler)
+    else:
+        server = ThreadingHTTPServer(address, _HttpHandler)
+
+    server.daemon_threads = True
+    server.store = store
+    server.outdir = outdir
+
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if socketpath is not None and _is_socket(socketpath):
+            os.unlink(socketpath)
@@ -0,0 +1,53 @@
+#
+# Copyright (C) 2022-2023 Mario Haustein, mario@mariohaustein.de
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import os
+import uuid
+
+
+
+#
+# Eindeutige temporäre Datei neben der Zieldatei anlegen
+#
+# Gleichzeitige Schreibvorgänge auf dieselbe Zieldatei kommen sich so nicht in
+# die Quere. Die Datei wird wie jede andere Datei entsprechend der umask
+# angelegt. Die Dateiendung bleibt erhalten, da PIL das Ausgabeformat daran
+# erkennt.
+#
+def make_tmpfile(filename):
+    root, ext = os.path.splitext(filename)
+
+    while True:
+        name = "%s.%s.tmp%s" % ( root, uuid.uuid4().hex[:8], ext )
+        try:
+            fd = os.open(name, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        except FileExistsError:
+            continue
+
+        os.close(fd)
+        return name
+
+
+#
+# Temporäre Datei entfernen, sofern sie noch existiert
+#
+def remove_tmpfile(filename):
+    try:
+        os.unlink(filename)
+    except FileNotFoundError:
+        pass
@@ -17,15 +17,14 @@
 #
 
 import base64
-from bs4 import BeautifulSoup
-from io import BytesIO
 import json
 import os
-from PIL import Image
 import re
-import requests
+import sys
 import urllib.parse
 
+from .meta import PageIndex
+
 
 
 # Die `removesuffix`-Methode gibt es es ab Python 3.9. So lange Python 3.8 noch
@@ -41,10 +40,100 @@ def removesuffix(s, suffix):
 
 
 
+#
+# Eintrag (Seite oder Abschnitt) im Inhaltsverzeichnis
+#
+# Bei mehreren eingelesenen Ausgaben (Vergleich, Hintergrunddienst) fallen die
+# Einträge beim Speicherbedarf ins Gewicht. Statt eines Wörterbuchs je Eintrag
+# werden daher feste Attribute (`__slots__`) verwendet. Der Zugriff erfolgt
+# weiterhin wie bei einem Wörterbuch (`entry['prefix']`, `'title' in entry`,
+# `entry.get('title')`). Nicht gesetzte Attribute gelten als nicht vorhanden.
+#
+class AipEntry:
+    __slots__ = \
+    (
+        'name', 'href', 'permalink', 'type', 'version', 'airac',
+        'pageid', 'path', 'prefix', 'title',
+        'page', 'subpage', 'odd',
+        'num', 'numfirst', 'numlast',
+        'folder', '_extra',
+    )
+
+    _KEYS = frozenset(__slots__) - { '_extra' }
+
+
+    def __getitem__(self, key):
+        if key in self._KEYS:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        else:
+            try:
+                return self._extra[key]
+            except (AttributeError, KeyError):
+                pass
+
+        raise KeyError(key)
+
+
+    def __setitem__(self, key, value):
+        if key in self._KEYS:
+            setattr(self, key, value)
+            return
+
+        try:
+            self._extra[key] = value
+        except AttributeError:
+            self._extra = { key: value }
+
+
+    def __contains__(self, key):
+        if key in self._KEYS:
+            return hasattr(self, key)
+
+        return hasattr(self, '_extra') and key in self._extra
+
+
+    def get(self, key, default = None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+    def keys(self):
+        result = [ k for k in self.__slots__ if k in self._KEYS and hasattr(self, k) ]
+        if hasattr(self, '_extra'):
+            result += list(self._extra)
+        return result
+
+
+    def items(self):
+        return [ ( k, self[k] ) for k in self.keys() ]
+
+
+    def __iter__(self):
+        return iter(self.keys())
+
+
+    def __repr__(self):
+        return 'AipEntry(%r)' % dict(self.items())
+
+
+
 class AipToc:
+    _HEADERS = { 'User-Agent': 'AIP Download Tool' }
+
+
     def __init__(self, filename: str):
+        # Das eingelesene JSON wird nach dem Aufbau des Seitenbaums nicht mehr
+        # benötigt und nicht vorgehalten.
         with open(filename) as f:
-            self.toc_raw = json.load(f)
+            toc_raw = json.load(f)
+
+        self.aiptype = toc_raw['type']
+        self.airac = toc_raw['airac']
 
         self.basedir = os.path.dirname(os.path.abspath(filename))
         self.datadir = os.path.join(self.basedir, 'data')
@@ -53,7 +142,9 @@ class AipToc:
         except FileExistsError:
             pass
 
-        self.toc = self._parse(self.toc_raw)
+        self.index = PageIndex(self.datadir)
+
+        self.toc = self._parse(toc_raw)
 
         self.index_num = {}
         self.index_prefix = {}
@@ -61,7 +152,10 @@ class AipToc:
 
 
     def _parse(self, entry, path = None):
-        newentry = { k: v for k, v in entry.items() if not isinstance(v, list) }
+        newentry = AipEntry()
+        for k, v in entry.items():
+            if not isinstance(v, list):
+                newentry[k] = v
 
         url = urllib.parse.urlparse(newentry['href'])
         newentry['pageid'] = removesuffix(url.path.split('/')[-1], '.html').lower()
@@ -101,12 +195,14 @@ class AipToc:
             path = tuple()
 
         elif component is not None:
-            path += component
+            # Abschnittsbezeichnungen, Präfixe und Titel wiederholen sich über
+            # viele Einträge und werden daher nur einmal gespeichert.
+            path += tuple(sys.intern(c) for c in component)
             newentry['path'] = path
-            newentry['prefix'] = " ".join(path)
+            newentry['prefix'] = sys.intern(" ".join(path))
 
         if title is not None:
-            newentry['title'] = title
+            newentry['title'] = sys.intern(title)
 
         if 'folder' in entry:
             for nextentry in entry['folder']:
@@ -136,7 +232,7 @@ class AipToc:
                 return match[2], match[4]
 
         # Unterabschnittsnummer in AIP IFR erkennen
-        if self.toc_raw['type'] == 'IFR' and \
+        if self.aiptype == 'IFR' and \
            len(path) == 2 and \
            path[0] in [ "GEN", "ENR", "AD" ]:
             match = re.fullmatch(r'(GEN|ENR|AD) [0-9]\.([0-9]+)( (.+))?', entry['name'])
@@ -144,7 +240,7 @@ class AipToc:
                 return match[2], match[4]
 
         # Den Verweis von der AIP-VFR auf die Streckenkarte in der AIP-IFR hart kodieren
-        if self.toc_raw['type'] == 'VFR' and \
+        if self.aiptype == 'VFR' and \
            path == ( "ENR", ) and \
            entry['name'].startswith("ENR Enroute Charts siehe AIP IFR"):
             return "6", "Streckenkarte"
@@ -160,7 +256,7 @@ class AipToc:
             raise ValueError("Unerwartete Streckenkarte '%s'" % entry['name'])
 
         # Anflugblätter behandeln
-        if self.toc_raw['type'] == 'VFR' and \
+        if self.aiptype == 'VFR' and \
            path in [ ( "AD", ), ( "HEL AD", ) ]:
             # Alphabetisches Register in der Navigation überspringen
             match = re.fullmatch(r'[A-Z](-[A-Z])?', entry['name'])
@@ -176,20 +272,20 @@ class AipToc:
             return entry['name'], entry['name']
 
         # Militärische Plätzer in der AIP IFR behandeln
-        if self.toc_raw['type'] == 'IFR' and \
+        if self.aiptype == 'IFR' and \
            path == ( "AD", ):
             match = re.fullmatch(r'MIL-AD ([0-9])( (.+))?', entry['name'])
             if match:
                 return ( 'MIL', match[1] ), match[3]
 
         # Überflüssigen Ordner "MIL-AD" eliminieren
-        if self.toc_raw['type'] == 'IFR' and \
+        if self.aiptype == 'IFR' and \
            len(path) == 3 and path[0] == "AD" and path[1] == "MIL":
             if path[2] == "1" and entry['name'] == "MIL-AD":
                 return None, None
 
         # Anflugblätter behandeln
-        if self.toc_raw['type'] == 'IFR' and \
+        if self.aiptype == 'IFR' and \
            path in [ ( "AD", "2" ), ( "AD", "3" ), ( "AD", "MIL", "2" ) ]:
             # Der ICAO-Locator ist nicht im Titel kodiert. Wir müssen eine
             # Ebene absteigen.
@@ -202,7 +298,7 @@ class AipToc:
             if match:
                 return None, None
 
-            if self.toc_raw['type'] == 'VFR' and \
+            if self.aiptype == 'VFR' and \
                entry['name'] == "AIC Prüfliste":
                 return "Liste", "Prüfliste"
 
@@ -217,7 +313,7 @@ class AipToc:
             if match:
                 return None, None
 
-            if self.toc_raw['type'] == 'VFR' and \
+            if self.aiptype == 'VFR' and \
                entry['name'] == "SUP Liste der Ergänzungen":
                 return "Liste", "Liste der Ergänzungen"
 
@@ -230,7 +326,7 @@ class AipToc:
 
     def _parse_page(self, entry, path):
         # Seitennummer der Textseiten in der AIP VFR bestimmen
-        if self.toc_raw['type'] == 'VFR' and \
+        if self.aiptype == 'VFR' and \
            len(path) == 2 and path[0] in [ "GEN", "ENR", "AD", "HEL AD" ]:
             match = re.fullmatch(r'(GEN|ENR|AD|HEL AD) ([0-9])[-\.]([0-9]+)([A-Za-z])?( (.+))?', entry['name'])
 
@@ -251,7 +347,7 @@ class AipToc:
                     return None, match[1], match[2], match[3]
 
         # Seitennummer der Textseiten in der AIP IFR bestimmen
-        if self.toc_raw['type'] == 'IFR' and \
+        if self.aiptype == 'IFR' and \
            len(path) == 3 and path[0] in [ "GEN", "ENR", "AD" ]:
             match = re.fullmatch(r'(GEN|ENR|AD) [0-9][\. ][0-9]+[- ]([0-9]+)([A-Za-z])?( (.+))?', entry['name'])
 
@@ -259,14 +355,14 @@ class AipToc:
                 return None, match[2], match[3], match[5]
 
         # Seitnnummern der Textseiten im Abschnitt MIL-AD der AIP-IFR bestimmen
-        if self.toc_raw['type'] == 'IFR' and \
+        if self.aiptype == 'IFR' and \
            len(path) == 3 and path[0] == "AD" and path[1] == "MIL":
             match = re.fullmatch(r'MIL-AD [0-9]-([0-9]+)([A-Za-z])?( (.+))?', entry['name'])
             if match:
                 return None, match[1], match[2], match[4]
 
         # Streckenverzeichnisse behandeln
-        if self.toc_raw['type'] == 'IFR' and \
+        if self.aiptype == 'IFR' and \
            path == ( "ENR", "3", "2" ):
             match = re.fullmatch(r'ENR 3\.2-([A-Z]+)-([0-9]+)([A-Za-z])?', entry['name'])
             if match:
@@ -277,7 +373,7 @@ class AipToc:
             return None, "1", None, entry['name']
 
         # Flugplatzkarten behandeln
-        if self.toc_raw['type'] == 'VFR' and \
+        if self.aiptype == 'VFR' and \
            len(path) == 2 and path[0] == "AD":
             # Terminal Chart mit Seitennummer
             match = re.fullmatch(r'E[DT][A-Z][A-Z] (.+) Terminal Chart ([0-9]+)', entry['name'])
@@ -305,7 +401,7 @@ class AipToc:
                 return None, match[3], match[4], match[2]
 
         # Flugplatzkarten behandeln
-        if self.toc_raw['type'] == 'IFR' and \
+        if self.aiptype == 'IFR' and \
            len(path) == 3 and path[0] == "AD" and path[1] in [ "2", "3" ]:
             # einfache Nummierung: 1-1, 1-2, ..., 2-1, ...
             match = re.fullmatch(r'AD [23] E[DT][A-Z][A-Z] ([126])-([0-9]+)([A-Za-z])?( (.+))?', entry['name'])
@@ -318,14 +414,14 @@ class AipToc:
                 return ( match[1], match[2] ), match[3], match[4], match[6]
 
         # Flugplatzkarten für Abschnitt "MIL-AD" behandeln
-        if self.toc_raw['type'] == 'IFR' and \
+        if self.aiptype == 'IFR' and \
            len(path) == 4 and path[0] == "AD" and path[1] == "MIL" and path[2] == "2":
             match = re.fullmatch(r'AD 2 E[DT][A-Z][A-Z] ([0-9])[- ]([0-9]+)([A-Za-z])?( (.+))?', entry['name'])
             if match:
                 return match[1], match[2], match[3], match[5]
 
         # Helikopterplätze behandeln
-        if self.toc_raw['type'] == 'VFR' and \
+        if self.aiptype == 'VFR' and \
            len(path) == 2 and path[0] == "HEL AD":
             # Verzeichnis der Helikopterplätze
             match = re.fullmatch(r'HEL AD 3-([A-Z]+)-([0-9]+)([A-Za-z])?', entry['name'])
@@ -502,18 +598,32 @@ class AipToc:
         if 'folder' in page:
             return None
 
-        filename = os.path.join(self.datadir, page['pageid'] + '_thumb.png')
+        filename = self._thumbnailfile(page)
         if not refresh and os.path.exists(filename):
             return filename
 
         print(page['name'])
 
+        import requests
+
         # Seite abrufen
-        response = requests.get(page['href'], headers = { 'User-Agent': 'AIP Download Tool' })
+        response = requests.get(page['href'], headers = self._HEADERS)
         response.raise_for_status()
 
+        self._store_thumbnail(page, filename, response.content)
+
+        return filename
+
+
+    def _thumbnailfile(self, page):
+        return os.path.join(self.datadir, page['pageid'] + '_thumb.png')
+
+
+    def _store_thumbnail(self, page, filename, content):
+        from bs4 import BeautifulSoup
+
         # Seite parsen
-        soup = BeautifulSoup(response.content, 'html.parser')
+        soup = BeautifulSoup(content, 'html.parser')
         soup = soup.find('main', class_ = 'container')
         soup = soup.find('img', class_ = 'pageImage')
         if soup is None:
@@ -528,19 +638,47 @@ class AipToc:
         with open(filename, 'wb') as f:
             f.write(mediacontent)
 
-        return filename
-
 
     def fetchpage(self, page, refresh = False):
         if 'folder' in page:
             return None
 
-        filename = os.path.join(self.datadir, page['pageid'] + '.pdf')
+        filename = self._pagefile(page)
         if not refresh and os.path.exists(filename):
             return filename
 
         print(page['name'])
 
+        url, headers = self._pageurl(page)
+
+        import requests
+
+        # Seite abrufen
+        response = requests.get(url, headers = headers)
+        response.raise_for_status()
+
+        self._store_page(page, filename, response.headers['content-type'], response.content)
+        self.index.record(page['pageid'], filename)
+
+        return filename
+
+
+    #
+    # Metadaten einer heruntergeladenen Seite aus dem Index abrufen. Ist die
+    # Seite noch nicht heruntergeladen, wird `None` geliefert.
+    #
+    def pageinfo(self, page):
+        if 'folder' in page:
+            return None
+
+        return self.index.get(page['pageid'], self._pagefile(page))
+
+
+    def _pagefile(self, page):
+        return os.path.join(self.datadir, page['pageid'] + '.pdf')
+
+
+    def _pageurl(self, page):
         chapter = page['path'][0]
         if chapter == "HEL AD":
             chapter = "AD"
@@ -558,21 +696,28 @@ class AipToc:
                 urllib.parse.quote(page['name'])
             )
 
-        # Seite abrufen
-        response = requests.get(url, headers = { 'referer': page['href'], 'User-Agent': 'AIP Download Tool' })
-        response.raise_for_status()
+        headers = dict(self._HEADERS)
+        headers['referer'] = page['href']
+
+        return url, headers
+
 
-        content_type = response.headers['content-type'].split(';')[0]
-        if content_type == 'application/pdf':
+    def _store_page(self, page, filename, content_type, content):
+        from bs4 import BeautifulSoup
+        from io import BytesIO
+        from PIL import Image
+
+        mediatype = content_type.split(';')[0]
+        if mediatype == 'application/pdf':
             with open(filename, 'wb') as f:
-                f.write(response.content)
-            return filename
+                f.write(content)
+            return
 
-        if content_type != 'text/html':
-            raise ValueError("Unbekannter Medientyp '%s' für Seite '%s'" % ( response.headers['content-type'], page['name'] ))
+        if mediatype != 'text/html':
+            raise ValueError("Unbekannter Medientyp '%s' für Seite '%s'" % ( content_type, page['name'] ))
 
         # Seite parsen
-        soup = BeautifulSoup(response.content, 'html.parser')
+        soup = BeautifulSoup(content, 'html.parser')
         soup = soup.find('body')
 
         if soup is not None:
@@ -590,5 +735,3 @@ class AipToc:
         mediastream = BytesIO(mediacontent)
         img = Image.open(mediastream)
         img.save(filename, resolution = 300, optimize = True)
-
-        return filename
@@ -0,0 +1,170 @@
+#!/bin/env python3
+
+#
+# Copyright (C) 2022-2023 Mario Haustein, mario@mariohaustein.de
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+
+
+# Bibliotheken, die nur von einzelnen Kommandos benötigt werden und deshalb
+# beim Programmstart nicht geladen werden dürfen.
+HEAVY_MODULES = [ 'bs4', 'httpx', 'PIL', 'pikepdf', 'requests', 'xdg' ]
+
+# Kommandos, die ohne diese Bibliotheken auskommen müssen
+STARTUP_COMMANDS = \
+[
+    [ 'toc', 'list' ],
+    [ 'page', 'tree', '--vfr', '--help' ],
+    [ 'page', 'list', '--vfr', '--help' ],
+    [ 'pdf', '--help' ],
+]
+
+
+
+def importtime(argv):
+    result = subprocess.run(
+        [ sys.executable, '-X', 'importtime' ] + argv,
+        stdout = subprocess.DEVNULL,
+        stderr = subprocess.PIPE,
+        text = True)
+
+    if result.returncode != 0:
+        raise RuntimeError("Aufruf '%s' fehlgeschlagen:\n%s" % ( " ".join(argv), result.stderr[-2000:] ))
+
+    modules = {}
+    total = 0
+
+    # Format: "import time: self [us] | cumulative | imported package"
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isnumeric():
+            continue
+
+        selftime = int(fields[0])
+        name = fields[2].strip()
+        modules[name] = selftime
+        total += selftime
+
+    return total, modules
+
+
+def bench_memory(args):
+    import gc
+    import tracemalloc
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from aip.toc import AipToc
+
+    tocs = []
+    for filename in args.tocs:
+        gc.collect()
+        tracemalloc.start()
+
+        toc = AipToc(filename)
+
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        # Das Inhaltsverzeichnis bis zum Ende der Messung erhalten
+        tocs.append(toc)
+
+        print("%-40s  %6d Seiten  %8.1f KiB  %5d Byte/Seite  (Spitze %8.1f KiB)" %
+            (
+                os.path.basename(filename),
+                len(toc.index_num),
+                current / 1024.0,
+                current / max(1, len(toc.index_num)),
+                peak / 1024.0,
+            )
+        )
+
+
+def bench_startup(args):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'aip.py')
+    failed = False
+
+    with tempfile.TemporaryDirectory() as cachedir:
+        for command in STARTUP_COMMANDS:
+            total, modules = importtime([ script, '-c', cachedir ] + command)
+
+            heavy = sorted({ m.split('.')[0] for m in modules } & set(HEAVY_MODULES))
+            print("%-28s  %7.1f ms  %4d Module  %s" %
+                (
+                    " ".join(command),
+                    total / 1000.0,
+                    len(modules),
+                    "OK" if not heavy else "geladen: " + ", ".join(heavy),
+                )
+            )
+
+            if heavy or total / 1000.0 > args.limit:
+                failed = True
+
+    if failed:
+        sys.exit(1)
+
+
+
+parser = argparse.ArgumentParser(
+        description = "Laufzeitmessungen"
+    )
+
+commands = parser.add_subparsers(required = True)
+
+
+command_startup = commands.add_parser(
+    'startup',
+    description = "Importzeit beim Programmstart messen (python -X importtime)")
+
+command_startup.add_argument(
+    '--limit',
+    metavar = 'MS',
+    type = float,
+    default = 150.0,
+    help = "Maximal zulässige Importzeit in Millisekunden")
+
+command_startup.set_defaults(func = bench_startup)
+
+
+command_memory = commands.add_parser(
+    'memory',
+    description = "Speicherbedarf eingelesener Inhaltsverzeichnisse messen (tracemalloc)")
+
+command_memory.add_argument(
+    'tocs',
+    metavar = 'TOC',
+    type = str,
+    nargs = '+',
+    help = "Inhaltsverzeichnisse (JSON)")
+
+command_memory.set_defaults(func = bench_memory)
+
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    args.func(args)
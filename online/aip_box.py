@@ -19,73 +19,261 @@
 #
 
 import argparse
+import collections
+import concurrent.futures
+import csv
+import json
 import pikepdf
+import sys
 
+from aip_lib import ACCESS_MODES
+from aip_lib import PAPER_FORMATS
+from aip_lib import box_size
+from aip_lib import classify_boxes
+from aip_lib import open_pdf
 
 
-parser = argparse.ArgumentParser(
-        description = "Boxen jeder PDF-Seite anzeigen"
+
+# Felder je Seite in maschinenlesbaren Ausgaben
+FIELDS = \
+[
+    'file', 'page', 'label', 'rotate',
+    'media', 'crop', 'trim', 'orient', 'width', 'height',
+    'anomalies',
+]
+
+# Zulässige Abweichung beim Vergleich von Boxen in pt
+BOX_EPSILON = 0.5
+
+
+
+def normalize(box):
+    r = pikepdf.Rectangle(box)
+    return r.llx, r.lly, r.urx, r.ury
+
+
+def contains(outer, inner):
+    return inner[0] >= outer[0] - BOX_EPSILON and inner[1] >= outer[1] - BOX_EPSILON and \
+           inner[2] <= outer[2] + BOX_EPSILON and inner[3] <= outer[3] + BOX_EPSILON
+
+
+#
+# Auffälligkeiten einer Seite bestimmen
+#
+# - a4-trim:             Zuschnitt in reinem A4. In der AIP ist das meist eine
+#                        falsch angelegte Zuschnittsbox (z.B. AD-2 EDDC-2).
+# - unknown-format:      Zuschnitt in keinem bekannten Papierformat
+# - trim-outside-crop:   Zuschnittsbox ragt über die Beschnittbox hinaus
+# - crop-outside-media:  Beschnittbox ragt über die Medienbox hinaus
+# - invalid-rotate:      Rotation ist kein Vielfaches von 90°
+#
+def anomalies(mediabox, cropbox, trimbox, trim, rotate):
+    result = []
+
+    if trim[0] == "A4":
+        result.append('a4-trim')
+    if trim[1] is None:
+        result.append('unknown-format')
+    if not contains(cropbox, trimbox):
+        result.append('trim-outside-crop')
+    if not contains(mediabox, cropbox):
+        result.append('crop-outside-media')
+    if rotate % 90:
+        result.append('invalid-rotate')
+
+    return result
+
+
+#
+# Boxen aller Seiten einer Datei einlesen
+#
+# Es werden nur die Seitenverzeichnisse gelesen, Inhaltsströme bleiben
+# unangetastet. Das Ergebnis ist eine Liste einfacher Datensätze je Seite, die
+# auch aus einem anderen Prozess zurückgegeben werden kann.
+#
+def scan_file(filename, access_mode = 'default'):
+    with open_pdf(filename, access_mode) as pdf:
+        pages = [ pikepdf.Page(p) for p in pdf.pages ]
+        boxes = [ [ normalize(page.mediabox), normalize(page.cropbox), normalize(page.trimbox) ] for page in pages ]
+
+        # Formate aller Boxen des Dokuments gemeinsam bestimmen
+        papers = classify_boxes([ box for b in boxes for box in b ])
+
+        records = []
+
+        for idx, ( page, ( mediabox, cropbox, trimbox ) ) in enumerate(zip(pages, boxes)):
+            media, crop, trim = papers[3 * idx : 3 * idx + 3]
+            rotate = int(page.obj.get('/Rotate', 0))
+            width, height = box_size(trimbox)
+
+            records.append(
+                {
+                    'file':      filename,
+                    'page':      idx + 1,
+                    'label':     page.label,
+                    'rotate':    rotate,
+                    'media':     media,
+                    'crop':      crop,
+                    'trim':      trim,
+                    'orient':    trim[1],
+                    'width':     width,
+                    'height':    height,
+                    'anomalies': anomalies(mediabox, cropbox, trimbox, trim, rotate),
+                })
+
+    return records
+
+
+#
+# Dateien nacheinander oder mit `jobs` Prozessen einlesen. Die Ergebnisse
+# werden als Paare aus Dateiname und Datensätzen in der Reihenfolge der Dateien
+# geliefert.
+#
+def scan_files(filenames, access_mode = 'default', jobs = 1):
+    if jobs <= 1:
+        for filename in filenames:
+            yield filename, scan_file(filename, access_mode)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers = jobs) as executor:
+        yield from zip(filenames, executor.map(scan_file, filenames, [ access_mode ] * len(filenames)))
+
+
+def paper_label(paper):
+    if paper[1] is None:
+        return paper[0]
+    return "%-3s %s" % paper
+
+
+def write_text(filename, records, stream):
+    stream.write("%s\n" % filename)
+
+    for r in records:
+        stream.write("%3s:\t%s\t%3s\n" %
+            (
+                r['label'],
+                "\t".join(paper_label(r[k]) for k in [ 'media', 'crop', 'trim' ]),
+                r['rotate'],
+            )
+        )
+
+    stream.write("\n")
+
+
+#
+# Seiten je Format sowie auffällige Seiten ausgeben. Unbekannte Formate werden
+# unter "Sonstige" zusammengefasst.
+#
+def write_summary(stats, flagged, stream):
+    stream.write("%-8s  %6s  %6s  %6s\n" % ( "Format", "Seiten", "Hoch", "Quer" ))
+
+    for paper in [ p for p, _, _ in PAPER_FORMATS ] + [ "Sonstige" ]:
+        if paper not in stats:
+            continue
+
+        s = stats[paper]
+        stream.write("%-8s  %6d  %6d  %6d\n" % ( paper, s['pages'], s['p'], s['l'] ))
+
+    stream.write("%-8s  %6d  %6d  %6d\n" %
+        (
+            "Summe",
+            sum(s['pages'] for s in stats.values()),
+            sum(s['p'] for s in stats.values()),
+            sum(s['l'] for s in stats.values()),
+        )
     )
 
-parser.add_argument(
-    'pdfs',
-    metavar = 'PDF',
-    type = str,
-    nargs = '+',
-    help = 'PDF-Dateien')
+    if flagged:
+        stream.write("\n")
+        for r in flagged:
+            stream.write("%s\t%3s:\t%s\n" % ( r['file'], r['label'], ", ".join(r['anomalies']) ))
 
-args = parser.parse_args()
 
 
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description = "Boxen jeder PDF-Seite anzeigen"
+        )
 
-print("  # \tMedia\tCrop\tTrim\tRotation")
-print()
+    parser.add_argument(
+        '--access-mode',
+        choices = ACCESS_MODES,
+        default = 'default',
+        help = 'Zugriffsart auf Eingabedateien (mmap teilt den Seitencache zwischen Prozessen)')
 
-for filename in args.pdfs:
-    pdf = pikepdf.Pdf.open(filename)
+    parser.add_argument(
+        '--format',
+        choices = [ 'text', 'json', 'csv' ],
+        default = 'text',
+        help = 'Ausgabeformat')
 
-    print(filename)
+    parser.add_argument(
+        '--summary',
+        action = 'store_true',
+        help = 'Seiten je Format zählen und auffällige Seiten auflisten')
 
-    for p in pdf.pages:
-        page = pikepdf.Page(p)
+    parser.add_argument(
+        '--jobs',
+        metavar = 'N',
+        type = int,
+        default = 1,
+        help = 'Anzahl paralleler Prozesse zum Einlesen')
 
-        mediabox = [ round((float(x) / 72.0 * 25.4)) for x in page.mediabox ]
-        cropbox  = [ round((float(x) / 72.0 * 25.4)) for x in page.cropbox  ]
-        trimbox  = [ round((float(x) / 72.0 * 25.4)) for x in page.trimbox  ]
+    parser.add_argument(
+        'pdfs',
+        metavar = 'PDF',
+        type = str,
+        nargs = '+',
+        help = 'PDF-Dateien')
 
-        boxes = []
+    args = parser.parse_args()
 
-        for box in [ mediabox, cropbox, trimbox ]:
-            box_left   = min(box[0], box[2])
-            box_right  = max(box[0], box[2])
-            box_bottom = min(box[1], box[3])
-            box_top    = max(box[1], box[3])
-            box_width  = box_right - box_left
-            box_height = box_top   - box_bottom
 
-            orient = "p" if box_height > box_width else "l"
+    stats = collections.defaultdict(lambda : { 'pages': 0, 'p': 0, 'l': 0 })
+    flagged = []
 
-            if ( box_width, box_height ) in [ ( 148, 210 ), ( 210, 148 ) ]:
-                paper = "A5"
-            elif ( box_width, box_height ) in [ ( 210, 277 ), ( 277, 210 ) ]:
-                paper = "A4n"
-            elif ( box_width, box_height ) in [ ( 210, 297 ), ( 297, 210 ) ]:
-                paper = "A4"
-            elif ( box_width, box_height ) in [ ( 297, 420 ), ( 420, 297 ) ]:
-                paper = "A3"
-            elif ( box_width, box_height ) in [ ( 841, 1189 ), ( 1189, 841 ) ]:
-                paper = "A0"
-            elif ( box_width, box_height ) in [ ( 380, 297 ), ( 297, 380 ) ]:
-                paper = "TC"
-            else:
-                paper = "%dx%d" % ( box_width, box_height )
-                orient = None
+    if args.format == 'text':
+        print("  # \tMedia\tCrop\tTrim\tRotation")
+        print()
+    elif args.format == 'json':
+        sys.stdout.write("[")
+    else:
+        writer = csv.DictWriter(sys.stdout, fieldnames = FIELDS)
+        writer.writeheader()
 
+    count = 0
+
+    for filename, records in scan_files(args.pdfs, args.access_mode, args.jobs):
+        for r in records:
+            paper, orient = r['trim']
             if orient is None:
-                boxes.append(paper)
+                stats["Sonstige"]['pages'] += 1
+            else:
+                stats[paper]['pages'] += 1
+                stats[paper][orient] += 1
+            if r['anomalies']:
+                flagged.append(r)
+
+        if args.format == 'text':
+            write_text(filename, records, sys.stdout)
+            continue
+
+        for r in records:
+            # Die Ausrichtung steht bereits in `orient`
+            r = dict(r, media = r['media'][0], crop = r['crop'][0], trim = r['trim'][0])
+
+            if args.format == 'json':
+                sys.stdout.write(",\n" if count else "\n")
+                sys.stdout.write(json.dumps(r, ensure_ascii = False))
             else:
-                boxes.append("%-3s %s" % ( paper, orient ))
+                writer.writerow(dict(r, anomalies = " ".join(r['anomalies'])))
+
+            count += 1
 
-        print("%3s:\t%s\t%3s" % ( page.label, "\t".join(boxes), p.get('/Rotate', "0") ))
+    if args.format == 'json':
+        sys.stdout.write("\n]\n" if count else "]\n")
 
-    print()
+    # Bei maschinenlesbaren Ausgaben bleibt die Standardausgabe den Datensätzen
+    # vorbehalten.
+    if args.summary:
+        write_summary(stats, flagged, sys.stdout if args.format == 'text' else sys.stderr)
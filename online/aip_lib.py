@@ -0,0 +1,555 @@
+#!/bin/env python
+
+#
+# Copyright (C) 2021 Mario Haustein, mario@mariohaustein.de
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import collections
+import itertools
+import pikepdf
+
+
+
+#
+# Zugriffsarten auf Eingabedateien
+#
+# - default: pikepdf wählt selbst
+# - mmap:    Datei in den Speicher einblenden. Mehrere Prozesse, die dieselben
+#            Dateien lesen, teilen sich den Seitencache des Betriebssystems,
+#            statt die Daten jeweils in eigene Puffer zu lesen.
+# - stream:  Datei blockweise lesen
+#
+ACCESS_MODES = [ 'default', 'mmap', 'stream' ]
+
+
+
+def open_pdf(filename, access_mode = 'default'):
+    if access_mode not in ACCESS_MODES:
+        raise ValueError("Unbekannte Zugriffsart '%s'" % access_mode)
+
+    return pikepdf.Pdf.open(filename, access_mode = getattr(pikepdf.AccessMode, access_mode))
+
+
+
+# Papierformate in mm (Breite x Höhe im Hochformat)
+PAPER_FORMATS = \
+[
+    ( "A5",  148,  210 ),
+    ( "A4n", 210,  277 ),
+    ( "A4",  210,  297 ),
+    ( "A3",  297,  420 ),
+    ( "A0",  841, 1189 ),
+    ( "TC",  297,  380 ),
+]
+
+# Zulässige Abweichung von den Formatmaßen in mm
+PAPER_TOLERANCE = 1
+
+
+
+#
+# Größe einer Box in mm. Die Koordinaten werden einzeln auf ganze Millimeter
+# gerundet.
+#
+def box_size(box):
+    box = [ round(float(x) / 72.0 * 25.4) for x in box ]
+    return abs(box[2] - box[0]), abs(box[3] - box[1])
+
+
+#
+# Papierformat und Ausrichtung einer Größe in mm bestimmen. Unbekannte Formate
+# werden als "<Breite>x<Höhe>" ohne Ausrichtung geliefert.
+#
+def paper_format(width, height, tolerance = PAPER_TOLERANCE):
+    short = min(width, height)
+    long  = max(width, height)
+
+    for paper, pwidth, pheight in PAPER_FORMATS:
+        if abs(short - pwidth) <= tolerance and abs(long - pheight) <= tolerance:
+            return paper, "p" if height > width else "l"
+
+    return "%dx%d" % ( width, height ), None
+
+
+#
+# Größen vieler Boxen in mm bestimmen
+#
+# `boxes` ist eine Folge von Boxen, z.B. `pikepdf.Page.trimbox`. Ist NumPy
+# installiert, werden alle Koordinaten in ein Feld übernommen, gemeinsam
+# umgerechnet und als Feld der Form (N, 2) geliefert. Andernfalls wird jede Box
+# einzeln umgerechnet.
+#
+def box_sizes(boxes):
+    try:
+        import numpy
+    except ImportError:
+        return [ box_size(box) for box in boxes ]
+
+    boxes = numpy.fromiter(itertools.chain.from_iterable(boxes), dtype = float)
+    boxes = numpy.rint(boxes.reshape(-1, 4) / 72.0 * 25.4)
+    return numpy.abs(boxes[:, 2:4] - boxes[:, 0:2])
+
+
+#
+# Papierformate vieler Größen in mm bestimmen
+#
+# Liefert je Größe ein Paar aus Papierformat und Ausrichtung wie
+# `paper_format()`. Mit NumPy werden alle Größen in einem Schritt gegen die
+# Formattabelle geprüft, ohne NumPy einzeln.
+#
+def paper_formats(sizes, tolerance = PAPER_TOLERANCE):
+    try:
+        import numpy
+    except ImportError:
+        return [ paper_format(width, height, tolerance) for width, height in sizes ]
+
+    sizes = numpy.asarray(sizes, dtype = float).reshape(-1, 2)
+    table = numpy.array([ ( pwidth, pheight ) for _, pwidth, pheight in PAPER_FORMATS ], dtype = float)
+
+    short = sizes.min(axis = 1)[:, None]
+    long  = sizes.max(axis = 1)[:, None]
+    match = ( numpy.abs(short - table[:, 0]) <= tolerance ) & ( numpy.abs(long - table[:, 1]) <= tolerance )
+
+    # Bei Überschneidungen gilt wie in `paper_format()` der erste Eintrag
+    papers  = numpy.array([ paper for paper, _, _ in PAPER_FORMATS ], dtype = object)[match.argmax(axis = 1)]
+    orients = numpy.where(sizes[:, 1] > sizes[:, 0], "p", "l").astype(object)
+
+    for idx in numpy.flatnonzero(~match.any(axis = 1)):
+        papers[idx]  = "%dx%d" % ( sizes[idx, 0], sizes[idx, 1] )
+        orients[idx] = None
+
+    return list(zip(papers.tolist(), orients.tolist()))
+
+
+#
+# Papierformate vieler Boxen (in pt) bestimmen
+#
+def classify_boxes(boxes, tolerance = PAPER_TOLERANCE):
+    return paper_formats(box_sizes(boxes), tolerance)
+
+
+
+#
+# Zwischenspeicher geöffneter PDF-Dokumente
+#
+# Es werden höchstens `maxsize` Dokumente offen gehalten. Darüber hinaus wird
+# das am längsten nicht benutzte Dokument verworfen und bei Bedarf erneut
+# geöffnet. Verworfene Dokumente werden nicht explizit geschlossen, da pikepdf
+# den Inhalt kopierter Seiten erst beim Speichern des Zieldokuments liest und
+# die Quelle bis dahin selbst am Leben hält.
+#
+class PdfPool:
+    def __init__(self, maxsize = 32, access_mode = 'default'):
+        self.maxsize = maxsize
+        self.access_mode = access_mode
+        self._pdfs = collections.OrderedDict()
+
+
+    def open(self, filename):
+        pdf = self._pdfs.pop(filename, None)
+        if pdf is None:
+            pdf = open_pdf(filename, self.access_mode)
+
+        return self.keep(filename, pdf)
+
+
+    #
+    # Bereits geöffnetes Dokument als zuletzt benutzt aufnehmen
+    #
+    def keep(self, filename, pdf):
+        self._pdfs.pop(filename, None)
+        self._pdfs[filename] = pdf
+        while self.maxsize is not None and len(self._pdfs) > self.maxsize:
+            self._pdfs.popitem(last = False)
+
+        return pdf
+
+
+    def page(self, filename, objgen):
+        return pikepdf.Page(self.open(filename).get_object(objgen))
+
+
+    def clear(self):
+        self._pdfs.clear()
+
+
+
+#
+# Seitenauswahl auswerten
+#
+# Zurückgegeben wird eine Liste von Seitenindizes (beginnend bei 0). Leerseiten
+# werden als `None` geliefert. Zur Prüfung wird nur die Seitenzahl des
+# Dokuments benötigt.
+#
+def parse_pagespec(pdfname, pagespec, pagecount):
+    result = []
+
+    for ps in pagespec.split(","):
+        if ps == "{}":
+            result.append(None)
+            continue
+
+        prange = ps.split("-")
+
+        if len(prange) > 2:
+            raise ValueError(
+                "Ungültiger Bereich '%s' für '%s'. '%s' ist keine Bereichsangabe." %
+                (
+                    pagespec,
+                    pdfname,
+                    ps,
+                )
+            )
+
+        if prange[0].isnumeric():
+            pfrom = int(prange[0])
+        elif prange[0] == '':
+            pfrom = None
+        else:
+            raise ValueError(
+                "Ungültiger Bereich '%s' für '%s'. '%s' ist keine Seiten-/Bereichsangabe." %
+                (
+                    pagespec,
+                    pdfname,
+                    ps,
+                )
+            )
+
+        if len(prange) < 2:
+            pto = None
+        elif prange[1].isnumeric():
+            pto = int(prange[1])
+        elif prange[1] == '':
+            pto = None
+        else:
+            raise ValueError(
+                "Ungültiger Bereich '%s' für '%s'. '%s' ist keine Bereichsangabe." %
+                (
+                    pagespec,
+                    pdfname,
+                    ps,
+                )
+            )
+
+        if pfrom is not None and (pfrom < 1 or pfrom > pagecount):
+            raise ValueError(
+                "Ungültiger Bereich '%s' für '%s'. Seitenangabe '%d' außerhalb des Bereichs. Das PDF enthält %d Seiten." %
+                (
+                    pagespec,
+                    pdfname,
+                    pfrom,
+                    pagecount,
+                )
+            )
+
+        if pto is not None and (pto < 1 or pto > pagecount):
+            raise ValueError(
+                "Ungültiger Bereich '%s' für '%s'. Seitenangabe '%d' außerhalb des Bereichs. Das PDF enthält %d Seiten." %
+                (
+                    pagespec,
+                    pdfname,
+                    pto,
+                    pagecount,
+                )
+            )
+
+        if pfrom is not None and pto is not None and pfrom > pto:
+            raise ValueError(
+                "Ungültiger Bereich '%s' für '%s'. Bereichsangabe '%s' ist nicht aufsteigend." %
+                (
+                    pagespec,
+                    pdfname,
+                    ps,
+                )
+            )
+
+        if len(prange) == 1:
+            if pfrom is None:
+                raise ValueError(
+                    "Ungültiger Bereich '%s' für '%s'. Bereich enthält leere Seiten-/Bereichsangabe." %
+                    (
+                        pagespec,
+                        pdfname,
+                    )
+                )
+
+            result.append(pfrom - 1)
+            continue
+
+        if pfrom is None:
+            pfrom = 1
+        if pto is None:
+            pto = pagecount
+
+        result.extend(range(pfrom - 1, pto))
+
+    return result
+
+
+#
+# Seitenauswahl aller Dokumente prüfen
+#
+# Zurückgegeben wird je Dokument ein Paar aus Dateiname und Seitenindizes. Zur
+# Prüfung wird nur die Seitenzahl benötigt. Die Dokumente werden dazu über
+# `pool` geöffnet, so dass höchstens dessen Größe an Dokumenten gleichzeitig
+# geöffnet ist. Die zuletzt geprüften Dokumente müssen bei der Aufzählung nicht
+# erneut eingelesen werden.
+#
+def select_pages(pdfs, pool = None):
+    if pool is None:
+        pool = PdfPool()
+
+    result = []
+    pagecounts = {}
+
+    for doc in split_pdfs(pdfs):
+        pdfname = doc[0]
+        if not pdfname.endswith(".pdf"):
+            raise ValueError("'%s' ist kein gültiger Dateiname." % pdfname)
+
+        if pdfname not in pagecounts:
+            pagecounts[pdfname] = len(pool.open(pdfname).pages)
+
+        pagecount = pagecounts[pdfname]
+
+        if len(doc) == 1:
+            result.append(( pdfname, list(range(pagecount)) ))
+        else:
+            result.append(( pdfname, parse_pagespec(pdfname, doc[1], pagecount) ))
+
+    return result
+
+
+def _iter_document(pool, pdfname, indices):
+    # Die lokale Referenz hält das Dokument während der Aufzählung fest, auch
+    # wenn es zwischenzeitlich aus dem Zwischenspeicher verdrängt wird.
+    pdf = pool.open(pdfname)
+
+    # Der wahlfreie Zugriff über `pdf.pages[idx]` durchläuft jedes Mal den
+    # Seitenbaum. Die benötigten Seiten werden daher in einem Durchlauf
+    # herausgesucht.
+    needed = set(indices)
+    pages = { idx: p for idx, p in enumerate(pdf.pages) if idx in needed }
+
+    for idx in indices:
+        yield None if idx is None else pages[idx]
+
+
+#
+# Seiten aller Dokumente laden
+#
+# Die Seitenauswahl wird vorab vollständig geprüft. Die Dokumente werden erst
+# bei der Aufzählung über `pool` geöffnet. Geliefert wird je Dokument ein Paar
+# aus Dateiname und einer Folge von Seiten bzw. `None` für Leerseiten.
+#
+def load_pages(pdfs, pool = None):
+    if pool is None:
+        pool = PdfPool()
+
+    selection = select_pages(pdfs, pool)
+
+    return ( ( pdfname, _iter_document(pool, pdfname, indices) ) for pdfname, indices in selection )
+
+
+
+#
+# Seitenauswahl in ein neues Dokument schreiben
+#
+# Zwischen den einzelnen PDF-Dateien wird mit Leerseiten auf das nächste
+# Vielfache von `modulus` aufgefüllt. Leerseiten erhalten das Format der
+# benachbarten Seite.
+#
+def write_selection(pdfs, output, modulus = 1, access_mode = 'default', **saveargs):
+    outpdf = pikepdf.Pdf.new()
+
+    for pdfname, ps in load_pages(pdfs, PdfPool(access_mode = access_mode)):
+        lastpage = None
+        blankpages = 0
+
+        ps = list(ps)
+        ps.extend((-len(ps) % modulus) * [ None ])
+
+        for p in ps:
+            if p is None:
+                if lastpage is None:
+                    blankpages += 1
+                else:
+                    width  = abs(lastpage.trimbox[2] - lastpage.trimbox[0])
+                    height = abs(lastpage.trimbox[3] - lastpage.trimbox[1])
+                    outpdf.add_blank_page(page_size = ( width, height ))
+
+                continue
+
+            lastpage = pikepdf.Page(p)
+
+            if blankpages:
+                for i in range(blankpages):
+                    width  = abs(lastpage.trimbox[2] - lastpage.trimbox[0])
+                    height = abs(lastpage.trimbox[3] - lastpage.trimbox[1])
+                    outpdf.add_blank_page(page_size = ( width, height ))
+                blankpages = 0
+
+            outpdf.pages.append(p)
+
+    outpdf.save(output, **saveargs)
+
+    return len(outpdf.pages)
+
+
+def _pagelabels(pdf):
+    if '/PageLabels' not in pdf.Root:
+        return []
+
+    result = []
+
+    def walk(node):
+        if '/Nums' in node:
+            nums = node.Nums
+            for idx in range(0, len(nums) - 1, 2):
+                result.append(( int(nums[idx]), nums[idx + 1] ))
+        if '/Kids' in node:
+            for kid in node.Kids:
+                walk(kid)
+
+    walk(pdf.Root.PageLabels)
+    result.sort(key = lambda x : x[0])
+
+    return result
+
+
+def _outline_copy(items, target, pageindex, offset):
+    for item in items:
+        dest = item.destination
+        if dest is None and item.action is not None and item.action.get('/S') == pikepdf.Name.GoTo:
+            dest = item.action.D
+
+        page = None
+        if isinstance(dest, pikepdf.Array) and len(dest) and dest[0].is_indirect:
+            page = pageindex.get(dest[0].objgen)
+
+        if page is None:
+            newitem = pikepdf.OutlineItem(item.title)
+        else:
+            newitem = pikepdf.OutlineItem(item.title, offset + page)
+
+        _outline_copy(item.children, newitem.children, pageindex, offset)
+        target.append(newitem)
+
+
+# Von übergeordneten Knoten des Seitenbaums vererbbare Einträge
+_INHERITABLE = [ '/Resources', '/MediaBox', '/CropBox', '/Rotate' ]
+
+
+#
+# Seiten an ein Dokument anhängen
+#
+# `PageList.extend` prüft für jede Seite, ob sie bereits im Zieldokument
+# enthalten ist, und benötigt dadurch quadratische Laufzeit. Die Seiten werden
+# daher einzeln kopiert und direkt in den Seitenbaum eingehängt. Vererbte
+# Einträge werden zuvor in die Quellseite übernommen.
+#
+def _append_pages(out, pages):
+    root = out.Root.Pages
+
+    for p in pages:
+        for key in _INHERITABLE:
+            if key in p.obj:
+                continue
+
+            node = p.obj.get('/Parent')
+            while node is not None and key not in node:
+                node = node.get('/Parent')
+            if node is not None:
+                p.obj[key] = node[key]
+
+        obj = out.copy_foreign(p.obj)
+        obj.Parent = root
+        root.Kids.append(obj)
+
+    root.Count = len(root.Kids)
+
+
+#
+# Teildokumente zusammenführen
+#
+# Lesezeichen und Seitenbeschriftungen der Teildokumente werden übernommen und
+# um die Zahl der vorangehenden Seiten verschoben. Das zusammengeführte
+# Dokument wird ungespeichert zurückgegeben.
+#
+def merge_documents(filenames):
+    out = pikepdf.Pdf.new()
+
+    labels = []
+    offset = 0
+
+    with out.open_outline() as outline:
+        for filename in filenames:
+            src = pikepdf.Pdf.open(filename)
+
+            if '/PageLayout' in src.Root:
+                out.Root.PageLayout = src.Root.PageLayout
+            if '/PageMode' in src.Root:
+                out.Root.PageMode = src.Root.PageMode
+
+            pageindex = { p.obj.objgen: idx for idx, p in enumerate(src.pages) }
+            with src.open_outline() as srcoutline:
+                _outline_copy(srcoutline.root, outline.root, pageindex, offset)
+
+            # Seiten ohne Beschriftung werden fortlaufend nummeriert.
+            srclabels = _pagelabels(src)
+            if srclabels and not labels and offset > 0:
+                labels.append(( 0, pikepdf.Dictionary(S = pikepdf.Name.D) ))
+            if ( srclabels or labels ) and ( not srclabels or srclabels[0][0] != 0 ):
+                srclabels.insert(0, ( 0, pikepdf.Dictionary(S = pikepdf.Name.D, St = offset + 1) ))
+            for num, label in srclabels:
+                labels.append(( offset + num, pikepdf.Dictionary({ k: v for k, v in label.items() }) ))
+
+            _append_pages(out, src.pages)
+            offset += len(src.pages)
+
+    if labels:
+        nums = pikepdf.Array()
+        for num, label in labels:
+            nums.append(num)
+            nums.append(label)
+        out.Root.PageLabels = pikepdf.Dictionary(Nums = nums)
+
+    return out
+
+
+def merge_pdfs(filenames, output, **saveargs):
+    out = merge_documents(filenames)
+    out.save(output, **saveargs)
+
+    return len(out.Root.Pages.Kids)
+
+
+#
+# Kommandozeilenargumente in Dokumente samt Seitenauswahl aufteilen
+#
+def split_pdfs(pdfs):
+    pdfs = list(pdfs)
+    result = []
+
+    while pdfs:
+        pdfname = pdfs.pop(0)
+        if len(pdfs) == 0 or pdfs[0].endswith(".pdf"):
+            result.append([ pdfname ])
+        else:
+            result.append([ pdfname, pdfs.pop(0) ])
+
+    return result
@@ -19,70 +19,80 @@
 #
 
 import argparse
-import pikepdf
-
-from aip import load_pages
-
-
-
-parser = argparse.ArgumentParser(
-        description = "Seiten aus PDFs extrahieren"
-    )
-
-parser.add_argument(
-    '--output',
-    metavar = 'FILE',
-    type = str,
-    required = True,
-    help = 'Ausgabedatei')
-
-parser.add_argument(
-    '--modulus',
-    metavar = 'N',
-    type = int,
-    default = 1,
-    help = 'Zwischen einzelnen PDF-Dateien auf nächstes Vielfaches von N auffüllen')
-
-parser.add_argument(
-    'pdfs',
-    metavar = 'PDF [PAGESPEC]',
-    type = str,
-    nargs = '+',
-    help = 'PDF-Dateien')
-
-args = parser.parse_args()
-
-
-
-outpdf = pikepdf.Pdf.new()
-
-pdfs = load_pages(args.pdfs)
-for pdfname, ps, _ in pdfs:
-    lastpage = None
-    blankpages = 0
-
-    ps.extend((-len(ps) % args.modulus) * [ None ])
-
-    for p in ps:
-        if p is None:
-            if lastpage is None:
-                blankpages += 1
-            else:
-                width  = abs(lastpage.trimbox[2] - lastpage.trimbox[0])
-                height = abs(lastpage.trimbox[3] - lastpage.trimbox[1])
-                outpdf.add_blank_page(page_size = ( width, height ))
-
-            continue
-
-        lastpage = pikepdf.Page(p)
-
-        if blankpages:
-            for i in range(blankpages):
-                width  = abs(lastpage.trimbox[2] - lastpage.trimbox[0])
-                height = abs(lastpage.trimbox[3] - lastpage.trimbox[1])
-                outpdf.add_blank_page(page_size = ( width, height ))
-            blankpages = 0
-
-        outpdf.pages.append(p)
-
-outpdf.save(args.output)
+import concurrent.futures
+import os
+import sys
+import tempfile
+
+from aip_lib import ACCESS_MODES
+from aip_lib import merge_pdfs
+from aip_lib import split_pdfs
+from aip_lib import write_selection
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description = "Seiten aus PDFs extrahieren"
+        )
+
+    parser.add_argument(
+        '--output',
+        metavar = 'FILE',
+        type = str,
+        required = True,
+        help = 'Ausgabedatei')
+
+    parser.add_argument(
+        '--modulus',
+        metavar = 'N',
+        type = int,
+        default = 1,
+        help = 'Zwischen einzelnen PDF-Dateien auf nächstes Vielfaches von N auffüllen')
+
+    parser.add_argument(
+        'pdfs',
+        metavar = 'PDF [PAGESPEC]',
+        type = str,
+        nargs = '+',
+        help = 'PDF-Dateien')
+
+    parser.add_argument(
+        '--access-mode',
+        choices = ACCESS_MODES,
+        default = 'default',
+        help = 'Zugriffsart auf Eingabedateien (mmap teilt den Seitencache zwischen Prozessen)')
+
+    parser.add_argument(
+        '--jobs',
+        metavar = 'N',
+        type = int,
+        default = 1,
+        help = 'Anzahl paralleler Prozesse')
+
+    args = parser.parse_args()
+
+
+
+    if args.jobs <= 1:
+        write_selection(args.pdfs, args.output, modulus = args.modulus, access_mode = args.access_mode)
+        sys.exit(0)
+
+    # Die Dokumente auf Teilaufträge verteilen, diese parallel erzeugen und
+    # anschließend zusammenführen. Da das Auffüllen mit Leerseiten je Dokument
+    # erfolgt, ist das Ergebnis identisch.
+    documents = split_pdfs(args.pdfs)
+    chunkcount = min(len(documents), 2 * args.jobs)
+    chunksize = -(-len(documents) // chunkcount)
+    chunks = [ sum(documents[i : i + chunksize], []) for i in range(0, len(documents), chunksize) ]
+
+    outdir = os.path.dirname(os.path.abspath(args.output))
+    with tempfile.TemporaryDirectory(dir = outdir) as tmpdir:
+        chunkfiles = [ os.path.join(tmpdir, 'chunk-%04d.pdf' % idx) for idx in range(len(chunks)) ]
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers = args.jobs) as executor:
+            futures = [ executor.submit(write_selection, c, f, modulus = args.modulus, access_mode = args.access_mode) for c, f in zip(chunks, chunkfiles) ]
+            for future in futures:
+                future.result()
+
+        merge_pdfs(chunkfiles, args.output)
@@ -0,0 +1,218 @@
+#!/bin/env python3
+
+#
+# Copyright (C) 2021 Mario Haustein, mario@mariohaustein.de
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+import argparse
+import importlib
+import os
+import tempfile
+import time
+
+
+
+# Seitenformate der synthetischen Testdaten in mm (Breite, Höhe, Rotation),
+# angelehnt an die Zusammensetzung eines Flugplatzkapitels der AIP VFR
+SAMPLE_PAGES = \
+[
+    ( 148, 210,   0 ),
+    ( 148, 210,   0 ),
+    ( 277, 210,   0 ),
+    ( 210, 277,   0 ),
+    ( 148, 210,   0 ),
+    ( 210, 297,  90 ),
+    ( 380, 297,   0 ),
+    ( 148, 210,   0 ),
+    ( 148, 210,   0 ),
+    ( 200, 200,   0 ),
+]
+
+
+
+#
+# Synthetisches Eingabedokument erzeugen
+#
+def make_sample(filename, pages):
+    import pikepdf
+
+    pdf = pikepdf.Pdf.new()
+
+    for idx in range(pages):
+        width, height, rotation = SAMPLE_PAGES[idx % len(SAMPLE_PAGES)]
+        page = pdf.add_blank_page(page_size = ( width / 25.4 * 72.0, height / 25.4 * 72.0 ))
+        if rotation:
+            page.obj.Rotate = rotation
+        page.obj.Contents = pdf.make_stream(b"0 0 1 RG 2 w 10 10 %.2f %.2f re S" % ( width / 25.4 * 72.0 - 20, height / 25.4 * 72.0 - 20 ))
+
+    pdf.save(filename)
+
+
+class Timer:
+    def __init__(self):
+        self.start = time.perf_counter()
+
+    def lap(self, label):
+        now = time.perf_counter()
+        print("%-24s  %8.3f s" % ( label, now - self.start ))
+        self.start = now
+
+
+
+def bench_impose(args):
+    import pikepdf
+    from aip_lib import load_pages
+    from vfr_print import Imposer
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sample = os.path.join(tmpdir, 'sample.pdf')
+        output = os.path.join(tmpdir, 'print.pdf')
+
+        make_sample(sample, args.pages)
+
+        timer = Timer()
+
+        imposer = Imposer(
+            cropmark   = True,
+            punchmark  = True,
+            foldmark   = True,
+            tc_to_a4   = args.tc_to_a4,
+            misc_to_a4 = True)
+
+        pdfs = load_pages([ sample ] * args.documents, imposer.pool)
+        timer.lap("Laden")
+
+        for filename, pages in pdfs:
+            imposer.add(filename, pages)
+        timer.lap("Einsortieren")
+
+        if args.jobs > 1:
+            sheets = imposer.write(output, jobs = args.jobs)
+            timer.lap("Ausschießen/Speichern")
+        else:
+            pdf = pikepdf.Pdf.new()
+            sheets = sum(1 for _ in imposer.sheets(pdf))
+            timer.lap("Ausschießen")
+
+            pdf.save(output)
+            timer.lap("Speichern")
+
+        print("%d Seiten, %d Bögen, %.1f MB" %
+            (
+                args.pages * args.documents,
+                sheets,
+                os.path.getsize(output) / 1e6,
+            )
+        )
+
+
+
+def bench_classify(args):
+    import pikepdf
+    from aip_lib import box_size
+    from aip_lib import classify_boxes
+    from aip_lib import paper_format
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        sample = os.path.join(tmpdir, 'sample.pdf')
+
+        make_sample(sample, args.pages)
+
+        timer = Timer()
+
+        # Das einmalige Laden von NumPy getrennt ausweisen
+        try:
+            importlib.import_module('numpy')
+        except ImportError:
+            pass
+        timer.lap("NumPy laden")
+
+        pdf = pikepdf.Pdf.open(sample)
+        boxes = [ pikepdf.Page(p).trimbox for p in pdf.pages ]
+        timer.lap("Boxen lesen")
+
+        single = [ paper_format(*box_size(box)) for box in boxes ]
+        timer.lap("Einzeln")
+
+        bulk = classify_boxes(boxes)
+        timer.lap("Gemeinsam")
+
+        if single != bulk:
+            raise ValueError("Ergebnisse weichen voneinander ab")
+
+        print("%d Seiten, %d Formate" % ( len(bulk), len(set(bulk)) ))
+
+
+
+parser = argparse.ArgumentParser(
+        description = "Laufzeitmessungen"
+    )
+
+commands = parser.add_subparsers(required = True)
+
+
+command_impose = commands.add_parser(
+    'impose',
+    description = "Ausschießen eines synthetischen Dokuments messen")
+
+command_impose.add_argument(
+    '--pages',
+    metavar = 'N',
+    type = int,
+    default = 1000,
+    help = "Seiten je Eingabedokument")
+
+command_impose.add_argument(
+    '--documents',
+    metavar = 'N',
+    type = int,
+    default = 1,
+    help = "Anzahl der Eingabedokumente")
+
+command_impose.add_argument(
+    '--jobs',
+    metavar = 'N',
+    type = int,
+    default = 1,
+    help = "Anzahl paralleler Prozesse")
+
+command_impose.add_argument(
+    '--tc-to-a4',
+    action = 'store_true',
+    help = 'Terminal Charts auf A4 verkleinern')
+
+command_impose.set_defaults(func = bench_impose)
+
+
+command_classify = commands.add_parser(
+    'classify',
+    description = "Bestimmung der Papierformate eines synthetischen Dokuments messen")
+
+command_classify.add_argument(
+    '--pages',
+    metavar = 'N',
+    type = int,
+    default = 10000,
+    help = "Seiten des Eingabedokuments")
+
+command_classify.set_defaults(func = bench_classify)
+
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    args.func(args)
@@ -19,243 +19,57 @@
 #
 
 import argparse
+import concurrent.futures
+import functools
+import os
 import pikepdf
 import sys
+import tempfile
 
-from aip import load_pages
+from aip_lib import ACCESS_MODES
+from aip_lib import PdfPool
+from aip_lib import load_pages
+from aip_lib import merge_pdfs
+from aip_lib import paper_format
+from aip_lib import paper_formats
 
 
 
-parser = argparse.ArgumentParser(
-        description = "AIP-PDFs für Druck ausschießen"
-    )
+# Reihenfolge der Formate im Druckdokument
+FORMATS = [ 'A5', 'A4N', 'A4', 'TC', 'MISC' ]
 
-parser.add_argument(
-    '--output',
-    metavar = 'FILE',
-    type = str,
-    required = True,
-    help = 'Ausgabedatei')
+# Bogengrößen in Punkten (Querformat)
+SHEET_A4 = ( 297 / 25.4 * 72.0, 210 / 25.4 * 72.0 )
+SHEET_A3 = ( 420 / 25.4 * 72.0, 297 / 25.4 * 72.0 )
 
-parser.add_argument(
-    '--cropmark',
-    action = 'store_true',
-    help = 'Schnitmarken zeichnen')
+# Seiten je Bogen und Format
+PAGES_PER_SHEET = { 'A5': 4, 'A4N': 2, 'A4': 2, 'TC': 2, 'MISC': 2 }
 
-parser.add_argument(
-    '--punchmark',
-    action = 'store_true',
-    help = 'Lochmarken zeichnen')
+# Fächer der Papierformate aus `aip_lib.PAPER_FORMATS`. Alle übrigen Formate
+# landen in MISC.
+PAPER_BUCKETS = { 'A5': 'A5', 'A4n': 'A4N', 'A4': 'A4', 'TC': 'TC' }
 
-parser.add_argument(
-    '--foldmark',
-    action = 'store_true',
-    help = 'Faltmarken zeichnen')
 
-parser.add_argument(
-    '--tc-to-a4',
-    action = 'store_true',
-    help = 'Terminal Charts auf A4 verkleinern')
 
-parser.add_argument(
-    '--misc-to-a4',
-    action = 'store_true',
-    help = 'Unbekannte Formate auf A4 verkleinern')
-
-parser.add_argument(
-    'pdfs',
-    metavar = 'PDF',
-    type = str,
-    nargs = '+',
-    help = 'PDF-Dateien')
-
-args = parser.parse_args()
-
-
-
-PAGES_A5   = []
-PAGES_A4N  = []
-PAGES_A4   = []
-PAGES_TC   = []
-PAGES_MISC = []
-
-
-
-pdfs = load_pages(args.pdfs)
-
-for filename, pages, _ in pdfs:
-    currlist = None
-    nextlist = None
-
-    for p in pages:
-        if p is None:
-            if currlist is not None:
-                currlist.append(None)
-            continue
-
-        page = pikepdf.Page(p)
-
-        box = [ round(float(x) / 72.0 * 25.4) for x in page.trimbox ]
-        box_left   = min(box[0], box[2])
-        box_right  = max(box[0], box[2])
-        box_bottom = min(box[1], box[3])
-        box_top    = max(box[1], box[3])
-        box_width  = box_right - box_left
-        box_height = box_top   - box_bottom
-
-        width  = box_width
-        height = box_height
-
-        rotation = p.Rotate if '/Rotate' in p else 0
-        if rotation % 180:
-            width, height = height, width
-
-        # Genau genommen gibt es keine reinen A4-Seiten. Stattdessen ist es
-        # wahrscheinlicher, dass die Zuschnittsbox der Seite falsch angelegt
-        # wurde (z.B. AD-2 EDDC-2). Wir kürzen die Seite ein, sodass eine auf
-        # A5 einklappbare Seite entsteht.
-        if ( width, height ) == ( 210, 297 ):
-            box_height = 277
-            box_top = box_bottom + box_height
-            box = [ round(float(x) / 25.4 * 72.0) for x in [ box_left, box_bottom, box_right, box_top ] ]
-            page.trimbox = box
-
-        pagedict = \
-        {
-            'page':      p,
-            'width':     width,
-            'height':    height,
-            'rotation':  rotation,
-            'landscape': width > height,
-            # 'box_left':   box_left,
-            # 'box_right':  box_right,
-            # 'box_bottom': box_bottom,
-            # 'box_top':    box_top,
-            # 'box_width':  box_width,
-            # 'box_height': box_height,
-        }
-
-        if ( box_width, box_height ) in [ ( 148, 210 ), ( 210, 148 ), ( 211, 148 ) ]:
-            pagedict['format'] = 'A5'
-
-            if currlist is PAGES_A4N and len(PAGES_A4N) % 2 and width < height:
-                # Eine hochformatige A5-Seite, die auf eine kurze, ungerade
-                # A4-Seite folgt, wird auf die Rückseite der A4-Seite gedruckt.
-                nextlist = PAGES_A4N
-            else:
-                nextlist = PAGES_A5
-
-        elif ( box_width, box_height ) in [ ( 210, 277 ), ( 277, 210 ) ]:
-            pagedict['format'] = 'A4N'
-
-            if currlist is PAGES_A4N and len(PAGES_A4N) % 2 and \
-               (
-                 width > height and not PAGES_A4N[-1]['landscape'] or
-                 width < height and     PAGES_A4N[-1]['landscape']
-               ):
-                # Folgt eine schmale A4-Seite im Hochformat auf eine schmale,
-                # ungerade A4-Seite im Querformat oder umgekehrt (Querformat
-                # folgt auf Hochformat), dann wird eine Leerseite eingefügt,
-                # weil beide Seiten ungerade sind.
-                PAGES_A4N.append(None)
-
-            nextlist = PAGES_A4N
-
-        elif ( box_width, box_height ) in [ ( 210, 297 ), ( 297, 210 ) ]:
-            pagedict['format'] = 'A4'
-            nextlist = PAGES_A4
-
-        elif ( box_width, box_height ) in [ ( 297, 380 ), ( 380, 297 ) ]:
-            pagedict['format'] = 'TC'
-
-            # Terminal Charts sind duplex, der Rest (Rollschemata) wird simplex
-            # aufgearbeitet.
-            if currlist is not PAGES_TC and len(PAGES_TC) % 2 != 0:
-                PAGES_TC.append(None)
-            nextlist = PAGES_TC
-
-        elif args.misc_to_a4:
-            # Eine Lücke lassen, wenn das Vorgängerformat nicht passt.
-            if len(PAGES_MISC) % 2 and PAGES_MISC[-1] is not None:
-                lastpage = PAGES_MISC[-1]
-                if ( pagedict['width'], pagedict['height'] ) != ( lastpage['width'], lastpage['height'] ) and \
-                   ( pagedict['width'], pagedict['height'] ) != ( lastpage['height'], lastpage['width'] ):
-                    PAGES_MISC.append(None)
-
-            pagedict['format'] = 'MISC'
-            if pagedict['landscape']:
-                pagedict['scale'] = min(1.0, 297.0 / pagedict['width'], 210.0 / pagedict['height'])
-            else:
-                pagedict['scale'] = min(1.0, 210.0 / pagedict['width'], 297.0 / pagedict['height'])
-            nextlist = PAGES_MISC
-
-        else:
-            sys.stderr.write(
-                "Seite %s von '%s' hat ein unbekanntes Format %dmm x %dmm. Seite bitte manuell drucken.\n" %
-                (
-                    page.label,
-                    filename,
-                    box_width,
-                    box_height,
-                )
-            )
-
-        # Beim Wechsel des Seitenformats ggf. eine Leerseite einfügen
-        if nextlist is not currlist and len(nextlist) % 2 != 0:
-            nextlist.append(None)
-
-        nextlist.append(pagedict)
-        currlist = nextlist
-
-    # Sicherstellen, dass wir bei jedem neuen Dokument mit einer ungeraden
-    # Seite beginnen.
-    if len(PAGES_A5) % 2 != 0:
-        PAGES_A5.append(None)
-    if len(PAGES_A4N) % 2 != 0:
-        PAGES_A4N.append(None)
-    if len(PAGES_A4) % 2 != 0:
-        PAGES_A4.append(None)
-    if len(PAGES_TC) % 2 != 0:
-        PAGES_TC.append(None)
-    if len(PAGES_MISC) % 2 != 0:
-        PAGES_MISC.append(None)
-
-PAGES_A5.extend((-len(PAGES_A5) % 4) * [ None ])
-PAGES_A4N.extend((-len(PAGES_A4N) % 2) * [ None ])
-PAGES_A4.extend((-len(PAGES_A4) % 2) * [ None ])
-PAGES_TC.extend((-len(PAGES_TC) % 2) * [ None ])
-PAGES_MISC.extend((-len(PAGES_MISC) % 2) * [ None ])
-
-
-
-def placepage(pdf, target, source,
+#
+# Transformationsmatrix einer Platzierung bestimmen
+#
+# Die AIP verwendet nur wenige Seitenformate und Platzierungen. Die Matrix wird
+# daher je Kombination aus Zuschnittsbox, Rotation und Platzierung nur einmal
+# berechnet.
+#
+@functools.lru_cache(maxsize = 1024)
+def transform(rotation, box_left, box_bottom, box_right, box_top,
               landscape = False,
               turn = False,
               offx = 0.0, offy = 0.0,
               scale = None,
               shiftx = 0.0, shifty = 0.0):
-    if source is None:
-        return
-
-    # Die Quellseiten kopieren und als Ressource in die Zielseiten einfügen
-    sourcepage = pikepdf.Page(source['page'])
-    targetpage = pikepdf.Page(target)
-    obj = pdf.copy_foreign(sourcepage.as_form_xobject())
-    name = targetpage.add_resource(obj, pikepdf.Name.XObject)
-
     m = pikepdf.Matrix()
 
-    # Abmessungen bestimmen.
-    box_left   = float(min(sourcepage.trimbox[0], sourcepage.trimbox[2]))
-    box_right  = float(max(sourcepage.trimbox[0], sourcepage.trimbox[2]))
-    box_bottom = float(min(sourcepage.trimbox[1], sourcepage.trimbox[3]))
-    box_top    = float(max(sourcepage.trimbox[1], sourcepage.trimbox[3]))
     box_width  = box_right - box_left
     box_height = box_top   - box_bottom
 
-    # Anzeigeausrichtung der Seite bestimmen.
-    rotation = source['page'].Rotate if '/Rotate' in source['page'] else 0
-
     # Anzeigeausrichtung kompensieren. Karte an unterer linken Ecke ausrichten.
     m = m @ pikepdf.Matrix().rotated(rotation)
     m = m @ pikepdf.Matrix().translated(-box_left, -box_bottom)
@@ -295,9 +109,49 @@ def placepage(pdf, target, source,
     # Seite platzieren.
     m = m @ pikepdf.Matrix().translated(shiftx, shifty)
 
+    return m.shorthand
+
+
+def placepage(pdf, target, source,
+              landscape = False,
+              turn = False,
+              offx = 0.0, offy = 0.0,
+              scale = None,
+              shiftx = 0.0, shifty = 0.0,
+              forms = None):
+    if source is None:
+        return
+
+    # Die Quellseiten kopieren und als Ressource in die Zielseiten einfügen.
+    # Mit `forms` wird jede Quellseite nur einmal in das Zieldokument kopiert
+    # und bei jeder weiteren Platzierung wiederverwendet.
+    sourcepage = pikepdf.Page(source['page'])
+    targetpage = pikepdf.Page(target)
+
+    key = source.get('key')
+    obj = forms.get(key) if forms is not None and key is not None else None
+    if obj is None:
+        obj = pdf.copy_foreign(sourcepage.as_form_xobject())
+        if forms is not None and key is not None:
+            forms[key] = obj
+
+    name = targetpage.add_resource(obj, pikepdf.Name.XObject)
+
+    # Abmessungen bestimmen.
+    box = [ float(x) for x in sourcepage.trimbox ]
+
+    # Anzeigeausrichtung der Seite bestimmen.
+    rotation = int(source['page'].Rotate) if '/Rotate' in source['page'] else 0
+
+    m = transform(
+        rotation,
+        min(box[0], box[2]), min(box[1], box[3]),
+        max(box[0], box[2]), max(box[1], box[3]),
+        landscape, turn, offx, offy, scale, shiftx, shifty)
+
     commands = []
     commands.append(( [],                         pikepdf.Operator('q')  ))
-    commands.append(( pikepdf.Array(m.shorthand), pikepdf.Operator('cm') ))
+    commands.append(( pikepdf.Array(m),           pikepdf.Operator('cm') ))
     commands.append(( [ name ],                   pikepdf.Operator('Do') ))
     commands.append(( [],                         pikepdf.Operator('Q')  ))
 
@@ -318,7 +172,15 @@ def pdfcmds_circle(x, y, r):
     return commands
 
 
-def marks_a5(pdf, page, cropmark = False, punchmark = False, foldmark = False):
+#
+# Inhalt der Zusatzmarken je Bogenformat
+#
+# Die Marken hängen nur von den gewählten Optionen ab. Der Inhaltsstrom wird
+# daher je Kombination nur einmal erzeugt und mit `placemarks()` als
+# gemeinsames Formular auf den Bögen platziert.
+#
+@functools.lru_cache(maxsize = None)
+def marks_a5(cropmark = False, punchmark = False, foldmark = False):
     commands = []
 
     # Schnittmarke
@@ -350,10 +212,11 @@ def marks_a5(pdf, page, cropmark = False, punchmark = False, foldmark = False):
         commands.extend(pdfcmds_circle((297 / 2 + 12) / 25.4 * 72.0, 185.0 / 25.4 * 72.0, 2 / 25.4 * 72.0))
         commands.append(( [],      pikepdf.Operator('Q') ))
 
-    pikepdf.Page(page).contents_add(pikepdf.unparse_content_stream(commands))
+    return pikepdf.unparse_content_stream(commands)
 
 
-def marks_a4(pdf, page, cropmark = False, punchmark = False, foldmark = False):
+@functools.lru_cache(maxsize = None)
+def marks_a4(cropmark = False, punchmark = False, foldmark = False):
     commands = []
 
     # Schnittmarke
@@ -395,10 +258,11 @@ def marks_a4(pdf, page, cropmark = False, punchmark = False, foldmark = False):
         commands.append(( [],                                      pikepdf.Operator('S') ))
         commands.append(( [],                                      pikepdf.Operator('Q') ))
 
-    pikepdf.Page(page).contents_add(pikepdf.unparse_content_stream(commands))
+    return pikepdf.unparse_content_stream(commands)
 
 
-def marks_a3(pdf, page, cropmark = False, punchmark = False, foldmark = False):
+@functools.lru_cache(maxsize = None)
+def marks_a3(cropmark = False, punchmark = False, foldmark = False):
     commands = []
 
     if cropmark:
@@ -451,161 +315,710 @@ def marks_a3(pdf, page, cropmark = False, punchmark = False, foldmark = False):
         commands.append(( [],                                       pikepdf.Operator('S') ))
         commands.append(( [],                                       pikepdf.Operator('Q') ))
 
-    pikepdf.Page(page).contents_add(pikepdf.unparse_content_stream(commands))
-
-
-
-OUT = pikepdf.Pdf.new()
-
-for i in range(0, len(PAGES_A5), 4):
-    # Zwei leere A4-Zielseiten anlegen.
-    OUT.add_blank_page(page_size = ( 297 / 25.4 * 72.0, 210 / 25.4 * 72.0 ))
-    OUT.add_blank_page(page_size = ( 297 / 25.4 * 72.0, 210 / 25.4 * 72.0 ))
-
-    placepage(OUT, OUT.pages[-2], PAGES_A5[i + 0], turn = True)
-    placepage(OUT, OUT.pages[-1], PAGES_A5[i + 1], turn = False)
-    placepage(OUT, OUT.pages[-1], PAGES_A5[i + 2], turn = False, shiftx = 148 / 25.4 * 72.0)
-    placepage(OUT, OUT.pages[-2], PAGES_A5[i + 3], turn = True,  shiftx = 148 / 25.4 * 72.0)
-
-    marks_a5(OUT, OUT.pages[-2], cropmark = args.cropmark, punchmark = args.punchmark, foldmark = args.foldmark)
-
-    p1 = pikepdf.Page(OUT.pages[-2])
-    p2 = pikepdf.Page(OUT.pages[-1])
-    p1.contents_coalesce()
-    p2.contents_coalesce()
-    p1.remove_unreferenced_resources()
-    p2.remove_unreferenced_resources()
-
-for i in range(0, len(PAGES_A4N), 2):
-    # Zwei leere A4-Zielseiten anlegen.
-    OUT.add_blank_page(page_size = ( 297 / 25.4 * 72.0, 210 / 25.4 * 72.0 ))
-    OUT.add_blank_page(page_size = ( 297 / 25.4 * 72.0, 210 / 25.4 * 72.0 ))
-
-    # A5-Seiten auf der Rückseite einer A4-Seite im Hochformat belassen.
-    pg2 = PAGES_A4N[i + 1]
-    landscape = pg2 is None or pg2['format'] != 'A5'
-
-    placepage(OUT, OUT.pages[-2], PAGES_A4N[i + 0], landscape = True,      turn = False)
-    placepage(OUT, OUT.pages[-1], PAGES_A4N[i + 1], landscape = landscape, turn = True)
-
-    marks_a4(OUT, OUT.pages[-2], cropmark = args.cropmark, punchmark = args.punchmark, foldmark = args.foldmark)
-
-    p1 = pikepdf.Page(OUT.pages[-2])
-    p2 = pikepdf.Page(OUT.pages[-1])
-    p1.contents_coalesce()
-    p2.contents_coalesce()
-    p1.remove_unreferenced_resources()
-    p2.remove_unreferenced_resources()
-
-
-for i in range(0, len(PAGES_A4), 2):
-    # Zwei leere A4-Zielseiten anlegen.
-    OUT.add_blank_page(page_size = ( 297 / 25.4 * 72.0, 210 / 25.4 * 72.0 ))
-    OUT.add_blank_page(page_size = ( 297 / 25.4 * 72.0, 210 / 25.4 * 72.0 ))
-
-    placepage(OUT, OUT.pages[-2], PAGES_A4[i + 0], landscape = True, turn = False)
-    placepage(OUT, OUT.pages[-1], PAGES_A4[i + 1], landscape = True, turn = True)
-
-    marks_a4(OUT, OUT.pages[-2], cropmark = args.cropmark, punchmark = args.punchmark, foldmark = args.foldmark)
-
-    p1 = pikepdf.Page(OUT.pages[-2])
-    p2 = pikepdf.Page(OUT.pages[-1])
-    p1.contents_coalesce()
-    p2.contents_coalesce()
-    p1.remove_unreferenced_resources()
-    p2.remove_unreferenced_resources()
-
-
-for i in range(0, len(PAGES_TC), 2):
-    if args.tc_to_a4:
-        # Zwei leere A4-Zielseiten anlegen.
-        OUT.add_blank_page(page_size = ( 297 / 25.4 * 72.0, 210 / 25.4 * 72.0 ))
-        OUT.add_blank_page(page_size = ( 297 / 25.4 * 72.0, 210 / 25.4 * 72.0 ))
-
-        #
-        # Format der TC-Seite
-        # - Lochrand:         25mm
-        # - nutzbare Breite: 355mm
-        # - nutzbare Höhe:   297mm
-        #
-        # Format der A4-Seite
-        # - Lochrand:         17mm
-        # - nutzbare Breite: 260mm
-        # - nutzbare Höhe:   210mm
-        #
-        # Skalierung:
-        # - Breite 260mm / 355mm = 0.732
-        # - Höhe   210mm / 297mm = 0.707 = 1 / sqrt(2)
-        #
-        # Die Höhe ist bschränkend. Es ist keine Verschiebung in y-Richtung
-        # notwendig.
-        #
-        placepage(OUT, OUT.pages[-2], PAGES_TC[i + 0], landscape = True, turn = False,
-            offx = 25 / 25.4 * 72.0, offy = 297 / 2 / 25.4 * 72.0,
-            scale = 0.68,
-            shiftx = 20 / 25.4 * 72.0, shifty = 210 / 2 / 25.4 * 72.0)
-        placepage(OUT, OUT.pages[-1], PAGES_TC[i + 1], landscape = True, turn = True,
-            offx = 25 / 25.4 * 72.0, offy = 297 / 2 / 25.4 * 72.0,
-            scale = 0.68,
-            shiftx = 20 / 25.4 * 72.0, shifty = 210 / 2 / 25.4 * 72.0)
-
-        marks_a4(OUT, OUT.pages[-2], cropmark = args.cropmark, punchmark = args.punchmark, foldmark = args.foldmark)
+    return pikepdf.unparse_content_stream(commands)
 
-    else:
-        # Zwei leere A3-Zielseiten anlegen.
-        OUT.add_blank_page(page_size = ( 420 / 25.4 * 72.0, 297 / 25.4 * 72.0 ))
-        OUT.add_blank_page(page_size = ( 420 / 25.4 * 72.0, 297 / 25.4 * 72.0 ))
 
-        placepage(OUT, OUT.pages[-2], PAGES_TC[i + 0], landscape = True, turn = False)
-        placepage(OUT, OUT.pages[-1], PAGES_TC[i + 1], landscape = True, turn = True)
+def placemarks(pdf, target, stream, forms = None):
+    if not stream:
+        return
 
-        marks_a3(OUT, OUT.pages[-2], cropmark = args.cropmark, punchmark = args.punchmark, foldmark = args.foldmark)
+    targetpage = pikepdf.Page(target)
 
-    p1 = pikepdf.Page(OUT.pages[-2])
-    p2 = pikepdf.Page(OUT.pages[-1])
-    p1.contents_coalesce()
-    p2.contents_coalesce()
-    p1.remove_unreferenced_resources()
-    p2.remove_unreferenced_resources()
+    key = ( 'marks', stream )
+    obj = forms.get(key) if forms is not None else None
+    if obj is None:
+        obj = pdf.make_stream(stream)
+        obj.Type = pikepdf.Name.XObject
+        obj.Subtype = pikepdf.Name.Form
+        obj.BBox = targetpage.mediabox
+        if forms is not None:
+            forms[key] = obj
 
+    name = targetpage.add_resource(obj, pikepdf.Name.XObject)
+    targetpage.contents_add(pikepdf.unparse_content_stream([ ( [ name ], pikepdf.Operator('Do') ) ]))
 
-for i in range(0, len(PAGES_MISC), 2):
-    # Zwei leere A4-Zielseiten anlegen.
-    OUT.add_blank_page(page_size = ( 297 / 25.4 * 72.0, 210 / 25.4 * 72.0 ))
-    OUT.add_blank_page(page_size = ( 297 / 25.4 * 72.0, 210 / 25.4 * 72.0 ))
 
-    pg1 = PAGES_MISC[i + 0]
-    pg2 = PAGES_MISC[i + 1]
 
-    if pg1 is None:
-        landscape1 = True
-        scale1 = 1.0
-        shifty1 = 0
-    else:
-        landscape1 = pg1['landscape']
-        scale1 = pg1['scale']
-        if landscape1:
-            shifty1 = 210 - scale1 * pg1['height']
+#
+# Ausschießen der AIP-Seiten für den Druck
+#
+# Die Seiten werden in drei Schritten verarbeitet.
+#
+# 1. `classify()` bestimmt das Format einer Seite. Innerhalb von `add()` werden
+#    die Formate aller Seiten eines Dokuments gemeinsam bestimmt.
+# 2. `add()` sortiert die Seiten eines Dokuments in Fächer je Format und fügt
+#    Leerseiten ein, damit Vorder- und Rückseiten zusammenpassen.
+# 3. `sheets()` platziert die Seiten fachweise auf Bögen und liefert jeden
+#    Bogen als Paar aus Vorder- und Rückseite, sobald er fertig ist.
+#
+# Ein `Imposer` hält keinen globalen Zustand. Mehrere Aufträge können daher im
+# selben Prozess oder parallel in mehreren Prozessen ausgeschossen werden.
+#
+# Die Fächer enthalten keine pikepdf-Objekte, sondern nur Dateiname und
+# Objektnummer jeder Seite. Die Quelldokumente werden beim Platzieren über
+# `pool` erneut geöffnet, sodass nicht alle Eingaben gleichzeitig geöffnet
+# bleiben müssen.
+#
+class Imposer:
+    def __init__(self,
+                 cropmark = False, punchmark = False, foldmark = False,
+                 tc_to_a4 = False, misc_to_a4 = False,
+                 pool = None):
+        self.cropmark   = cropmark
+        self.punchmark  = punchmark
+        self.foldmark   = foldmark
+        self.tc_to_a4   = tc_to_a4
+        self.misc_to_a4 = misc_to_a4
+
+        self.pool = pool if pool is not None else PdfPool()
+
+        self.buckets = { f: [] for f in FORMATS }
+
+        # Seitenbeschreibungen je Dokument in der Reihenfolge der Eingabe
+        self.documents = []
+
+        # Bereits kopierte Quellseiten des aktuellen Druckdokuments
+        self._forms = ( None, {} )
+
+
+    #
+    # Geometrie einer Seite bestimmen
+    #
+    # Zurückgegeben wird die Seitenbeschreibung ohne Format sowie die Größe der
+    # Zuschnittsbox in mm, nach der das Format bestimmt wird.
+    #
+    def measure(self, p, filename):
+        page = pikepdf.Page(p)
+
+        box = [ round(float(x) / 72.0 * 25.4) for x in page.trimbox ]
+        box_left   = min(box[0], box[2])
+        box_right  = max(box[0], box[2])
+        box_bottom = min(box[1], box[3])
+        box_top    = max(box[1], box[3])
+        box_width  = box_right - box_left
+        box_height = box_top   - box_bottom
+
+        width  = box_width
+        height = box_height
+
+        rotation = int(p.Rotate) if '/Rotate' in p else 0
+        if rotation % 180:
+            width, height = height, width
+
+        # Genau genommen gibt es keine reinen A4-Seiten. Stattdessen ist es
+        # wahrscheinlicher, dass die Zuschnittsbox der Seite falsch angelegt
+        # wurde (z.B. AD-2 EDDC-2). Wir kürzen die Seite ein, sodass eine auf
+        # A5 einklappbare Seite entsteht.
+        if ( width, height ) == ( 210, 297 ):
+            box_height = 277
+            box_top = box_bottom + box_height
+            trimbox = [ round(float(x) / 25.4 * 72.0) for x in [ box_left, box_bottom, box_right, box_top ] ]
         else:
-            shifty1 = 210 - scale1 * pg1['width']
+            trimbox = None
+
+        pagedict = \
+        {
+            'key':       ( filename, page.obj.objgen ),
+            'trimbox':   trimbox,
+            'width':     width,
+            'height':    height,
+            'rotation':  rotation,
+            'landscape': width > height,
+        }
+
+        return pagedict, ( box_width, box_height )
+
+
+    #
+    # Seite anhand ihres Papierformats (siehe `aip_lib.paper_format()`) einem Fach
+    # zuordnen
+    #
+    # Zurückgegeben wird die vervollständigte Seitenbeschreibung oder `None`,
+    # wenn die Seite ein unbekanntes Format hat.
+    #
+    def assign(self, pagedict, size, paper):
+        if paper in PAPER_BUCKETS:
+            pagedict['format'] = PAPER_BUCKETS[paper]
+
+        elif self.misc_to_a4:
+            pagedict['format'] = 'MISC'
+            if pagedict['landscape']:
+                pagedict['scale'] = min(1.0, 297.0 / pagedict['width'], 210.0 / pagedict['height'])
+            else:
+                pagedict['scale'] = min(1.0, 210.0 / pagedict['width'], 297.0 / pagedict['height'])
+
+        else:
+            sys.stderr.write(
+                "Seite %s von '%s' hat ein unbekanntes Format %dmm x %dmm. Seite bitte manuell drucken.\n" %
+                (
+                    self.pool.page(*pagedict['key']).label,
+                    pagedict['key'][0],
+                    size[0],
+                    size[1],
+                )
+            )
+            return None
+
+        return pagedict
+
+
+    #
+    # Format einer Seite bestimmen
+    #
+    # Zurückgegeben wird die Seitenbeschreibung für das Platzieren oder `None`,
+    # wenn die Seite ein unbekanntes Format hat. `filename` muss die Datei
+    # bezeichnen, aus der die Seite stammt.
+    #
+    def classify(self, p, filename):
+        pagedict, size = self.measure(p, filename)
+        paper, _ = paper_format(*size)
+        return self.assign(pagedict, size, paper)
+
+
+    #
+    # Seiten eines Dokuments einsortieren
+    #
+    # `pages` ist eine beliebige Folge von Seiten, `None` steht für eine
+    # Leerseite.
+    #
+    def add(self, filename, pages):
+        self.add_pages(None if p is None else ( filename, p ) for p in pages)
+
+
+    #
+    # Seiten aus mehreren Dateien als ein Dokument einsortieren
+    #
+    # `pages` ist eine Folge von Paaren aus Dateiname und Seite, `None` steht
+    # für eine Leerseite. Die Folge wird nur einmal durchlaufen und die Seiten
+    # werden nach dem Vermessen nicht mehr benötigt. Sie können daher bei
+    # Bedarf geöffnet werden, z.B. aus vielen einseitigen Dateien.
+    #
+    def add_pages(self, pages):
+        # Formate aller Seiten des Dokuments gemeinsam bestimmen
+        measured = [ None if s is None else self.measure(s[1], s[0]) for s in pages ]
+        papers   = iter(paper_formats([ m[1] for m in measured if m is not None ]))
+
+        document = []
+        for m in measured:
+            if m is None:
+                document.append(None)
+                continue
+
+            pagedict = self.assign(*m, next(papers)[0])
+            if pagedict is not None:
+                document.append(pagedict)
+
+        # Für `optimize()` vormerken
+        self.documents.append(document)
+
+        self._sort(document)
+
+
+    #
+    # Seitenbeschreibungen eines Dokuments auf die Fächer verteilen
+    #
+    # Mit `pack` werden Leerseiten vermieden, die nur der Aufteilung der AIP
+    # geschuldet sind (siehe `optimize()`). Die Reihenfolge der Seiten bleibt
+    # stets erhalten.
+    #
+    def _sort(self, document, pack = False):
+        pages_a5   = self.buckets['A5']
+        pages_a4n  = self.buckets['A4N']
+        pages_tc   = self.buckets['TC']
+        pages_misc = self.buckets['MISC']
+
+        currlist = None
+        nextlist = None
+
+        for pagedict in document:
+            if pagedict is None:
+                if currlist is not None:
+                    currlist.append(None)
+                continue
+
+            if pagedict['format'] == 'A5':
+                if currlist is pages_a4n and len(pages_a4n) % 2 and ( pack or not pagedict['landscape'] ):
+                    # Eine hochformatige A5-Seite, die auf eine kurze, ungerade
+                    # A4-Seite folgt, wird auf die Rückseite der A4-Seite gedruckt.
+                    nextlist = pages_a4n
+                else:
+                    nextlist = pages_a5
+
+            elif pagedict['format'] == 'A4N':
+                if currlist is pages_a4n and len(pages_a4n) % 2 and pages_a4n[-1] is not None and \
+                   pagedict['landscape'] != pages_a4n[-1]['landscape'] and not pack:
+                    # Folgt eine schmale A4-Seite im Hochformat auf eine schmale,
+                    # ungerade A4-Seite im Querformat oder umgekehrt (Querformat
+                    # folgt auf Hochformat), dann wird eine Leerseite eingefügt,
+                    # weil beide Seiten ungerade sind.
+                    pages_a4n.append(None)
+
+                nextlist = pages_a4n
+
+            elif pagedict['format'] == 'TC':
+                # Terminal Charts sind duplex, der Rest (Rollschemata) wird simplex
+                # aufgearbeitet.
+                if currlist is not pages_tc and len(pages_tc) % 2 != 0:
+                    pages_tc.append(None)
+                nextlist = pages_tc
+
+            elif pagedict['format'] == 'MISC':
+                # Eine Lücke lassen, wenn das Vorgängerformat nicht passt.
+                if len(pages_misc) % 2 and pages_misc[-1] is not None and not pack:
+                    lastpage = pages_misc[-1]
+                    if ( pagedict['width'], pagedict['height'] ) != ( lastpage['width'], lastpage['height'] ) and \
+                       ( pagedict['width'], pagedict['height'] ) != ( lastpage['height'], lastpage['width'] ):
+                        pages_misc.append(None)
+                nextlist = pages_misc
+
+            else:
+                nextlist = self.buckets[pagedict['format']]
+
+            # Beim Wechsel des Seitenformats ggf. eine Leerseite einfügen
+            if nextlist is not currlist and len(nextlist) % 2 != 0:
+                nextlist.append(None)
+
+            nextlist.append(pagedict)
+            currlist = nextlist
+
+        # Sicherstellen, dass wir bei jedem neuen Dokument mit einer ungeraden
+        # Seite beginnen.
+        for bucket in self.buckets.values():
+            if len(bucket) % 2 != 0:
+                bucket.append(None)
+
+
+    #
+    # Fächer auf volle Bögen auffüllen. A5-Seiten werden zu viert auf einem
+    # Bogen platziert, alle anderen Formate zu zweit.
+    #
+    def pad(self):
+        for fmt, bucket in self.buckets.items():
+            bucket.extend((-len(bucket) % PAGES_PER_SHEET[fmt]) * [ None ])
+
+
+    #
+    # Kennzahlen je Fach: Seiten, Leerseiten und Bögen nach dem Auffüllen
+    #
+    def stats(self):
+        result = {}
+        for fmt, bucket in self.buckets.items():
+            blanks = bucket.count(None)
+            result[fmt] = \
+            {
+                'pages':  len(bucket) - blanks,
+                'blanks': blanks + (-len(bucket) % PAGES_PER_SHEET[fmt]),
+                'sheets': -(-len(bucket) // PAGES_PER_SHEET[fmt]),
+            }
+        return result
+
+
+    #
+    # Bogenzahl verringern
+    #
+    # Jedes Blatt trägt zwei aufeinanderfolgende Seiten, und jedes Dokument
+    # beginnt auf einer Vorderseite. Leerseiten, die die Lesereihenfolge oder
+    # ausdrücklich angeforderte Leerseiten (`{}`) betreffen, sind daher
+    # notwendig. Einige Leerseiten bilden dagegen nur die Blattaufteilung der
+    # AIP nach und werden beim erneuten Einsortieren aller Dokumente vermieden:
+    #
+    # - Auf die Rückseite einer ungeraden, schmalen A4-Seite wird auch eine
+    #   folgende A5-Seite im Querformat gedruckt (gedreht).
+    # - Schmale A4-Seiten im Hoch- und Querformat teilen sich ein Blatt.
+    # - Sonstige Formate unterschiedlicher Größe teilen sich ein Blatt, da sie
+    #   ohnehin auf A4 verkleinert und nicht beschnitten werden.
+    #
+    # Zurückgegeben werden die Kennzahlen vor und nach der Optimierung.
+    #
+    def optimize(self):
+        before = self.stats()
+
+        self.buckets = { f: [] for f in FORMATS }
+        for document in self.documents:
+            self._sort(document, pack = True)
+
+        return before, self.stats()
 
-    if pg2 is None:
-        landscape2 = True
-        scale2 = 1.0
-    else:
-        landscape2 = pg2['landscape']
-        scale2 = pg2['scale']
 
-    placepage(OUT, OUT.pages[-2], pg1, landscape = landscape1, turn = False, scale = scale1, shifty = shifty1 / 25.4 * 72.0)
-    placepage(OUT, OUT.pages[-1], pg2, landscape = landscape2, turn = True,  scale = scale2)
+    #
+    # Formulare des Druckdokuments
+    #
+    # Quellseiten werden anhand von Dateiname und Objektnummer wiedererkannt
+    # und je Druckdokument nur einmal kopiert. Wiederholte Seiten und die
+    # Zusatzmarken verweisen auf dasselbe Formular.
+    #
+    def _formcache(self, pdf):
+        if self._forms[0] is not pdf:
+            self._forms = ( pdf, {} )
+        return self._forms[1]
+
+
+    def _place(self, pdf, target, source, **kwargs):
+        if source is None:
+            return
+
+        page = self.pool.page(*source['key'])
+        if source['trimbox'] is not None:
+            page.trimbox = source['trimbox']
+
+        placepage(pdf, target, dict(source, page = page.obj), forms = self._formcache(pdf), **kwargs)
+
+
+    def _marks(self, marks, pdf, page):
+        stream = marks(cropmark = self.cropmark, punchmark = self.punchmark, foldmark = self.foldmark)
+        placemarks(pdf, page, stream, forms = self._formcache(pdf))
+
+
+    def _new_sheet(self, pdf, size):
+        # Die neuen Seiten direkt verwenden. Der Zugriff über `pdf.pages[-1]`
+        # durchsucht bei jedem Bogen den ganzen Seitenbaum.
+        front = pdf.add_blank_page(page_size = size)
+        back  = pdf.add_blank_page(page_size = size)
+        return front, back
+
+
+    def _finish_sheet(self, front, back):
+        p1 = pikepdf.Page(front)
+        p2 = pikepdf.Page(back)
+        p1.contents_coalesce()
+        p2.contents_coalesce()
+        return p1, p2
+
+
+    def _sheets_a5(self, pdf, pages):
+        for i in range(0, len(pages), 4):
+            front, back = self._new_sheet(pdf, SHEET_A4)
+
+            self._place(pdf, front, pages[i + 0], turn = True)
+            self._place(pdf, back,  pages[i + 1], turn = False)
+            self._place(pdf, back,  pages[i + 2], turn = False, shiftx = 148 / 25.4 * 72.0)
+            self._place(pdf, front, pages[i + 3], turn = True,  shiftx = 148 / 25.4 * 72.0)
+
+            self._marks(marks_a5, pdf, front)
+
+            yield self._finish_sheet(front, back)
+
+
+    def _sheets_a4n(self, pdf, pages):
+        for i in range(0, len(pages), 2):
+            front, back = self._new_sheet(pdf, SHEET_A4)
+
+            # A5-Seiten auf der Rückseite einer A4-Seite im Hochformat belassen.
+            pg2 = pages[i + 1]
+            landscape = pg2 is None or pg2['format'] != 'A5'
+
+            self._place(pdf, front, pages[i + 0], landscape = True,      turn = False)
+            self._place(pdf, back,  pages[i + 1], landscape = landscape, turn = True)
+
+            self._marks(marks_a4, pdf, front)
 
-    p1 = pikepdf.Page(OUT.pages[-2])
-    p2 = pikepdf.Page(OUT.pages[-1])
-    p1.contents_coalesce()
-    p2.contents_coalesce()
-    p1.remove_unreferenced_resources()
-    p2.remove_unreferenced_resources()
+            yield self._finish_sheet(front, back)
+
+
+    def _sheets_a4(self, pdf, pages):
+        for i in range(0, len(pages), 2):
+            front, back = self._new_sheet(pdf, SHEET_A4)
 
+            self._place(pdf, front, pages[i + 0], landscape = True, turn = False)
+            self._place(pdf, back,  pages[i + 1], landscape = True, turn = True)
+
+            self._marks(marks_a4, pdf, front)
+
+            yield self._finish_sheet(front, back)
+
+
+    def _sheets_tc(self, pdf, pages):
+        for i in range(0, len(pages), 2):
+            if self.tc_to_a4:
+                front, back = self._new_sheet(pdf, SHEET_A4)
+
+                #
+                # Format der TC-Seite
+                # - Lochrand:         25mm
+                # - nutzbare Breite: 355mm
+                # - nutzbare Höhe:   297mm
+                #
+                # Format der A4-Seite
+                # - Lochrand:         17mm
+                # - nutzbare Breite: 260mm
+                # - nutzbare Höhe:   210mm
+                #
+                # Skalierung:
+                # - Breite 260mm / 355mm = 0.732
+                # - Höhe   210mm / 297mm = 0.707 = 1 / sqrt(2)
+                #
+                # Die Höhe ist bschränkend. Es ist keine Verschiebung in y-Richtung
+                # notwendig.
+                #
+                self._place(pdf, front, pages[i + 0], landscape = True, turn = False,
+                    offx = 25 / 25.4 * 72.0, offy = 297 / 2 / 25.4 * 72.0,
+                    scale = 0.68,
+                    shiftx = 20 / 25.4 * 72.0, shifty = 210 / 2 / 25.4 * 72.0)
+                self._place(pdf, back, pages[i + 1], landscape = True, turn = True,
+                    offx = 25 / 25.4 * 72.0, offy = 297 / 2 / 25.4 * 72.0,
+                    scale = 0.68,
+                    shiftx = 20 / 25.4 * 72.0, shifty = 210 / 2 / 25.4 * 72.0)
+
+                self._marks(marks_a4, pdf, front)
+
+            else:
+                front, back = self._new_sheet(pdf, SHEET_A3)
+
+                self._place(pdf, front, pages[i + 0], landscape = True, turn = False)
+                self._place(pdf, back,  pages[i + 1], landscape = True, turn = True)
+
+                self._marks(marks_a3, pdf, front)
+
+            yield self._finish_sheet(front, back)
+
+
+    def _sheets_misc(self, pdf, pages):
+        for i in range(0, len(pages), 2):
+            front, back = self._new_sheet(pdf, SHEET_A4)
+
+            pg1 = pages[i + 0]
+            pg2 = pages[i + 1]
+
+            if pg1 is None:
+                landscape1 = True
+                scale1 = 1.0
+                shifty1 = 0
+            else:
+                landscape1 = pg1['landscape']
+                scale1 = pg1['scale']
+                if landscape1:
+                    shifty1 = 210 - scale1 * pg1['height']
+                else:
+                    shifty1 = 210 - scale1 * pg1['width']
+
+            if pg2 is None:
+                landscape2 = True
+                scale2 = 1.0
+            else:
+                landscape2 = pg2['landscape']
+                scale2 = pg2['scale']
+
+            self._place(pdf, front, pg1, landscape = landscape1, turn = False, scale = scale1, shifty = shifty1 / 25.4 * 72.0)
+            self._place(pdf, back,  pg2, landscape = landscape2, turn = True,  scale = scale2)
+
+            yield self._finish_sheet(front, back)
+
+
+    #
+    # Bögen erzeugen
+    #
+    # Die Bögen werden in `pdf` angelegt und einzeln geliefert. Ohne Angabe von
+    # `formats` werden alle Fächer in der Reihenfolge von `FORMATS`
+    # ausgeschossen.
+    #
+    def sheets(self, pdf, formats = None):
+        self.pad()
+
+        generators = \
+        {
+            'A5':   self._sheets_a5,
+            'A4N':  self._sheets_a4n,
+            'A4':   self._sheets_a4,
+            'TC':   self._sheets_tc,
+            'MISC': self._sheets_misc,
+        }
+
+        for fmt in formats or FORMATS:
+            yield from generators[fmt](pdf, self.buckets[fmt])
+
+
+    #
+    # Dokumente vollständig ausschießen
+    #
+    # `documents` liefert Paare aus Dateiname und Seitenfolge. Zurückgegeben
+    # wird das Druckdokument, das optional unter `output` gespeichert wird.
+    #
+    def impose(self, documents, output = None):
+        for filename, pages in documents:
+            self.add(filename, pages)
+
+        pdf = pikepdf.Pdf.new()
+        for sheet in self.sheets(pdf):
+            pass
+
+        if output is not None and len(pdf.pages):
+            pdf.save(output)
+
+        return pdf
+
+
+
+    def options(self):
+        return \
+        {
+            'cropmark':   self.cropmark,
+            'punchmark':  self.punchmark,
+            'foldmark':   self.foldmark,
+            'tc_to_a4':   self.tc_to_a4,
+            'misc_to_a4': self.misc_to_a4,
+        }
+
+
+    #
+    # Einsortierte Seiten ausschießen und speichern
+    #
+    # Mit `jobs` > 1 werden die Fächer in Teilaufträge zu höchstens
+    # `chunksize` Bögen zerlegt. Diese werden in eigenen Prozessen ausgeschossen
+    # und anschließend in der ursprünglichen Reihenfolge zusammengeführt.
+    # Zurückgegeben wird die Zahl der Bögen.
+    #
+    def write(self, output, jobs = 1, chunksize = None):
+        self.pad()
+
+        if jobs <= 1:
+            pdf = pikepdf.Pdf.new()
+            sheets = sum(1 for _ in self.sheets(pdf))
+            if sheets:
+                pdf.save(output)
+            return sheets
+
+        total = sum(len(bucket) // PAGES_PER_SHEET[fmt] for fmt, bucket in self.buckets.items())
+        if chunksize is None:
+            chunksize = max(1, -(-total // ( 2 * jobs )))
+
+        chunks = []
+        for fmt in FORMATS:
+            step = chunksize * PAGES_PER_SHEET[fmt]
+            bucket = self.buckets[fmt]
+            for i in range(0, len(bucket), step):
+                chunks.append(( fmt, bucket[i : i + step] ))
+
+        if not chunks:
+            return 0
+
+        outdir = os.path.dirname(os.path.abspath(output))
+        with tempfile.TemporaryDirectory(dir = outdir) as tmpdir:
+            chunkfiles = [ os.path.join(tmpdir, 'chunk-%04d.pdf' % idx) for idx in range(len(chunks)) ]
+
+            with concurrent.futures.ProcessPoolExecutor(max_workers = jobs) as executor:
+                futures = [ executor.submit(impose_chunk, self.options(), self.pool.access_mode, fmt, pages, f) for ( fmt, pages ), f in zip(chunks, chunkfiles) ]
+                for future in futures:
+                    future.result()
+
+            merge_pdfs(chunkfiles, output)
+
+        return total
+
+
+
+#
+# Teilauftrag in einem Arbeitsprozess ausschießen. Die Seitenbeschreibungen
+# enthalten nur Dateinamen und Objektnummern und lassen sich daher an den
+# Arbeitsprozess übergeben.
+#
+def impose_chunk(options, access_mode, fmt, pages, output):
+    imposer = Imposer(pool = PdfPool(access_mode = access_mode), **options)
+    imposer.buckets[fmt] = list(pages)
+
+    pdf = pikepdf.Pdf.new()
+    for sheet in imposer.sheets(pdf, [ fmt ]):
+        pass
+    pdf.save(output)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+            description = "AIP-PDFs für Druck ausschießen"
+        )
+
+    parser.add_argument(
+        '--output',
+        metavar = 'FILE',
+        type = str,
+        required = True,
+        help = 'Ausgabedatei')
+
+    parser.add_argument(
+        '--cropmark',
+        action = 'store_true',
+        help = 'Schnitmarken zeichnen')
+
+    parser.add_argument(
+        '--punchmark',
+        action = 'store_true',
+        help = 'Lochmarken zeichnen')
+
+    parser.add_argument(
+        '--foldmark',
+        action = 'store_true',
+        help = 'Faltmarken zeichnen')
+
+    parser.add_argument(
+        '--tc-to-a4',
+        action = 'store_true',
+        help = 'Terminal Charts auf A4 verkleinern')
+
+    parser.add_argument(
+        '--misc-to-a4',
+        action = 'store_true',
+        help = 'Unbekannte Formate auf A4 verkleinern')
+
+    parser.add_argument(
+        '--optimize',
+        action = 'store_true',
+        help = 'Seiten dichter auf Blätter verteilen und Bogenzahl vor und nach der Optimierung ausgeben')
+
+    parser.add_argument(
+        '--access-mode',
+        choices = ACCESS_MODES,
+        default = 'default',
+        help = 'Zugriffsart auf Eingabedateien (mmap teilt den Seitencache zwischen Prozessen)')
+
+    parser.add_argument(
+        '--jobs',
+        metavar = 'N',
+        type = int,
+        default = 1,
+        help = 'Anzahl paralleler Prozesse')
+
+    parser.add_argument(
+        'pdfs',
+        metavar = 'PDF',
+        type = str,
+        nargs = '+',
+        help = 'PDF-Dateien')
+
+    args = parser.parse_args()
+
+    imposer = Imposer(
+        cropmark   = args.cropmark,
+        punchmark  = args.punchmark,
+        foldmark   = args.foldmark,
+        tc_to_a4   = args.tc_to_a4,
+        misc_to_a4 = args.misc_to_a4,
+        pool       = PdfPool(access_mode = args.access_mode))
+
+    for filename, pages in load_pages(args.pdfs, imposer.pool):
+        imposer.add(filename, pages)
+
+    if args.optimize:
+        before, after = imposer.optimize()
+
+        print("%-6s  %6s  %14s  %14s" % ( "Format", "Seiten", "Leerseiten", "Bögen" ))
+        for fmt in FORMATS + [ None ]:
+            if fmt is None:
+                b = { k: sum(s[k] for s in before.values()) for k in [ 'pages', 'blanks', 'sheets' ] }
+                a = { k: sum(s[k] for s in after.values())  for k in [ 'pages', 'blanks', 'sheets' ] }
+                label = "Summe"
+            else:
+                b = before[fmt]
+                a = after[fmt]
+                label = fmt
+
+            print("%-6s  %6d  %5d -> %5d  %5d -> %5d" %
+                (
+                    label,
+                    b['pages'],
+                    b['blanks'],
+                    a['blanks'],
+                    b['sheets'],
+                    a['sheets'],
+                )
+            )
 
-if len(OUT.pages):
-    OUT.save(args.output)
+    imposer.write(args.output, jobs = args.jobs)